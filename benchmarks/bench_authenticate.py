@@ -0,0 +1,252 @@
+"""
+Benchmark FreeIpaRpcAuthBackend.authenticate against local FreeIPA stand-ins.
+
+Reports throughput, p50/p99 latency, django queries and FreeIPA calls per
+authentication for each concurrency level. Runs fully offline:
+
+    python benchmarks/bench_authenticate.py --latency 20 --concurrency 1,8,32
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ipa_standin import StandInServer, generate_certificate  # noqa: E402
+
+
+def percentile(values, p):
+    values = sorted(values)
+    if not values:
+        return 0.0
+    index = min(len(values) - 1, int(round(p / 100.0 * (len(values) - 1))))
+    return values[index]
+
+
+def parse_setting(value):
+    name, _, raw = value.partition('=')
+    try:
+        parsed = json.loads(raw)
+    except ValueError:
+        parsed = raw
+    if not name.startswith('FREEIPA_AUTH_'):
+        name = 'FREEIPA_AUTH_' + name
+    return name, parsed
+
+
+def configure_django(directory, servers, cert_path, overrides, verbose):
+    import django
+    from django.conf import settings
+
+    settings.configure(
+        SECRET_KEY='benchmark',
+        INSTALLED_APPS=[
+            'django.contrib.auth',
+            'django.contrib.contenttypes',
+            'django.contrib.sessions',
+            'freeipa_auth',
+        ],
+        DATABASES={
+            'default': {
+                'ENGINE': 'django.db.backends.sqlite3',
+                'NAME': os.path.join(directory, 'bench.sqlite3'),
+                'OPTIONS': {'timeout': 60},
+            }
+        },
+        CACHES={
+            'default': {
+                'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            }
+        },
+        AUTHENTICATION_BACKENDS=[
+            'freeipa_auth.backends.FreeIpaRpcAuthBackend',
+        ],
+        FREEIPA_AUTH_SERVERS=servers,
+        FREEIPA_AUTH_SSL_VERIFY=cert_path,
+        FREEIPA_AUTH_UPDATE_USER_GROUPS=True,
+        LOGGING={
+            'version': 1,
+            'disable_existing_loggers': False,
+            'loggers': {
+                # Failovers are expected when a failure rate is set
+                'freeipa_auth': {'level': 'DEBUG' if verbose else 'CRITICAL',
+                                 'propagate': verbose},
+            },
+        },
+        **overrides
+    )
+    django.setup()
+
+    from django.db.backends.signals import connection_created
+
+    # Let readers proceed while a worker writes
+    def use_wal(sender, connection, **kwargs):
+        if connection.vendor == 'sqlite':
+            connection.cursor().execute('PRAGMA journal_mode=WAL')
+    connection_created.connect(use_wal)
+
+    from django.core.management import call_command
+    call_command('migrate', verbosity=0)
+
+    from django.contrib.auth.models import Group
+    for name in ('admin', 'bench_group'):
+        Group.objects.get_or_create(name=name)
+
+
+class QueryCounter(object):
+
+    def __init__(self):
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, execute, sql, params, many, context):
+        with self._lock:
+            self.count += 1
+        return execute(sql, params, many, context)
+
+
+def run_level(concurrency, requests, users, password, queries):
+    from django.db import close_old_connections, connection
+    from freeipa_auth.backends import FreeIpaRpcAuthBackend
+
+    errors = []
+
+    def authenticate(index):
+        username = 'user{index}'.format(index=index % users)
+        start = time.perf_counter()
+        try:
+            with connection.execute_wrapper(queries):
+                # A backend per call, as django.contrib.auth.authenticate does
+                user = FreeIpaRpcAuthBackend().authenticate(
+                    username=username, password=password
+                )
+            ok = user is not None
+        except Exception as e:
+            errors.append(e)
+            ok = False
+        finally:
+            close_old_connections()
+        return time.perf_counter() - start, ok
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(authenticate, range(requests)))
+    elapsed = time.perf_counter() - start
+
+    latencies = [latency for latency, ok in results]
+    return {
+        'elapsed': elapsed,
+        'latencies': latencies,
+        'errors': sum(1 for latency, ok in results if not ok),
+        'first_error': repr(errors[0]) if errors else None,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--concurrency', default='1,4,16',
+                        help='comma separated concurrency levels')
+    parser.add_argument('--requests', type=int, default=200,
+                        help='authentications per concurrency level')
+    parser.add_argument('--users', type=int, default=50,
+                        help='distinct usernames cycled through')
+    parser.add_argument('--servers', type=int, default=1,
+                        help='number of stand-in servers')
+    parser.add_argument('--latency', type=float, default=5.0,
+                        help='milliseconds added to every response')
+    parser.add_argument('--jitter', type=float, default=0.0,
+                        help='up to this many extra milliseconds at random')
+    parser.add_argument('--failure-rate', type=float, default=0.0,
+                        help='share of requests dropped by the first server')
+    parser.add_argument('--warmup', type=int, default=None,
+                        help='sequential authentications before measuring, '
+                             'defaults to one per user')
+    parser.add_argument('--setting', action='append', default=[],
+                        metavar='NAME=VALUE',
+                        help='FREEIPA_AUTH_ setting override, value as JSON')
+    parser.add_argument('--json', action='store_true',
+                        help='print results as JSON')
+    parser.add_argument('--verbose', action='store_true',
+                        help='show freeipa_auth log output')
+    options = parser.parse_args(argv)
+
+    password = 'secret'
+    directory = tempfile.mkdtemp(prefix='freeipa-bench-')
+    cert_path, key_path = generate_certificate(directory)
+    servers = [
+        StandInServer(
+            cert_path, key_path,
+            latency=options.latency / 1000.0,
+            jitter=options.jitter / 1000.0,
+            failure_rate=options.failure_rate if index == 0 else 0.0,
+            password=password,
+            users=options.users
+        ).start()
+        for index in range(options.servers)
+    ]
+
+    try:
+        configure_django(directory, [server.address for server in servers],
+                         cert_path, dict(map(parse_setting, options.setting)),
+                         options.verbose)
+
+        # Concurrent first syncs would mostly measure SQLite write locks
+        warmup = options.users if options.warmup is None else options.warmup
+        if warmup:
+            run_level(1, warmup, options.users, password, QueryCounter())
+
+        report = []
+        for concurrency in [int(level) for level in
+                            options.concurrency.split(',')]:
+            for server in servers:
+                server.reset_counts()
+            queries = QueryCounter()
+            result = run_level(concurrency, options.requests, options.users,
+                               password, queries)
+            ipa_calls = sum(
+                count for server in servers
+                for name, count in server.counts.items()
+                if name.startswith('/')
+            )
+            report.append({
+                'concurrency': concurrency,
+                'requests': options.requests,
+                'throughput': options.requests / result['elapsed'],
+                'p50_ms': percentile(result['latencies'], 50) * 1000,
+                'p99_ms': percentile(result['latencies'], 99) * 1000,
+                'queries_per_auth': queries.count / float(options.requests),
+                'ipa_requests_per_auth': ipa_calls / float(options.requests),
+                'errors': result['errors'],
+            })
+            if result['first_error']:
+                print('concurrency {concurrency}: {error}'.format(
+                    concurrency=concurrency, error=result['first_error']),
+                    file=sys.stderr)
+    finally:
+        for server in servers:
+            server.stop()
+        shutil.rmtree(directory, ignore_errors=True)
+
+    if options.json:
+        print(json.dumps(report, indent=2))
+        return
+
+    header = ('{:>11} {:>8} {:>10} {:>9} {:>9} {:>11} {:>10} {:>6}')
+    print(header.format('concurrency', 'requests', 'auth/s', 'p50 ms',
+                        'p99 ms', 'queries/auth', 'ipa/auth', 'errors'))
+    row = ('{concurrency:>11} {requests:>8} {throughput:>10.1f} '
+           '{p50_ms:>9.1f} {p99_ms:>9.1f} {queries_per_auth:>11.1f} '
+           '{ipa_requests_per_auth:>10.2f} {errors:>6}')
+    for entry in report:
+        print(row.format(**entry))
+
+
+if __name__ == '__main__':
+    main()
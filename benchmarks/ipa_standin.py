@@ -0,0 +1,295 @@
+"""
+Local HTTPS stand-in for the FreeIPA endpoints used by freeipa_auth.
+
+Serves /ipa/session/login_password and /ipa/session/json with configurable
+latency and failure rate, and needs no network access.
+"""
+import datetime
+import ipaddress
+import json
+import os
+import random
+import shutil
+import ssl
+import subprocess
+import tempfile
+import threading
+import time
+import uuid
+
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+
+def generate_certificate(directory, host='127.0.0.1'):
+    """
+    Write a self signed certificate and key for host
+    :param directory: directory to write cert.pem and key.pem to
+    :param host: ip address or host name the certificate is valid for
+    :return: tuple of cert path and key path
+    """
+    cert_path = os.path.join(directory, 'cert.pem')
+    key_path = os.path.join(directory, 'key.pem')
+
+    try:
+        from cryptography import x509
+        from cryptography.hazmat.primitives import hashes, serialization
+        from cryptography.hazmat.primitives.asymmetric import rsa
+        from cryptography.x509.oid import NameOID
+    except ImportError:
+        if shutil.which('openssl') is None:
+            raise RuntimeError(
+                "cryptography or the openssl binary is required to generate "
+                "the stand-in server certificate"
+            )
+        san = 'IP:{host}' if _is_ip(host) else 'DNS:{host}'
+        subprocess.check_call([
+            'openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes',
+            '-days', '1', '-subj', '/CN={host}'.format(host=host),
+            '-addext', 'subjectAltName=' + san.format(host=host),
+            '-keyout', key_path, '-out', cert_path
+        ], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        return cert_path, key_path
+
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, host)])
+    if _is_ip(host):
+        alt_name = x509.IPAddress(ipaddress.ip_address(host))
+    else:
+        alt_name = x509.DNSName(host)
+    now = datetime.datetime.now(datetime.timezone.utc)
+    cert = (
+        x509.CertificateBuilder()
+        .subject_name(name)
+        .issuer_name(name)
+        .public_key(key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(now - datetime.timedelta(minutes=5))
+        .not_valid_after(now + datetime.timedelta(days=1))
+        .add_extension(x509.SubjectAlternativeName([alt_name]), critical=False)
+        .add_extension(x509.BasicConstraints(ca=True, path_length=None),
+                       critical=True)
+        .sign(key, hashes.SHA256())
+    )
+    with open(key_path, 'wb') as f:
+        f.write(key.private_bytes(
+            serialization.Encoding.PEM,
+            serialization.PrivateFormat.TraditionalOpenSSL,
+            serialization.NoEncryption()
+        ))
+    with open(cert_path, 'wb') as f:
+        f.write(cert.public_bytes(serialization.Encoding.PEM))
+    return cert_path, key_path
+
+
+def _is_ip(host):
+    try:
+        ipaddress.ip_address(host)
+    except ValueError:
+        return False
+    return True
+
+
+def user_record(uid, groups):
+    """A user_show record as returned with all=True"""
+    return {
+        'uid': [uid],
+        'givenname': ['Bench'],
+        'sn': [uid.title()],
+        'mail': ['{uid}@example.com'.format(uid=uid)],
+        'memberof_group': list(groups),
+        'nsaccountlock': False,
+        'modifytimestamp': [{'__datetime__': '20240101000000Z'}],
+    }
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        server = self.server
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        server.count(self.path)
+
+        delay = server.latency + random.uniform(0, server.jitter)
+        if delay:
+            time.sleep(delay)
+        if random.random() < server.failure_rate:
+            # Drop the connection, the client sees a connection error
+            self.close_connection = True
+            return
+
+        if self.path == '/ipa/session/login_password':
+            self.login(parse_qs(body.decode()))
+        elif self.path == '/ipa/session/json':
+            self.rpc(json.loads(body.decode()))
+        else:
+            self.respond(404, b'')
+
+    def respond(self, status, body, content_type='application/json',
+                headers=None):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def login(self, form):
+        user = form.get('user', [''])[0]
+        password = form.get('password', [''])[0]
+        if not user or password != self.server.password:
+            self.respond(
+                401, b'', content_type='text/plain',
+                headers={'X-IPA-Rejection-Reason': 'invalid-password'}
+            )
+            return
+        token = uuid.uuid4().hex
+        self.server.sessions[token] = user
+        self.respond(200, b'', content_type='text/plain', headers={
+            'Set-Cookie': 'ipa_session=MagBearerToken={token}; Path=/ipa; '
+                          'Secure; HttpOnly'.format(token=token)
+        })
+
+    def session_user(self):
+        cookie = self.headers.get('Cookie', '')
+        for part in cookie.split(';'):
+            name, _, value = part.strip().partition('=')
+            if name == 'ipa_session':
+                return self.server.sessions.get(
+                    value.replace('MagBearerToken=', ''))
+        return None
+
+    def rpc(self, call):
+        if self.session_user() is None:
+            self.respond(401, b'', content_type='text/plain')
+            return
+        result = self.call(call['method'], call['params'][0],
+                           call['params'][1])
+        self.respond(200, json.dumps({
+            'result': result, 'error': None, 'id': call.get('id'),
+            'principal': 'admin@EXAMPLE.COM', 'version': '4.9.8'
+        }).encode())
+
+    def call(self, method, args, options):
+        server = self.server
+        server.count('rpc:' + method)
+        if method == 'user_show':
+            return {'result': user_record(args[0], server.groups),
+                    'value': args[0], 'summary': None}
+        if method == 'batch':
+            return {'count': len(args), 'results': [
+                dict(self.call(sub['method'], sub['params'][0],
+                               sub['params'][1]), error=None)
+                for sub in args
+            ]}
+        if method == 'user_find':
+            uids = ['user{index}'.format(index=index)
+                    for index in range(server.users)]
+            if options.get('pkey_only'):
+                result = [{'uid': [uid]} for uid in uids]
+            else:
+                result = [user_record(uid, server.groups) for uid in uids]
+            return {'result': result, 'count': len(result),
+                    'truncated': False}
+        if method == 'group_find':
+            result = [{'cn': [group]} for group in server.groups]
+            return {'result': result, 'count': len(result),
+                    'truncated': False}
+        return {'result': None}
+
+
+class StandInServer(ThreadingHTTPServer):
+
+    """FreeIPA stand-in over HTTPS on a random local port"""
+
+    daemon_threads = True
+
+    def __init__(self, cert_path, key_path, latency=0.0, jitter=0.0,
+                 failure_rate=0.0, password='secret', users=100,
+                 groups=('admin', 'bench_group'), host='127.0.0.1'):
+        """
+        :param cert_path: certificate the server presents
+        :param key_path: key of the certificate
+        :param latency: seconds added to every response
+        :param jitter: up to this many extra seconds added at random
+        :param failure_rate: share of requests answered by dropping the
+            connection
+        :param password: password accepted for every user
+        :param users: number of users listed by user_find
+        :param groups: groups every user is a member of
+        """
+        super(StandInServer, self).__init__((host, 0), StandInHandler)
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        context.load_cert_chain(cert_path, key_path)
+        self.socket = context.wrap_socket(self.socket, server_side=True)
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.password = password
+        self.users = users
+        self.groups = list(groups)
+        self.sessions = {}
+        self.counts = Counter()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def address(self):
+        host, port = self.server_address[:2]
+        return '{host}:{port}'.format(host=host, port=port)
+
+    def count(self, name):
+        with self._lock:
+            self.counts[name] += 1
+
+    def reset_counts(self):
+        with self._lock:
+            self.counts.clear()
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever,
+                                        daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='milliseconds added to every response')
+    parser.add_argument('--failure-rate', type=float, default=0.0)
+    parser.add_argument('--password', default='secret')
+    options = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    cert_path, key_path = generate_certificate(directory)
+    server = StandInServer(cert_path, key_path,
+                           latency=options.latency / 1000.0,
+                           failure_rate=options.failure_rate,
+                           password=options.password)
+    print('Serving FreeIPA stand-in on https://{address} (cert {cert})'
+          .format(address=server.address, cert=cert_path))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,5 @@
+import django
+
+# Django 3.2 and later find the app config on their own
+if django.VERSION < (3, 2):
+    default_app_config = 'freeipa_auth.apps.FreeIpaAuthConfig'
@@ -0,0 +1,15 @@
+from django.apps import AppConfig
+
+
+class FreeIpaAuthConfig(AppConfig):
+
+    name = 'freeipa_auth'
+    verbose_name = 'FreeIPA Auth'
+
+    def ready(self):
+        from freeipa_auth import ipa_sessions, permissions
+        from freeipa_auth.settings import get_settings
+        permissions.connect_signals()
+        ipa_sessions.connect_signals()
+        # Load and validate settings once at startup
+        get_settings()
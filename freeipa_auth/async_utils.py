@@ -0,0 +1,284 @@
+import asyncio
+import logging
+import threading
+import weakref
+
+import requests
+
+from freeipa_auth.freeipa_utils import (
+    IPA_SESSION_COOKIE, USER_SHOW_PARAMS, FreeIpaSessionExpired,
+    build_batch_post_data, build_session_payload, get_request_template,
+    decode_response
+)
+from freeipa_auth.metrics import timed
+
+try:
+    import httpx
+except ImportError:  # pragma: no cover
+    httpx = None
+
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncConnectionPoolRegistry(object):
+
+    """
+    Process wide registry of pooled httpx transports, one per freeipa server
+    and event loop. Transports hold the connection pools and are shared by
+    every AsyncFreeIpaSession, while cookies stay on each per login client.
+    """
+
+    def __init__(self):
+        self._transports = weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+
+    def get_transport(self, host_server, ssl_verify=False, pool_size=10,
+                      keep_alive=True):
+        """
+        Returns the shared transport for a server on the running event loop
+        :param host_server: string
+        :param ssl_verify: ssl cert path or bool
+        :param pool_size: max number of pooled connections to the server
+        :param keep_alive: keep idle connections open for reuse
+        :return: httpx.AsyncHTTPTransport
+        """
+        loop = asyncio.get_running_loop()
+        key = (host_server, ssl_verify, pool_size, keep_alive)
+        with self._lock:
+            transports = self._transports.setdefault(loop, {})
+            transport = transports.get(key)
+            if transport is None:
+                limits = httpx.Limits(
+                    max_connections=pool_size,
+                    max_keepalive_connections=pool_size if keep_alive else 0
+                )
+                transport = httpx.AsyncHTTPTransport(
+                    verify=ssl_verify, limits=limits
+                )
+                transports[key] = transport
+        return transport
+
+    def clear(self):
+        with self._lock:
+            self._transports = weakref.WeakKeyDictionary()
+
+
+async_connection_pools = AsyncConnectionPoolRegistry()
+
+
+class AsyncFreeIpaSession(object):
+
+    """
+    Asyncio FreeIPA session constructor for RPC authentication.
+    Mirrors FreeIpaSession on top of httpx, which must be installed.
+    Transport errors are raised as their requests counterparts.
+    """
+
+    def __init__(self, host_server, ssl_verify=False, server_timeout=5,
+                 pool_size=10, keep_alive=True,
+                 user_show_params=USER_SHOW_PARAMS):
+        if httpx is None:
+            raise ImportError(
+                "httpx is required for async FreeIPA authentication"
+            )
+
+        self.host_server = host_server
+        self.template = get_request_template(host_server)
+        self.user_show_params = user_show_params
+        self.ssl_verify = ssl_verify
+        self.user = None
+        self.user_is_authenticated = False
+        self.server_timeout = server_timeout
+        self.cancelled = False
+
+        # user_show record, fetched by load_user_data
+        self._user_data = None
+        # Coroutine function taking this session and returning its
+        # user_data, defaults to a user_show on this session
+        self.user_data_loader = None
+
+        # Extra calls sent along with user_show when user_data is fetched
+        self.post_login_calls = []
+        self.post_login_results = []
+
+        # The client is never closed as that would close the shared
+        # transport along with it
+        self.session = httpx.AsyncClient(
+            transport=async_connection_pools.get_transport(
+                host_server, ssl_verify, pool_size, keep_alive
+            ),
+            timeout=server_timeout
+        )
+
+    async def _post(self, url, **kwargs):
+        try:
+            return await self.session.post(url, **kwargs)
+        except httpx.TimeoutException as e:
+            raise requests.Timeout(str(e))
+        except httpx.TransportError as e:
+            raise requests.ConnectionError(str(e))
+
+    async def authenticate(self, user, password):
+        """
+        Authenticates user on freeipa backend and returns the session response.
+        user_data is only fetched by load_user_data.
+        :param user: string
+        :param password: string
+        :return: session response
+        """
+        login_data = {'user': user, 'password': password}
+
+        logger.debug("User is attempting to authenticate via FreeIPA...")
+
+        with timed('freeipa_auth_login', server=self.host_server) as outcome:
+            response = await self._post(
+                self.template.login_url,
+                headers=self.template.login_headers,
+                data=login_data
+            )
+            if response.status_code != 200:
+                outcome['outcome'] = 'failure'
+
+        self.user = user
+        if response.status_code == 200:
+            logger.info("User successfully authenticated via FreeIPA")
+            self.user_is_authenticated = True
+        else:
+            logger.info("User failed to authenticate via FreeIPA")
+
+        return response
+
+    def cancel(self):
+        """Abandon this session, pending follow up requests are skipped"""
+        self.cancelled = True
+
+    async def make_session_request(self, post_data):
+        """
+        Base POST request once user is authenticated
+        and a session is established
+        :param post_data: dict with method, item and params
+        :return:
+        """
+        debug_message = 'Making {method} request to {url}'
+        logger.debug(debug_message.format(method=post_data['method'],
+                                          url=self.template.session_url))
+
+        with timed('freeipa_auth_request', server=self.host_server,
+                   method=post_data['method']):
+            response = await self._post(
+                self.template.session_url,
+                headers=self.template.session_headers,
+                content=build_session_payload(post_data)
+            )
+            if response.status_code == 401:
+                raise FreeIpaSessionExpired(
+                    "FreeIPA session on {server} expired".format(
+                        server=self.host_server)
+                )
+            results = decode_response(response)
+
+        return results
+
+    def export_cookie(self):
+        """
+        Returns the IPA session cookie of an authenticated session
+        :return: dict with value, domain and path or None
+        """
+        for cookie in self.session.cookies.jar:
+            if cookie.name == IPA_SESSION_COOKIE:
+                return {'value': cookie.value, 'domain': cookie.domain,
+                        'path': cookie.path}
+        return None
+
+    @classmethod
+    def from_cookie(cls, host_server, user, cookie, **kwargs):
+        """
+        Rebuild an authenticated session from an exported session cookie
+        :param host_server: server the cookie was issued by
+        :param user: username the session belongs to
+        :param cookie: dict returned by export_cookie
+        :return: AsyncFreeIpaSession
+        """
+        ipa_session = cls(host_server, **kwargs)
+        ipa_session.session.cookies.set(
+            IPA_SESSION_COOKIE, cookie['value'],
+            domain=cookie['domain'], path=cookie['path']
+        )
+        ipa_session.user = user
+        ipa_session.user_is_authenticated = True
+        return ipa_session
+
+    async def make_batch_request(self, calls):
+        """
+        Send several calls as one freeipa batch request
+        :param calls: List of post_data dicts with method, item and params
+        :return: List of results matching the calls
+        """
+        response = await self.make_session_request(
+            build_batch_post_data(calls)
+        )
+        return response['result']['results']
+
+    @property
+    def user_data(self):
+        """
+        The user's user_show record once load_user_data fetched it
+        :return: dict
+        """
+        if self._user_data is None:
+            return {}
+        return self._user_data
+
+    @user_data.setter
+    def user_data(self, user_data):
+        self._user_data = user_data
+
+    @property
+    def has_user_data(self):
+        """Whether user_data was fetched or set already"""
+        return self._user_data is not None
+
+    async def load_user_data(self):
+        """
+        Fetch user_data unless it was fetched already. Nothing is fetched
+        for unauthenticated or cancelled sessions.
+        :return: dict
+        """
+        if self._user_data is None:
+            if not self.user_is_authenticated or self.cancelled:
+                return {}
+            if self.user_data_loader is not None:
+                self._user_data = await self.user_data_loader(self)
+            else:
+                self._user_data = await self._get_user_data()
+        return self._user_data
+
+    async def _get_user_data(self):
+        """
+        Internal method to grab user data on freeipa server after login.
+        Any post login calls are sent in the same batch request.
+        :return:
+        """
+        if self.user_is_authenticated:
+            post_data = {'method': 'user_show',
+                         'item': [self.user],
+                         'params': dict(self.user_show_params)}
+            if not self.post_login_calls:
+                response = await self.make_session_request(post_data)
+                return response['result']['result']
+
+            results = await self.make_batch_request(
+                [post_data] + list(self.post_login_calls)
+            )
+            self.post_login_results = results[1:]
+            return results[0]['result']
+        return {}
+
+    @property
+    def groups(self):
+        """
+        Returns all groups of which currently authenticated user is a member
+        :return: List of groups
+        """
+        return self.user_data.get('memberof_group', [])
@@ -1,9 +1,41 @@
 from django.contrib.auth.backends import ModelBackend
-from freeipa_auth.freeipa_utils import FreeIpaSession
+from freeipa_auth.freeipa_utils import FreeIpaSession, get_user_show_params
+from freeipa_auth.async_utils import AsyncFreeIpaSession
+from freeipa_auth.cache import (
+    AccountStatusCache, CredentialCache, UserDataCache
+)
+from freeipa_auth.ipa_sessions import IpaSessionStore
+from freeipa_auth.servers import server_pools
+from freeipa_auth.service import ServiceSession, service_sessions
+from freeipa_auth.throttling import LoginThrottle, get_client_ip
+from freeipa_auth.singleflight import login_flights, login_key
+from freeipa_auth.groups import GroupHierarchy, group_hierarchy
+from freeipa_auth.sync import DirectorySync
+from freeipa_auth.permissions import PermissionCache
+from freeipa_auth.deferred import deferred_syncs
+from freeipa_auth.revalidation import (
+    MISSING_ACCOUNT, AccountStatus, account_status_batcher, is_account_locked
+)
+from freeipa_auth.metrics import get_sink, timed
+from freeipa_auth.settings import (  # noqa: F401
+    FreeIpaAuthSettings, get_settings
+)
+from freeipa_auth.hedging import (
+    HedgedAttempt, arun_hedged, hedging_executor, run_hedged
+)
 from django.contrib.auth.models import Group
+from django.core.exceptions import ImproperlyConfigured, PermissionDenied
 from django.contrib.auth import get_user_model
+from django.db import router
 import requests
+import functools
 import logging
+import time
+
+try:
+    from asgiref.sync import sync_to_async
+except ImportError:  # pragma: no cover
+    sync_to_async = None
 
 logger = logging.getLogger(__name__)
 
@@ -18,7 +50,48 @@ class FreeIpaRpcAuthBackend(ModelBackend):
     """
 
     def __init__(self):
-        self.settings = FreeIpaAuthSettings()
+        self.settings = get_settings()
+        self.credential_cache = None
+        if self.settings.CREDENTIAL_CACHE_TTL:
+            self.credential_cache = CredentialCache(
+                self.settings.CREDENTIAL_CACHE_TTL,
+                alias=self.settings.CREDENTIAL_CACHE_ALIAS
+            )
+        self.user_data_cache = None
+        if self.settings.USER_DATA_MAX_AGE:
+            self.user_data_cache = UserDataCache(
+                self.settings.USER_DATA_MAX_AGE,
+                alias=self.settings.CREDENTIAL_CACHE_ALIAS
+            )
+        self.permission_cache = None
+        if self.settings.PERMISSION_CACHE_TTL:
+            self.permission_cache = PermissionCache(
+                self.settings.PERMISSION_CACHE_TTL,
+                alias=self.settings.CREDENTIAL_CACHE_ALIAS
+            )
+        self.username_throttle = None
+        if self.settings.THROTTLE_USERNAME_RATE:
+            self.username_throttle = LoginThrottle(
+                'username',
+                self.settings.THROTTLE_USERNAME_RATE,
+                self.settings.THROTTLE_USERNAME_BURST,
+                alias=self.settings.CREDENTIAL_CACHE_ALIAS
+            )
+        self.ip_throttle = None
+        if self.settings.THROTTLE_IP_RATE:
+            self.ip_throttle = LoginThrottle(
+                'ip',
+                self.settings.THROTTLE_IP_RATE,
+                self.settings.THROTTLE_IP_BURST,
+                alias=self.settings.CREDENTIAL_CACHE_ALIAS
+            )
+        self.account_status_cache = None
+        if self.settings.SESSION_REVALIDATE_INTERVAL and \
+                self.settings.ACCOUNT_STATUS_CACHE_TTL:
+            self.account_status_cache = AccountStatusCache(
+                self.settings.ACCOUNT_STATUS_CACHE_TTL,
+                alias=self.settings.CREDENTIAL_CACHE_ALIAS
+            )
 
     def authenticate(self, *args, **kwargs):
         """
@@ -26,61 +99,731 @@ class FreeIpaRpcAuthBackend(ModelBackend):
         Authenticate on freeipa server and sync django user groups.
         :param username:
         :param password:
-        :param tries: Number of tries for authentication (internal use only)
         :return:
         """
 
         if self.settings.BACKEND_ENABLED:
 
             # get arguments from Django auth __init__
+            request = args[0] if args else kwargs.get('request', None)
             username = kwargs.get('username', None)
             password = kwargs.get('password', None)
-            tries = kwargs.get('tries', 1)
 
-            # Grab freeipa server from settings
-            server = self.settings.SERVER
+            # Skip the freeipa round trip if these credentials
+            # were verified recently
+            user = self.get_cached_user(username, password)
+            if user is not None:
+                return user
+
+            # Concurrent logins with the same credentials share one
+            # freeipa exchange and user sync
+            if self.settings.COALESCE_LOGINS:
+                return login_flights.do(
+                    login_key(username, password),
+                    functools.partial(self.authenticate_on_freeipa,
+                                      request, username, password)
+                )
+            return self.authenticate_on_freeipa(request, username, password)
+
+    def authenticate_on_freeipa(self, request, username, password):
+        """
+        Check the credentials on freeipa and sync the django user
+        :param request: django request or None
+        :param username:
+        :param password:
+        :return: user or None
+        """
+        # Reject floods before they reach freeipa
+        self.check_throttles(request, username)
+
+        # A fresh user_show record means the user was synced recently
+        cached_user_data = self.get_cached_user_data(username)
+
+        # Authenticate and get response via RPC protocol
+        user_session, response = self.authenticate_on_servers(
+            username,
+            password
+        )
+
+        # Check response status code
+        logged_in = response.status_code == 200
+
+        # If credentials were valid then sync and return the user
+        # Django will handle user sessions from here
+        user = None
+        if logged_in:
+            if self.settings.SERVICE_DIRECTORY_READS:
+                # The user's session only checks the password
+                user_session.user_data_loader = \
+                    self.fetch_directory_user_data
+            user = self.get_synced_user(user_session, cached_user_data)
+            self.attach_ipa_session(user, user_session)
+            # The account is active, whatever an earlier check cached
+            if self.account_status_cache:
+                self.account_status_cache.invalidate(username)
+        self.cache_credentials(username, password, user)
+        return user
 
-            # if second try, allow for a single failover server only
-            if tries == 2:
-                server = self.settings.FAILOVER_SERVER
+    def get_cached_user(self, username, password):
+        """
+        Returns the user if these credentials were verified recently
+        :param username:
+        :param password:
+        :return: user or None
+        """
+        if self.credential_cache:
+            user_id = self.credential_cache.get_user_id(username, password)
+            if user_id is not None:
+                return User.objects.filter(pk=user_id).first()
 
-            # Specify ssl public cert for a mutual SSL handshake
-            ssl_verify = self.settings.SSL_VERIFY
+    def cache_credentials(self, username, password, user):
+        """
+        Remember credentials freeipa accepted, or forget them if it did not
+        :param username:
+        :param password:
+        :param user: authenticated user or None
+        """
+        if self.credential_cache:
+            if user is not None:
+                self.credential_cache.set(username, password, user)
+            else:
+                self.credential_cache.invalidate(username)
 
-            # Setup FreeIPA user session
-            user_session = FreeIpaSession(
-                server,
-                ssl_verify=ssl_verify,
-                server_timeout=self.settings.SERVER_TIMEOUT
+    def check_throttles(self, request, username):
+        """
+        Count a login attempt against the username and client ip throttles
+        :param request: django request or None
+        :param username:
+        :raise PermissionDenied: if either throttle is exhausted, which stops
+            django from trying the remaining backends
+        """
+        throttles = (
+            (self.username_throttle, username),
+            (self.ip_throttle, get_client_ip(request)),
+        )
+        for throttle, ident in throttles:
+            if throttle is None or not ident:
+                continue
+            if not throttle.allow(ident):
+                get_sink().increment('freeipa_auth_throttled_total',
+                                     scope=throttle.scope)
+                logger.warning(
+                    "FreeIPA login throttled by {scope}".format(
+                        scope=throttle.scope)
+                )
+                raise PermissionDenied(
+                    "Too many login attempts, try again later"
+                )
+
+    def get_cached_user_data(self, username):
+        """
+        Returns the user_show record of a recent sync, if still fresh
+        :param username:
+        :return: user data dict or None
+        """
+        if self.user_data_cache:
+            return self.user_data_cache.get(username)
+
+    def get_server_pool(self):
+        """
+        Returns the process wide health tracked pool of configured servers
+        :return: ServerPool
+        """
+        return server_pools.get_pool(
+            self.settings.SERVERS,
+            failure_threshold=self.settings.CIRCUIT_BREAKER_THRESHOLD,
+            cooldown=self.settings.CIRCUIT_BREAKER_COOLDOWN
+        )
+
+    def get_user_session(self, server):
+        """
+        Setup FreeIPA user session for a server
+        :param server:
+        :return: FreeIpaSession
+        """
+        return FreeIpaSession(
+            server,
+            # Specify ssl public cert for a mutual SSL handshake
+            ssl_verify=self.settings.SSL_VERIFY,
+            server_timeout=self.settings.SERVER_TIMEOUT,
+            pool_size=self.settings.POOL_SIZE,
+            keep_alive=self.settings.POOL_KEEP_ALIVE,
+            user_show_params=self.settings.user_show_params
+        )
+
+    def authenticate_on_servers(self, username, password, **kwargs):
+        """
+        Authenticate on the healthy servers, fastest first, moving on to the
+        next server on connection errors. Request outcomes feed the health
+        of each server.
+        :param username:
+        :param password:
+        :return: Tuple of the user session and its login response
+        """
+        pool = self.get_server_pool()
+        servers = pool.candidates()
+        if not servers:
+            logger.critical("No healthy FreeIPA server available")
+            raise requests.ConnectionError(
+                "No healthy FreeIPA server available"
             )
 
-            message = "Attempting to authenticate user on server: {server}"
-            logger.info(message.format(server=server))
+        if self.settings.HEDGE_REQUESTS and len(servers) > 1:
+            return self.authenticate_hedged(
+                pool, servers, username, password, **kwargs
+            )
 
+        for server in servers:
             try:
-                # Authenticate and get response via RPC protocol
-                response = user_session.authenticate(username, password)
-
-                # Check response status code
-                logged_in = response.status_code == 200
-
-                # If credentials were valid then sync and return the user
-                # Django will handle user sessions from here
-                if logged_in:
-                    return self.update_user(user_session)
-
-            except requests.ConnectionError:
-                # If there was a connection error, we can try the
-                # failover server once and return user
-                logger.critical("Main FreeIPA server connection error")
-                if tries == 1 and self.settings.FAILOVER_SERVER:
-                    return self.authenticate(
-                        username=username,
-                        password=password,
-                        tries=tries+1
-                    )
+                return self.authenticate_on_server(
+                    pool, server, username, password, **kwargs
+                )
+            except (requests.ConnectionError, requests.Timeout):
+                if server == servers[-1]:
+                    raise
+                get_sink().increment('freeipa_auth_failovers_total',
+                                     server=server)
+
+    def get_service_session(self):
+        """
+        Returns the shared service account session for directory reads.
+        It logs in on first use and again whenever the IPA session expired.
+        :return: ServiceSession
+        """
+        if not self.settings.SERVICE_USER:
+            raise ImproperlyConfigured(
+                "FREEIPA_AUTH_SERVICE_USER is required for directory reads"
+            )
+
+        return service_sessions.get(
+            (tuple(self.settings.SERVERS), self.settings.SERVICE_USER),
+            functools.partial(ServiceSession, self.login_service_account,
+                              max_age=self.settings.IPA_SESSION_MAX_AGE)
+        )
+
+    def login_service_account(self):
+        """
+        Log in the configured service account
+        :return: authenticated FreeIpaSession
+        """
+        service_session, response = self.authenticate_on_servers(
+            self.settings.SERVICE_USER,
+            self.settings.SERVICE_PASSWORD
+        )
+        response.raise_for_status()
+        return service_session
+
+    def fetch_directory_user_data(self, user_session):
+        """
+        Read the user's record, along with any post login calls, through
+        the service session instead of the user's own session. Used as
+        the user_data_loader of user sessions in service mode.
+        :param user_session: authenticated freeipa_user_session obj
+        :return: user_show result
+        """
+        post_data = {'method': 'user_show',
+                     'item': [user_session.user],
+                     'params': dict(user_session.user_show_params)}
+        service_session = self.get_service_session()
+        if not user_session.post_login_calls:
+            response = service_session.make_session_request(post_data)
+            return response['result']['result']
+
+        results = service_session.make_batch_request(
+            [post_data] + list(user_session.post_login_calls)
+        )
+        user_session.post_login_results = results[1:]
+        return results[0]['result']
+
+    def get_post_login_calls(self, username):
+        """
+        Extra freeipa calls to send in the same batch request as the
+        user_show upon login, e.g. group_show for group details. Their
+        results are found in user_session.post_login_results.
+        Override to fetch more data per login without extra round trips.
+        :param username:
+        :return: List of dicts with method, item and params
+        """
+        return []
+
+    def authenticate_hedged(self, pool, servers, username, password, **kwargs):
+        """
+        Start the login on the fastest server and, whenever it has not
+        answered within its usual latency percentile, start the same login
+        on the next server. The first response wins.
+        :return: Tuple of the user session and its login response
+        """
+        attempts = []
+        for server in servers:
+            user_session = self.get_user_session(server)
+            attempts.append(HedgedAttempt(
+                run=functools.partial(
+                    self.authenticate_on_server, pool, server,
+                    username, password, user_session=user_session, **kwargs
+                ),
+                cancel=user_session.cancel,
+                delay=pool.hedge_delay(
+                    server,
+                    self.settings.HEDGE_PERCENTILE,
+                    self.settings.HEDGE_DELAY
+                )
+            ))
+
+        return run_hedged(
+            attempts,
+            executor=hedging_executor.get(self.settings.HEDGE_MAX_WORKERS),
+            retry_on=(requests.ConnectionError, requests.Timeout)
+        )
+
+    def authenticate_on_server(self, pool, server, username, password,
+                               user_session=None, **kwargs):
+        """
+        Authenticate on a single server and record the outcome in the pool
+        :return: Tuple of the user session and its login response
+        """
+        if user_session is None:
+            user_session = self.get_user_session(server)
+        user_session.post_login_calls = self.get_post_login_calls(username)
+
+        message = "Attempting to authenticate user on server: {server}"
+        logger.info(message.format(server=server))
+
+        start = time.monotonic()
+        try:
+            response = user_session.authenticate(username, password, **kwargs)
+        except (requests.ConnectionError, requests.Timeout):
+            pool.record_failure(server)
+            message = "FreeIPA server connection error: {server}"
+            logger.critical(message.format(server=server))
+            raise
+        except Exception:
+            pool.record_failure(server)
+            raise
+
+        pool.record_success(server, time.monotonic() - start)
+        return user_session, response
+
+    def get_synced_user(self, user_session, cached_user_data=None):
+        """
+        Return the django user for an authenticated session, reusing
+        the last sync while the cached user_show record is fresh.
+        :param user_session: freeipa_user_session obj
+        :param cached_user_data: fresh user_show record or None
+        :return:
+        """
+        if cached_user_data is not None:
+            user = User.objects.filter(username=user_session.user).first()
+            if user is not None:
+                return user
+            user_session.user_data = cached_user_data
+            return self.update_user(user_session)
+
+        if self.settings.DEFER_USER_SYNC:
+            # Existing users log in right away, new users are created inline
+            user = User.objects.filter(username=user_session.user).first()
+            if user is not None:
+                deferred_syncs.submit(
+                    user_session.user,
+                    functools.partial(self.sync_user, user_session),
+                    max_workers=self.settings.DEFER_USER_SYNC_WORKERS,
+                    max_pending=self.settings.DEFER_USER_SYNC_QUEUE,
+                    using=router.db_for_write(User)
+                )
+                return user
+
+        return self.sync_user(user_session)
+
+    def sync_user(self, user_session):
+        """
+        Sync the user and cache the user_show record the sync fetched
+        :param user_session: freeipa_user_session obj
+        :return:
+        """
+        user = self.update_user(user_session)
+        if self.user_data_cache and user_session.has_user_data:
+            self.user_data_cache.set(user_session.user, user_session.user_data)
+        return user
+
+    def attach_ipa_session(self, user, user_session):
+        """
+        Hand the IPA session cookie of a login to django's login, which
+        stores it encrypted in the django session
+        :param user: django user
+        :param user_session: authenticated freeipa_user_session obj
+        """
+        if not self.settings.STORE_IPA_SESSION or user is None:
+            return
+        cookie = user_session.export_cookie()
+        if cookie is not None:
+            user.ipa_session = {'server': user_session.host_server,
+                                'user': user_session.user,
+                                'cookie': cookie}
+
+    def get_ipa_session(self, request):
+        """
+        Rebuild the authenticated FreeIPA session stored at login, so
+        directory lookups for the user need no password login
+        :param request: request of the logged in user
+        :return: FreeIpaSession or None if there is no usable session
+        """
+        if not self.settings.STORE_IPA_SESSION:
+            return None
+        data = IpaSessionStore(self.settings.IPA_SESSION_MAX_AGE).load(
+            request.session
+        )
+        if data is None or data['user'] != request.user.get_username():
+            return None
+        return FreeIpaSession.from_cookie(
+            data['server'],
+            data['user'],
+            data['cookie'],
+            ssl_verify=self.settings.SSL_VERIFY,
+            server_timeout=self.settings.SERVER_TIMEOUT,
+            pool_size=self.settings.POOL_SIZE,
+            keep_alive=self.settings.POOL_KEEP_ALIVE
+        )
+
+    def invalidate_credentials(self, username):
+        """
+        Drop cached credentials and user data so the next
+        login is checked and synced on freeipa
+        :param username:
+        """
+        if self.credential_cache:
+            self.credential_cache.invalidate(username)
+        if self.user_data_cache:
+            self.user_data_cache.invalidate(username)
+
+    def get_account_status(self, username):
+        """
+        Returns whether the user's freeipa account is still active, with
+        its groups. Statuses are cached and concurrent lookups are read
+        together through the service session.
+        :param username:
+        :return: AccountStatus or None if freeipa could not tell
+        """
+        if self.account_status_cache:
+            status = self.account_status_cache.get(username)
+            if status is not None:
+                return status
+
+        status = account_status_batcher.get(
+            username,
+            self.fetch_account_statuses,
+            window=self.settings.ACCOUNT_STATUS_BATCH_WINDOW,
+            max_size=self.settings.ACCOUNT_STATUS_BATCH_SIZE
+        )
+        if status is not None and self.account_status_cache:
+            self.account_status_cache.set(username, status)
+        return status
+
+    def fetch_account_statuses(self, usernames):
+        """
+        Read the lock state and groups of several users in one batch
+        request through the service session
+        :param usernames: List of usernames
+        :return: dict of username to AccountStatus, leaving out users
+            whose record could not be read
+        """
+        params = dict(get_user_show_params(
+            ['nsaccountlock'], members=self.settings.UPDATE_USER_GROUPS
+        ))
+        batch = self.get_service_session().batch()
+        for username in usernames:
+            batch.add('user_show', [username], params)
+
+        statuses = {}
+        for username, result in zip(usernames, batch.execute()):
+            if result.get('error'):
+                if result.get('error_name') == 'NotFound':
+                    statuses[username] = MISSING_ACCOUNT
                 else:
+                    logger.warning(
+                        "Could not read FreeIPA user {username}: "
+                        "{error}".format(username=username,
+                                         error=result['error'])
+                    )
+                continue
+            record = result['result']
+            groups = ()
+            if self.settings.UPDATE_USER_GROUPS:
+                groups = tuple(self.get_record_groups(record))
+            statuses[username] = AccountStatus(
+                active=not is_account_locked(record), groups=groups
+            )
+        return statuses
+
+    async def aauthenticate(self, request=None, **kwargs):
+        """
+        Async twin of authenticate, used by Django's aauthenticate.
+        Freeipa requests run on the event loop through AsyncFreeIpaSession
+        and the user sync uses the async ORM.
+        :param username:
+        :param password:
+        :return:
+        """
+
+        if self.settings.BACKEND_ENABLED:
+
+            username = kwargs.get('username', None)
+            password = kwargs.get('password', None)
+
+            user = await sync_to_async(self.get_cached_user)(
+                username, password
+            )
+            if user is not None:
+                return user
+
+            if self.settings.COALESCE_LOGINS:
+                return await login_flights.ado(
+                    login_key(username, password),
+                    functools.partial(self.aauthenticate_on_freeipa,
+                                      request, username, password)
+                )
+            return await self.aauthenticate_on_freeipa(
+                request, username, password
+            )
+
+    async def aauthenticate_on_freeipa(self, request, username, password):
+        """
+        Async twin of authenticate_on_freeipa
+        :return: user or None
+        """
+        await sync_to_async(self.check_throttles)(request, username)
+
+        cached_user_data = await sync_to_async(self.get_cached_user_data)(
+            username
+        )
+
+        user_session, response = await self.aauthenticate_on_servers(
+            username,
+            password
+        )
+
+        user = None
+        if response.status_code == 200:
+            if self.settings.SERVICE_DIRECTORY_READS:
+                user_session.user_data_loader = sync_to_async(
+                    self.fetch_directory_user_data
+                )
+            user = await self.aget_synced_user(
+                user_session, cached_user_data
+            )
+            self.attach_ipa_session(user, user_session)
+            # The account is active, whatever an earlier check cached
+            if self.account_status_cache:
+                await sync_to_async(self.account_status_cache.invalidate)(
+                    username
+                )
+        await sync_to_async(self.cache_credentials)(
+            username, password, user
+        )
+        return user
+
+    def get_async_user_session(self, server):
+        """
+        Setup async FreeIPA user session for a server
+        :param server:
+        :return: AsyncFreeIpaSession
+        """
+        return AsyncFreeIpaSession(
+            server,
+            ssl_verify=self.settings.SSL_VERIFY,
+            server_timeout=self.settings.SERVER_TIMEOUT,
+            pool_size=self.settings.POOL_SIZE,
+            keep_alive=self.settings.POOL_KEEP_ALIVE,
+            user_show_params=self.settings.user_show_params
+        )
+
+    async def aauthenticate_on_servers(self, username, password, **kwargs):
+        """
+        Async twin of authenticate_on_servers
+        :return: Tuple of the user session and its login response
+        """
+        pool = self.get_server_pool()
+        servers = pool.candidates()
+        if not servers:
+            logger.critical("No healthy FreeIPA server available")
+            raise requests.ConnectionError(
+                "No healthy FreeIPA server available"
+            )
+
+        if self.settings.HEDGE_REQUESTS and len(servers) > 1:
+            attempts = []
+            for server in servers:
+                user_session = self.get_async_user_session(server)
+                attempts.append(HedgedAttempt(
+                    run=functools.partial(
+                        self.aauthenticate_on_server, pool, server,
+                        username, password, user_session=user_session,
+                        **kwargs
+                    ),
+                    cancel=user_session.cancel,
+                    delay=pool.hedge_delay(
+                        server,
+                        self.settings.HEDGE_PERCENTILE,
+                        self.settings.HEDGE_DELAY
+                    )
+                ))
+            return await arun_hedged(
+                attempts,
+                retry_on=(requests.ConnectionError, requests.Timeout)
+            )
+
+        for server in servers:
+            try:
+                return await self.aauthenticate_on_server(
+                    pool, server, username, password, **kwargs
+                )
+            except (requests.ConnectionError, requests.Timeout):
+                if server == servers[-1]:
                     raise
+                get_sink().increment('freeipa_auth_failovers_total',
+                                     server=server)
+
+    async def aauthenticate_on_server(self, pool, server, username, password,
+                                      user_session=None, **kwargs):
+        """
+        Async twin of authenticate_on_server
+        :return: Tuple of the user session and its login response
+        """
+        if user_session is None:
+            user_session = self.get_async_user_session(server)
+        user_session.post_login_calls = self.get_post_login_calls(username)
+
+        message = "Attempting to authenticate user on server: {server}"
+        logger.info(message.format(server=server))
+
+        start = time.monotonic()
+        try:
+            response = await user_session.authenticate(
+                username, password, **kwargs
+            )
+        except (requests.ConnectionError, requests.Timeout):
+            pool.record_failure(server)
+            message = "FreeIPA server connection error: {server}"
+            logger.critical(message.format(server=server))
+            raise
+        except Exception:
+            pool.record_failure(server)
+            raise
+
+        pool.record_success(server, time.monotonic() - start)
+        return user_session, response
+
+    async def aget_synced_user(self, user_session, cached_user_data=None):
+        """
+        Async twin of get_synced_user
+        :param user_session: async freeipa_user_session obj
+        :param cached_user_data: fresh user_show record or None
+        :return:
+        """
+        if cached_user_data is not None:
+            user = await User.objects.filter(
+                username=user_session.user
+            ).afirst()
+            if user is not None:
+                return user
+            user_session.user_data = cached_user_data
+
+        user = await self.aupdate_user(user_session)
+        if self.user_data_cache and cached_user_data is None and \
+                user_session.has_user_data:
+            await sync_to_async(self.user_data_cache.set)(
+                user_session.user, user_session.user_data
+            )
+        return user
+
+    async def aupdate_user(self, user_session):
+        """
+        Async twin of update_user
+        :param user_session: async freeipa_user_session obj
+        :return:
+        """
+        with timed('freeipa_auth_update_user'):
+            return await self._aupdate_user(user_session)
+
+    async def _aupdate_user(self, user_session):
+        user, created = await User.objects.aget_or_create(
+            username=user_session.user
+        )
+
+        changed_fields = []
+        if user.has_usable_password():
+            user.set_unusable_password()
+            changed_fields.append('password')
+
+        if created or self.settings.ALWAYS_UPDATE_USER:
+            await user_session.load_user_data()
+            changed_fields += self.update_user_attrs(
+                user, user_session.user_data
+            )
+            if self.settings.GROUP_HIERARCHY_INDEX:
+                # Loading the index may read from freeipa
+                await sync_to_async(self.get_group_hierarchy)()
+            groups = self.get_all_user_groups(user_session)
+            changed_fields += await self.aupdate_user_groups(user, groups)
+
+        if changed_fields:
+            await user.asave(update_fields=changed_fields)
+        return user
+
+    async def aupdate_user_groups(self, user, groups):
+        """
+        Async twin of update_user_groups
+        :return: List of changed field names
+        """
+        changed_fields = []
+
+        if not user.is_staff:
+            setattr(user, "is_staff", True)
+            changed_fields.append('is_staff')
+
+        if self.settings.UPDATE_USER_GROUPS:
+            group_ids = set([
+                pk async for pk in Group.objects.filter(name__in=groups)
+                .values_list('pk', flat=True)
+            ])
+            current_ids = set([
+                pk async for pk in user.groups.values_list('pk', flat=True)
+            ])
+            if current_ids - group_ids:
+                await sync_to_async(user.groups.remove)(
+                    *(current_ids - group_ids)
+                )
+            if group_ids - current_ids:
+                await sync_to_async(user.groups.add)(
+                    *(group_ids - current_ids)
+                )
+
+        return changed_fields
+
+    def _use_permission_cache(self, user_obj, obj=None):
+        # Superusers hold every permission, ModelBackend answers those
+        return self.permission_cache is not None and obj is None and \
+            user_obj.is_active and not user_obj.is_anonymous and \
+            not user_obj.is_superuser
+
+    def get_user_permissions(self, user_obj, obj=None):
+        """
+        Overriden method of ModelBackend, served from the shared
+        permission cache when enabled
+        """
+        if not self._use_permission_cache(user_obj, obj):
+            return super(FreeIpaRpcAuthBackend, self).get_user_permissions(
+                user_obj, obj)
+        return self.permission_cache.get_user_entry(user_obj)['permissions']
+
+    def get_group_permissions(self, user_obj, obj=None):
+        """
+        Overriden method of ModelBackend. Group permissions are cached per
+        group set and shared by every user with the same groups.
+        """
+        if not self._use_permission_cache(user_obj, obj):
+            return super(FreeIpaRpcAuthBackend, self).get_group_permissions(
+                user_obj, obj)
+        entry = self.permission_cache.get_user_entry(user_obj)
+        return self.permission_cache.get_group_permissions(entry['group_ids'])
 
     def get_all_user_groups(self, user_session):
         """
@@ -89,85 +832,129 @@ class FreeIpaRpcAuthBackend(ModelBackend):
         :param user_session:
         :return:
         """
-        groups = user_session.groups
-        groups += user_session.user_data.get('memberofindirect_group', [])
-        return list(set(groups))
+        return self.get_effective_groups(
+            user_session.groups,
+            user_session.user_data.get('memberofindirect_group', [])
+        )
+
+    def get_record_groups(self, user_data):
+        """
+        Direct and indirect groups of a user_show record
+        :param user_data: user_show result
+        :return: List of groups
+        """
+        return self.get_effective_groups(
+            user_data.get('memberof_group', []),
+            user_data.get('memberofindirect_group', [])
+        )
+
+    def get_effective_groups(self, groups, indirect_groups):
+        """
+        Resolve nested groups from the group hierarchy index when enabled,
+        otherwise from the indirect groups freeipa reported for the user.
+        :param groups: direct groups
+        :param indirect_groups: indirect groups from user_show
+        :return: List of groups
+        """
+        if self.settings.GROUP_HIERARCHY_INDEX:
+            hierarchy = self.get_group_hierarchy()
+            return list(hierarchy.effective_groups(groups))
+        return list(set(groups) | set(indirect_groups))
+
+    def get_group_hierarchy(self):
+        """
+        Returns the process wide group hierarchy, reloaded through the
+        service account every GROUP_HIERARCHY_REFRESH seconds
+        :return: GroupHierarchy
+        """
+        return group_hierarchy.get(
+            self.load_group_hierarchy,
+            self.settings.GROUP_HIERARCHY_REFRESH
+        )
+
+    def load_group_hierarchy(self):
+        """
+        Read every group with its direct parent groups
+        :return: GroupHierarchy
+        :raise DirectoryTruncated: if freeipa did not list every group
+        """
+        directory = DirectorySync(self, self.get_service_session())
+        # no_members would also drop memberof_group, so the member lists
+        # come along with the parent groups
+        records = directory.find_entries('group_find', {'no_members': False})
+        return GroupHierarchy.from_records(records)
 
     def update_user(self, user_session):
         """
-        Sync freeipa user to django with user freeipa user groups groups
+        Sync freeipa user to django with user freeipa user groups groups.
+        Only changed fields and group memberships are written.
         :param user_session: freeipa_user_session obj
         :return:
         """
+        with timed('freeipa_auth_update_user'):
+            return self._update_user(user_session)
 
+    def _update_user(self, user_session):
         user, created = User.objects.get_or_create(username=user_session.user)
 
-        # Set random (secret) pass for freeipa user.
+        # Make sure the freeipa user has no usable password.
         # This user does not need to, and cannot, login
         # via classic django auth.
-        user.set_password(User.objects.make_random_password(length=100))
-
-        if not created and not self.settings.ALWAYS_UPDATE_USER:
-            return user
-
-        # Update user attrs
-        self.update_user_attrs(user, user_session.user_data)
+        changed_fields = []
+        if user.has_usable_password():
+            user.set_unusable_password()
+            changed_fields.append('password')
+
+        # user_data is only fetched from freeipa past this point
+        if created or self.settings.ALWAYS_UPDATE_USER:
+            # Update user attrs
+            changed_fields += self.update_user_attrs(
+                user, user_session.user_data
+            )
 
-        # Sync freeipa user groups with current user
-        groups = self.get_all_user_groups(user_session)
-        self.update_user_groups(user, groups)
+            # Sync freeipa user groups with current user
+            groups = self.get_all_user_groups(user_session)
+            changed_fields += self.update_user_groups(user, groups)
 
-        user.save()
+        if changed_fields:
+            user.save(update_fields=changed_fields)
         return user
 
     def update_user_attrs(self, user, user_session_data):
-        for attr, key in self.settings.USER_ATTRS_MAP.items():
-            attr_value = user_session_data[key]
-            if isinstance(attr_value, list):
-                attr_value = attr_value.pop()
-            setattr(user, attr, attr_value)
+        """
+        Set mapped freeipa attributes on the user
+        :return: List of changed field names
+        """
+        changed_fields = []
+        for attr, getter in self.settings.user_attr_getters:
+            attr_value = getter(user_session_data)
+            if getattr(user, attr) != attr_value:
+                setattr(user, attr, attr_value)
+                changed_fields.append(attr)
+        return changed_fields
 
     def update_user_groups(self, user, groups):
         """
         Add user to django groups
+        :return: List of changed field names
         """
+        changed_fields = []
+
         # every user should be staff, but none should be superuser
-        setattr(user, "is_staff", True)
+        if not user.is_staff:
+            setattr(user, "is_staff", True)
+            changed_fields.append('is_staff')
 
-        # Update user groups
+        # Update user groups, touching only the memberships that changed
         if self.settings.UPDATE_USER_GROUPS:
-            user.groups.clear()
-            user.groups.add(*Group.objects.filter(name__in=groups))
-
-
-class FreeIpaAuthSettings(object):
-
-    defaults = {
-        'BACKEND_ENABLED': True,
-        'SERVER': None,
-        'FAILOVER_SERVER': None,
-        'SSL_VERIFY': True,
-        'UPDATE_USER_GROUPS': False,
-        'USER_ATTRS_MAP': {
-            'first_name': 'givenname',
-            'last_name': 'sn',
-            'email': 'mail'
-        },
-        'ALWAYS_UPDATE_USER': True,
-        'SERVER_TIMEOUT': 5,
-    }
-
-    def __init__(self, prefix='FREEIPA_AUTH_'):
-        """
-        Load FreeIPA Auth settings and set defaults
-        if they do not exists
-        """
-        from django.conf import settings
-
-        for name, default in self.defaults.items():
-            value = getattr(settings, prefix + name, default)
-            setattr(self, name, value)
-        if getattr(self, 'FAILOVER_SERVER') is None:
-            logger.warning(
-                "FreeIPA Failover Server is not set. Proceed with caution."
+            group_ids = set(
+                Group.objects.filter(name__in=groups)
+                .values_list('pk', flat=True)
             )
+            current_ids = set(user.groups.values_list('pk', flat=True))
+            if current_ids - group_ids:
+                user.groups.remove(*(current_ids - group_ids))
+            if group_ids - current_ids:
+                user.groups.add(*(group_ids - current_ids))
+
+        return changed_fields
@@ -0,0 +1,135 @@
+import hashlib
+import hmac
+import logging
+import os
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.encoding import force_bytes
+
+logger = logging.getLogger(__name__)
+
+
+class CredentialCache(object):
+
+    """
+    Short lived cache of credentials recently verified on freeipa.
+    Only a salted HMAC of the password is stored, never the password itself.
+    """
+
+    key_prefix = 'freeipa_auth:credentials:'
+
+    def __init__(self, timeout, alias='default'):
+        self.timeout = timeout
+        self.cache = caches[alias]
+
+    def _key(self, username):
+        digest = hashlib.sha256(force_bytes(username)).hexdigest()
+        return self.key_prefix + digest
+
+    def _verifier(self, salt, password):
+        key = salt + force_bytes(settings.SECRET_KEY)
+        return hmac.new(key, force_bytes(password), hashlib.sha256).hexdigest()
+
+    def get_user_id(self, username, password):
+        """
+        Returns the cached user id if the password matches the verifier
+        :param username: string
+        :param password: string
+        :return: user pk or None
+        """
+        entry = self.cache.get(self._key(username))
+        if entry is None:
+            return None
+
+        verifier = self._verifier(entry['salt'], password)
+        if not hmac.compare_digest(verifier, entry['verifier']):
+            return None
+
+        logger.debug("User credentials found in FreeIPA credential cache")
+        return entry['user_id']
+
+    def set(self, username, password, user):
+        """
+        Store a verifier for credentials just accepted by freeipa
+        :param username: string
+        :param password: string
+        :param user: django user obj
+        """
+        salt = os.urandom(16)
+        entry = {
+            'salt': salt,
+            'verifier': self._verifier(salt, password),
+            'user_id': user.pk,
+        }
+        self.cache.set(self._key(username), entry, self.timeout)
+
+    def invalidate(self, username):
+        """Drop any cached credentials for the user"""
+        self.cache.delete(self._key(username))
+
+
+class UserDataCache(object):
+
+    """
+    Cache of freeipa user_show records. While a record is cached the user
+    is considered in sync and logins skip the directory read and db sync.
+    """
+
+    key_prefix = 'freeipa_auth:user_data:'
+
+    def __init__(self, max_age, alias='default'):
+        self.max_age = max_age
+        self.cache = caches[alias]
+
+    def _key(self, username):
+        digest = hashlib.sha256(force_bytes(username)).hexdigest()
+        return self.key_prefix + digest
+
+    def get(self, username):
+        """
+        Returns the cached user_show record if it is still fresh
+        :param username: string
+        :return: user data dict or None
+        """
+        return self.cache.get(self._key(username))
+
+    def set(self, username, user_data):
+        """Store a freshly synced user_show record"""
+        self.cache.set(self._key(username), user_data, self.max_age)
+
+    def invalidate(self, username):
+        """Drop the cached record so the next login refreshes it"""
+        self.cache.delete(self._key(username))
+
+
+class AccountStatusCache(object):
+
+    """
+    Cache of account statuses read from freeipa, letting revalidated
+    sessions share a directory read for the lifetime of an entry
+    """
+
+    key_prefix = 'freeipa_auth:account_status:'
+
+    def __init__(self, timeout, alias='default'):
+        self.timeout = timeout
+        self.cache = caches[alias]
+
+    def _key(self, username):
+        digest = hashlib.sha256(force_bytes(username)).hexdigest()
+        return self.key_prefix + digest
+
+    def get(self, username):
+        """
+        Returns the cached status of a user
+        :param username: string
+        :return: AccountStatus or None
+        """
+        return self.cache.get(self._key(username))
+
+    def set(self, username, status):
+        self.cache.set(self._key(username), status, self.timeout)
+
+    def invalidate(self, username):
+        self.cache.delete(self._key(username))
@@ -0,0 +1,99 @@
+import logging
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+
+from django.db import close_old_connections, transaction
+
+logger = logging.getLogger(__name__)
+
+
+class DeferredSync(object):
+
+    """
+    Process wide thread pool running user syncs after the login response.
+    Jobs start once the current transaction commits, a job still queued
+    for the same key is not queued again and once max_pending jobs are
+    queued or running new jobs run inline instead.
+    """
+
+    def __init__(self):
+        self._executor = None
+        self._queued = set()
+        self._pending = 0
+        self._lock = threading.Lock()
+
+    def get_executor(self, max_workers):
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(
+                        max_workers=max_workers,
+                        thread_name_prefix='freeipa-auth-sync'
+                    )
+        return self._executor
+
+    def submit(self, key, func, max_workers, max_pending, using=None):
+        """
+        Run func on the thread pool once the current transaction commits
+        :param key: hashable, e.g. the username
+        :param func: callable without arguments
+        :param max_workers: size of the thread pool
+        :param max_pending: jobs queued or running before running inline
+        :param using: database alias of the transaction
+        """
+        transaction.on_commit(
+            lambda: self._submit(key, func, max_workers, max_pending),
+            using=using
+        )
+
+    def _submit(self, key, func, max_workers, max_pending):
+        with self._lock:
+            if key in self._queued:
+                return
+            inline = self._pending >= max_pending
+            if not inline:
+                self._queued.add(key)
+                self._pending += 1
+
+        if inline:
+            logger.warning("Deferred user sync queue is full, syncing inline")
+            func()
+            return
+
+        try:
+            self.get_executor(max_workers).submit(self._run, key, func)
+        except RuntimeError:
+            # The pool is shutting down with the interpreter
+            self._done(key)
+            func()
+
+    def _run(self, key, func):
+        with self._lock:
+            # A login from now on queues a new sync with its own data
+            self._queued.discard(key)
+        close_old_connections()
+        try:
+            func()
+        except Exception:
+            logger.exception("Deferred user sync failed")
+        finally:
+            close_old_connections()
+            self._done()
+
+    def _done(self, key=None):
+        with self._lock:
+            if key is not None:
+                self._queued.discard(key)
+            self._pending -= 1
+
+    def wait(self):
+        """Block until every queued sync finished, e.g. in tests"""
+        with self._lock:
+            executor = self._executor
+            self._executor = None
+        if executor is not None:
+            executor.shutdown(wait=True)
+
+
+deferred_syncs = DeferredSync()
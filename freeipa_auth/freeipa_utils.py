@@ -1,79 +1,306 @@
 import requests
+import functools
 import logging
 import json
+import socket
+import threading
+
+from collections import namedtuple
+from types import MappingProxyType
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection
+
+from freeipa_auth.metrics import timed
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
 
 
 logger = logging.getLogger(__name__)
 
 
-class FreeIpaSession(object):
+class PooledHTTPAdapter(HTTPAdapter):
+
+    """HTTP adapter with optional TCP keep-alive on pooled sockets"""
+
+    def __init__(self, keep_alive=True, **kwargs):
+        self.keep_alive = keep_alive
+        super(PooledHTTPAdapter, self).__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        if self.keep_alive:
+            kwargs['socket_options'] = (
+                HTTPConnection.default_socket_options +
+                [(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)]
+            )
+        super(PooledHTTPAdapter, self).init_poolmanager(*args, **kwargs)
+
+
+class ConnectionPoolRegistry(object):
+
+    """
+    Process wide registry of pooled HTTP adapters, one per FreeIPA server.
+    Adapters hold the underlying urllib3 connection pools and are shared by
+    every FreeIpaSession, while cookies stay on each per login session.
+    """
+
+    def __init__(self):
+        self._adapters = {}
+        self._lock = threading.Lock()
+
+    def get_adapter(self, host_server, pool_size=10, keep_alive=True):
+        """
+        Returns the shared adapter for a server, creating it on first use
+        :param host_server: string
+        :param pool_size: max number of pooled connections to the server
+        :param keep_alive: enable TCP keep-alive on pooled connections
+        :return: PooledHTTPAdapter
+        """
+        key = (host_server, pool_size, keep_alive)
+        adapter = self._adapters.get(key)
+        if adapter is None:
+            with self._lock:
+                adapter = self._adapters.get(key)
+                if adapter is None:
+                    adapter = PooledHTTPAdapter(
+                        keep_alive=keep_alive,
+                        pool_connections=1,
+                        pool_maxsize=pool_size,
+                    )
+                    self._adapters[key] = adapter
+        return adapter
+
+    def clear(self):
+        """Close and drop every pooled adapter"""
+        with self._lock:
+            for adapter in self._adapters.values():
+                adapter.close()
+            self._adapters = {}
+
+
+connection_pools = ConnectionPoolRegistry()
+
+
+# Base login POST headers
+LOGIN_HEADERS = MappingProxyType({
+    'Content-Type': 'application/x-www-form-urlencoded',
+    'Accept': 'text/plain'
+})
+
+# Base session POST headers
+SESSION_HEADERS = MappingProxyType({
+    'Content-Type': 'application/json',
+    'Accept': 'application/json'
+})
+
+# Base user_show options
+USER_SHOW_PARAMS = MappingProxyType({'all': True, 'raw': False})
+
+# Attributes user_show returns without all, membership lists aside
+USER_DEFAULT_ATTRS = frozenset([
+    'uid', 'givenname', 'sn', 'homedirectory', 'loginshell', 'uidnumber',
+    'gidnumber', 'mail', 'ou', 'telephonenumber', 'title', 'nsaccountlock',
+])
+
+IPA_SESSION_COOKIE = 'ipa_session'
+
+# Immutable per server URLs and headers, shared by every session and thread
+RequestTemplate = namedtuple(
+    'RequestTemplate',
+    ['login_url', 'session_url', 'login_headers', 'session_headers']
+)
 
-    """FreeIPA session constructor for RPC authentication"""
 
-    # Base login POST headers
-    login_headers = {'referer': '',
-                     'Content-Type': 'application/x-www-form-urlencoded',
-                     'Accept': 'text/plain'}
+@functools.lru_cache(maxsize=None)
+def get_request_template(host_server):
+    """
+    Returns the precomputed request template of a server
+    :param host_server: string
+    :return: RequestTemplate
+    """
+    login_url = 'https://{host_server}/ipa/session/login_password'.format(
+        host_server=host_server)
+    session_url = 'https://{host_server}/ipa/session/json'.format(
+        host_server=host_server)
+    return RequestTemplate(
+        login_url=login_url,
+        session_url=session_url,
+        login_headers=MappingProxyType(dict(LOGIN_HEADERS,
+                                            referer=login_url)),
+        session_headers=MappingProxyType(dict(SESSION_HEADERS,
+                                              referer=session_url))
+    )
 
-    # Bse session POST headers
-    session_headers = {'referer': '',
-                       'Content-Type': 'application/json',
-                       'Accept': 'application/json'}
 
-    # Base user specific POST data
-    user_post_data = {'item': [], 'method': 'user_show',
-                      'params': {'all': True, 'raw': False}}
+def get_user_show_params(attrs, members=True):
+    """
+    Returns the user_show options fetching no more than needed. Every
+    attribute is only requested when attrs holds a non default attribute.
+    :param attrs: freeipa attributes read from the record
+    :param members: whether the group membership lists are read
+    :return: immutable dict of options
+    """
+    params = {'all': not USER_DEFAULT_ATTRS.issuperset(attrs), 'raw': False}
+    if not members:
+        params['no_members'] = True
+    return MappingProxyType(params)
 
-    # Base session POST data
-    session_post_data = {'id': 0, 'method': '', 'params': []}
 
-    def __init__(self, host_server, ssl_verify=False, server_timeout=5):
+def decode_response(response):
+    """
+    Decode a JSON response, with orjson when it is installed
+    :param response: requests or httpx response
+    :return: decoded object
+    """
+    if orjson is not None:
+        return orjson.loads(response.content)
+    return response.json()
+
+
+def build_session_payload(post_data):
+    """
+    Serialize a JSON-RPC call, built fresh for every request
+    :param post_data: dict with method, item and params
+    :return: JSON string
+    """
+    return json.dumps({'id': 0,
+                       'method': post_data['method'],
+                       'params': [post_data['item'], post_data['params']]})
+
+
+def build_batch_post_data(calls):
+    """
+    Wrap several calls into one batch call
+    :param calls: List of post_data dicts with method, item and params
+    :return: post_data dict
+    """
+    return {
+        'method': 'batch',
+        'item': [{'method': call['method'],
+                  'params': [call['item'], call['params']]}
+                 for call in calls],
+        'params': {}
+    }
+
+
+class FreeIpaBatch(object):
+
+    """Queue of JSON-RPC calls sent to freeipa as a single batch request"""
+
+    def __init__(self, session):
+        self.session = session
+        self.calls = []
+
+    def add(self, method, item=None, params=None):
+        """
+        Queue a call
+        :param method: freeipa method, e.g. group_show
+        :param item: List of positional arguments
+        :param params: dict of options
+        :return: index of the call's result
+        """
+        self.calls.append({'method': method,
+                           'item': item or [],
+                           'params': params or {}})
+        return len(self.calls) - 1
+
+    def execute(self):
+        """
+        Send the queued calls
+        :return: List of results matching the queued calls
+        """
+        if not self.calls:
+            return []
+        return self.session.make_batch_request(self.calls)
+
+
+class FreeIpaSessionExpired(requests.HTTPError):
+
+    """The IPA session was rejected by the server, a new login is needed"""
+
+
+class FreeIpaSession(object):
+
+    """
+    FreeIPA session constructor for RPC authentication.
+    Request data is built per call from the server's immutable request
+    template, so sessions share no mutable state across threads.
+    """
+
+    def __init__(self, host_server, ssl_verify=False, server_timeout=5,
+                 pool_size=10, keep_alive=True,
+                 user_show_params=USER_SHOW_PARAMS):
 
         self.host_server = host_server
+        self.template = get_request_template(host_server)
+        self.user_show_params = user_show_params
         self.ssl_verify = ssl_verify
         self.user = None
         self.user_is_authenticated = False
-        self.user_data = {}
-        self.session = requests.Session()
         self.server_timeout = server_timeout
+        self.cancelled = False
+
+        # user_show record, fetched on first access to user_data
+        self._user_data = None
+        # Callable taking this session and returning its user_data,
+        # defaults to a user_show on this session
+        self.user_data_loader = None
+
+        # Extra calls sent along with user_show when user_data is fetched
+        self.post_login_calls = []
+        self._post_login_results = []
+
+        # A fresh session keeps cookies isolated per login while the
+        # mounted adapter reuses pooled connections to the server
+        self.session = requests.Session()
+        self.session.mount(
+            'https://{host_server}/'.format(host_server=host_server),
+            connection_pools.get_adapter(host_server, pool_size, keep_alive)
+        )
 
     def authenticate(self, user, password):
         """
-        Authenticates user on freeipa backend and returns the session response
+        Authenticates user on freeipa backend and returns the session response.
+        user_data is only fetched once it is accessed.
         :param user: string
         :param password: string
         :return: session response
         """
-        url_template = 'https://{host_server}/ipa/session/login_password'
-        ipa_login_url = url_template.format(host_server=self.host_server)
-
-        # Add the referer header
-        self.login_headers['referer'] = ipa_login_url
-
         # Set POST data
         login_data = {'user': user, 'password': password}
 
         logger.debug("User is attempting to authenticate via FreeIPA...")
 
-        response = self.session.post(
-            ipa_login_url,
-            headers=self.login_headers,
-            data=login_data,
-            verify=self.ssl_verify,
-            timeout=self.server_timeout
-        )
+        with timed('freeipa_auth_login', server=self.host_server) as outcome:
+            response = self.session.post(
+                self.template.login_url,
+                headers=self.template.login_headers,
+                data=login_data,
+                verify=self.ssl_verify,
+                timeout=self.server_timeout
+            )
+            if response.status_code != 200:
+                outcome['outcome'] = 'failure'
 
         self.user = user
-        # If user is authenticated, get user_data from the freeipa server
         if response.status_code == 200:
             logger.info("User successfully authenticated via FreeIPA")
             self.user_is_authenticated = True
-            self.user_data = self._get_user_data()
         else:
             logger.info("User failed to authenticate via FreeIPA")
 
         return response
 
+    def cancel(self):
+        """
+        Abandon this session, e.g. when a hedged login on another server
+        won. Pending follow up requests are skipped. The pooled connections
+        are shared and stay open.
+        """
+        self.cancelled = True
+
     def make_session_request(self, post_data):
         """
         Base POST request once user is authenticated
@@ -82,45 +309,151 @@ class FreeIpaSession(object):
         :return:
         """
 
-        url_template = 'https://{host_server}/ipa/session/json'
-        ipa_session_url = url_template.format(host_server=self.host_server)
+        debug_message = 'Making {method} request to {url}'
+        logger.debug(debug_message.format(method=post_data['method'],
+                                          url=self.template.session_url))
+
+        with timed('freeipa_auth_request', server=self.host_server,
+                   method=post_data['method']):
+            request = self.session.post(
+                self.template.session_url,
+                headers=self.template.session_headers,
+                data=build_session_payload(post_data),
+                verify=self.ssl_verify,
+                timeout=self.server_timeout
+            )
+            if request.status_code == 401:
+                raise FreeIpaSessionExpired(
+                    "FreeIPA session on {server} expired".format(
+                        server=self.host_server),
+                    response=request
+                )
+            results = decode_response(request)
 
-        # Set the referer header
-        self.session_headers['referer'] = ipa_session_url
+        return results
 
-        # Update session POST data with user specific data
-        self.session_post_data.update({'method': post_data['method'],
-                                       'params': [
-                                           post_data['item'],
-                                           post_data['params']
-                                       ]})
+    def export_cookie(self):
+        """
+        Returns the IPA session cookie of an authenticated session
+        :return: dict with value, domain and path or None
+        """
+        for cookie in self.session.cookies:
+            if cookie.name == IPA_SESSION_COOKIE:
+                return {'value': cookie.value, 'domain': cookie.domain,
+                        'path': cookie.path}
+        return None
 
-        debug_message = 'Making {method} request to {url}'
-        logger.debug(debug_message.format(method=post_data['method'],
-                                          url=ipa_session_url))
-
-        request = self.session.post(
-            ipa_session_url,
-            headers=self.session_headers,
-            data=json.dumps(self.session_post_data),
-            verify=self.ssl_verify,
-            timeout=5
+    @classmethod
+    def from_cookie(cls, host_server, user, cookie, **kwargs):
+        """
+        Rebuild an authenticated session from an exported session cookie,
+        skipping the password login
+        :param host_server: server the cookie was issued by
+        :param user: username the session belongs to
+        :param cookie: dict returned by export_cookie
+        :return: FreeIpaSession
+        """
+        ipa_session = cls(host_server, **kwargs)
+        ipa_session.session.cookies.set(
+            IPA_SESSION_COOKIE, cookie['value'],
+            domain=cookie['domain'], path=cookie['path']
         )
+        ipa_session.user = user
+        ipa_session.user_is_authenticated = True
+        return ipa_session
 
-        results = request.json()
-        return results
+    def batch(self):
+        """
+        Returns a batch to queue calls sent in a single round trip
+        :return: FreeIpaBatch
+        """
+        return FreeIpaBatch(self)
+
+    def make_batch_request(self, calls):
+        """
+        Send several calls as one freeipa batch request
+        :param calls: List of post_data dicts with method, item and params
+        :return: List of results matching the calls. Each result holds
+                 either the call's result or its error.
+        """
+        response = self.make_session_request(build_batch_post_data(calls))
+        return response['result']['results']
+
+    @property
+    def user_post_data(self):
+        """
+        user_show request for the current user
+        :return: post_data dict
+        """
+        return {'method': 'user_show',
+                'item': [self.user],
+                'params': dict(self.user_show_params)}
+
+    @property
+    def user_data(self):
+        """
+        The user's user_show record, fetched from the server on first access
+        :return: dict, empty unless authenticated
+        """
+        if self._user_data is None:
+            return self.load_user_data()
+        return self._user_data
+
+    @user_data.setter
+    def user_data(self, user_data):
+        self._user_data = user_data
+
+    @property
+    def has_user_data(self):
+        """Whether user_data was fetched or set already"""
+        return self._user_data is not None
+
+    @property
+    def post_login_results(self):
+        """
+        Results of post_login_calls, fetched along with user_data
+        :return: List of results
+        """
+        if self._user_data is None and self.post_login_calls:
+            self.load_user_data()
+        return self._post_login_results
+
+    @post_login_results.setter
+    def post_login_results(self, results):
+        self._post_login_results = results
+
+    def load_user_data(self):
+        """
+        Fetch user_data unless it was fetched already. Nothing is fetched
+        for unauthenticated or cancelled sessions.
+        :return: dict
+        """
+        if self._user_data is None:
+            if not self.user_is_authenticated or self.cancelled:
+                return {}
+            if self.user_data_loader is not None:
+                self._user_data = self.user_data_loader(self)
+            else:
+                self._user_data = self._get_user_data()
+        return self._user_data
 
     def _get_user_data(self):
         """
-        Internal method to grab user data on freeipa server upon authentication
+        Internal method to grab user data on freeipa server after login.
+        Any post login calls are sent in the same batch request.
         :return:
         """
 
-        self.user_post_data['item'] = [self.user]
-
         if self.user_is_authenticated:
-            response = self.make_session_request(self.user_post_data)
-            return response['result']['result']
+            if not self.post_login_calls:
+                response = self.make_session_request(self.user_post_data)
+                return response['result']['result']
+
+            results = self.make_batch_request(
+                [self.user_post_data] + list(self.post_login_calls)
+            )
+            self.post_login_results = results[1:]
+            return results[0]['result']
         return {}
 
     @property
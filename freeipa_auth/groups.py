@@ -0,0 +1,116 @@
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class GroupHierarchy(object):
+
+    """
+    DAG of freeipa groups with the precomputed transitive closure of the
+    groups each group is a member of, directly or through nesting.
+    """
+
+    def __init__(self, parents):
+        """
+        :param parents: dict of group to the groups it is a direct member of
+        """
+        self.parents = parents
+        self.ancestors = {}
+        for group in parents:
+            self.ancestors[group] = self._closure(group)
+
+    @classmethod
+    def from_records(cls, records):
+        """
+        Build the hierarchy from group_find records
+        :param records: List of group records with cn and memberof_group
+        :return: GroupHierarchy
+        """
+        return cls(dict(
+            (record['cn'][0], list(record.get('memberof_group', [])))
+            for record in records
+        ))
+
+    def _closure(self, group):
+        ancestors = set()
+        stack = list(self.parents.get(group, []))
+        while stack:
+            parent = stack.pop()
+            if parent in ancestors:
+                continue
+            ancestors.add(parent)
+            known = self.ancestors.get(parent)
+            if known is not None:
+                ancestors.update(known)
+            else:
+                stack.extend(self.parents.get(parent, []))
+        ancestors.discard(group)
+        return frozenset(ancestors)
+
+    def effective_groups(self, groups):
+        """
+        Direct groups and every group they are nested in
+        :param groups: direct group memberships
+        :return: set of groups
+        """
+        effective = set(groups)
+        for group in groups:
+            effective.update(self.ancestors.get(group, ()))
+        return effective
+
+
+class GroupHierarchyIndex(object):
+
+    """
+    Process wide group hierarchy, reloaded once it is older than max_age.
+    While one thread reloads, the others keep using the previous hierarchy.
+    """
+
+    def __init__(self):
+        self._hierarchy = None
+        self._loaded_at = None
+        self._lock = threading.Lock()
+
+    def _fresh(self, max_age):
+        return self._hierarchy is not None and \
+            time.monotonic() - self._loaded_at < max_age
+
+    def get(self, loader, max_age):
+        """
+        Returns the cached hierarchy, reloading it when stale. Only the
+        first load blocks, later reloads are left to a single caller while
+        the others get the stale hierarchy. If a reload fails the previous
+        hierarchy keeps being used.
+        :param loader: callable returning a GroupHierarchy
+        :param max_age: seconds between reloads
+        :return: GroupHierarchy
+        """
+        if self._fresh(max_age):
+            return self._hierarchy
+        hierarchy = self._hierarchy
+        if not self._lock.acquire(blocking=hierarchy is None):
+            # Another thread is reloading
+            return hierarchy
+        try:
+            if not self._fresh(max_age):
+                try:
+                    self._hierarchy = loader()
+                except Exception:
+                    if self._hierarchy is None:
+                        raise
+                    logger.exception(
+                        "Could not refresh FreeIPA group hierarchy")
+                self._loaded_at = time.monotonic()
+            return self._hierarchy
+        finally:
+            self._lock.release()
+
+    def clear(self):
+        with self._lock:
+            self._hierarchy = None
+            self._loaded_at = None
+
+
+group_hierarchy = GroupHierarchyIndex()
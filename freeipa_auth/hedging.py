@@ -0,0 +1,143 @@
+import asyncio
+import logging
+import threading
+import time
+
+from collections import namedtuple
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+logger = logging.getLogger(__name__)
+
+# A hedged attempt, with how long to wait on it before starting the next
+HedgedAttempt = namedtuple('HedgedAttempt', ['run', 'cancel', 'delay'])
+
+
+class HedgingExecutor(object):
+
+    """Process wide thread pool running hedged requests"""
+
+    def __init__(self):
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def get(self, max_workers):
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(
+                        max_workers=max_workers,
+                        thread_name_prefix='freeipa-auth-hedge'
+                    )
+        return self._executor
+
+
+hedging_executor = HedgingExecutor()
+
+
+class _StartedAttempt(object):
+
+    """Runs an attempt, noting when a worker thread picked it up"""
+
+    def __init__(self, attempt):
+        self.attempt = attempt
+        self.started_at = None
+
+    def __call__(self):
+        self.started_at = time.monotonic()
+        return self.attempt.run()
+
+    def timeout(self):
+        """Seconds left of the attempt's delay, the full delay if queued"""
+        if self.started_at is None:
+            return self.attempt.delay
+        return max(0, self.started_at + self.attempt.delay - time.monotonic())
+
+
+def run_hedged(attempts, executor, retry_on=(Exception,)):
+    """
+    Run attempts one after the other, starting the next attempt as soon as
+    the running ones failed or have not finished within the delay for them.
+    The delay of an attempt only starts once it runs, so attempts queued
+    behind a busy executor are not hedged before reaching the server.
+    The first attempt to succeed wins and every other attempt is cancelled.
+    :param attempts: List of HedgedAttempt
+    :param executor: concurrent.futures executor
+    :param retry_on: exceptions after which the next attempt is started
+    :return: result of the winning attempt
+    """
+    remaining = list(attempts)
+    pending = {}
+    error = None
+    timed_out = False
+
+    try:
+        while True:
+            if remaining and (timed_out or not pending):
+                attempt = remaining.pop(0)
+                latest = _StartedAttempt(attempt)
+                pending[executor.submit(latest)] = attempt
+
+            if not pending:
+                break
+
+            done, _ = wait(pending,
+                           timeout=latest.timeout() if remaining else None,
+                           return_when=FIRST_COMPLETED)
+            timed_out = not done and latest.started_at is not None and \
+                latest.timeout() == 0
+
+            for future in done:
+                pending.pop(future)
+                try:
+                    return future.result()
+                except retry_on as e:
+                    error = e
+    finally:
+        for future, attempt in pending.items():
+            future.cancel()
+            attempt.cancel()
+
+    raise error
+
+
+async def arun_hedged(attempts, retry_on=(Exception,)):
+    """
+    Asyncio twin of run_hedged. Attempts run coroutine functions and losing
+    attempts are cancelled outright.
+    :param attempts: List of HedgedAttempt
+    :param retry_on: exceptions after which the next attempt is started
+    :return: result of the winning attempt
+    """
+    remaining = list(attempts)
+    pending = {}
+    error = None
+    timed_out = False
+
+    try:
+        while True:
+            if remaining and (timed_out or not pending):
+                attempt = remaining.pop(0)
+                pending[asyncio.ensure_future(attempt.run())] = attempt
+                delay = attempt.delay
+
+            if not pending:
+                break
+
+            done, _ = await asyncio.wait(
+                list(pending), timeout=delay if remaining else None,
+                return_when=asyncio.FIRST_COMPLETED
+            )
+            timed_out = not done
+
+            for task in done:
+                pending.pop(task)
+                try:
+                    return task.result()
+                except retry_on as e:
+                    error = e
+    finally:
+        for task, attempt in pending.items():
+            task.cancel()
+            attempt.cancel()
+
+    raise error
@@ -0,0 +1,90 @@
+import base64
+import hashlib
+import json
+import logging
+
+from django.conf import settings
+
+try:
+    from cryptography.fernet import Fernet, InvalidToken
+except ImportError:  # pragma: no cover
+    Fernet = None
+
+logger = logging.getLogger(__name__)
+
+SESSION_KEY = '_freeipa_auth_ipa_session'
+
+
+class IpaSessionStore(object):
+
+    """
+    Keeps the IPA session cookie of a login in the django session,
+    encrypted with a key derived from SECRET_KEY. Requires cryptography.
+    """
+
+    key_salt = 'freeipa_auth.ipa_sessions.IpaSessionStore'
+
+    def __init__(self, max_age, secret=None):
+        """
+        :param max_age: seconds a stored cookie is used, matching the
+            lifetime of IPA sessions
+        :param secret: defaults to SECRET_KEY
+        """
+        if Fernet is None:
+            raise ImportError(
+                "cryptography is required to store IPA sessions"
+            )
+        secret = secret or settings.SECRET_KEY
+        key = hashlib.sha256((self.key_salt + secret).encode()).digest()
+        self.fernet = Fernet(base64.urlsafe_b64encode(key))
+        self.max_age = max_age
+
+    def save(self, session, server, user, cookie):
+        """
+        Store an IPA session cookie
+        :param session: django session
+        :param server: server the cookie was issued by
+        :param user: username the cookie belongs to
+        :param cookie: dict returned by FreeIpaSession.export_cookie
+        """
+        data = json.dumps({'server': server, 'user': user, 'cookie': cookie})
+        session[SESSION_KEY] = self.fernet.encrypt(data.encode()).decode()
+
+    def load(self, session):
+        """
+        Returns the stored IPA session unless it is missing, tampered
+        with or older than max_age
+        :param session: django session
+        :return: dict with server, user and cookie or None
+        """
+        token = session.get(SESSION_KEY)
+        if not token:
+            return None
+        try:
+            data = self.fernet.decrypt(token.encode(), ttl=self.max_age)
+        except InvalidToken:
+            return None
+        return json.loads(data.decode())
+
+    def clear(self, session):
+        session.pop(SESSION_KEY, None)
+
+
+def store_ipa_session(sender, request, user, **kwargs):
+    """Save the IPA session of a freeipa login once django logged it in"""
+    ipa_session = getattr(user, 'ipa_session', None)
+    if ipa_session is None or getattr(request, 'session', None) is None:
+        return
+
+    from freeipa_auth.settings import get_settings
+    IpaSessionStore(get_settings().IPA_SESSION_MAX_AGE).save(
+        request.session, **ipa_session
+    )
+
+
+def connect_signals():
+    """Store IPA sessions of freeipa logins in the django session"""
+    from django.contrib.auth.signals import user_logged_in
+
+    user_logged_in.connect(store_ipa_session,
+                           dispatch_uid='freeipa_auth_store_ipa_session')
@@ -0,0 +1,61 @@
+import datetime
+import logging
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from django.utils import timezone
+
+from freeipa_auth.backends import FreeIpaRpcAuthBackend
+from freeipa_auth.sync import DirectorySync, get_active_usernames
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+
+    help = "Refresh attributes and group memberships of recently active " \
+           "FreeIPA users"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--active-hours', type=float, default=24,
+                            help="Refresh users who logged in within this "
+                                 "many hours")
+        parser.add_argument('--page-size', type=int, default=200,
+                            help="Users read from FreeIPA per request")
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help="Rows written per bulk query")
+        parser.add_argument('--interval', type=float, default=0,
+                            help="Keep running, refreshing every this many "
+                                 "seconds")
+
+    def handle(self, *args, **options):
+        if not options['interval']:
+            self.refresh(options)
+            return
+
+        while True:
+            try:
+                self.refresh(options)
+            except Exception:
+                # Keep running, the next round may reach freeipa again
+                logger.exception("FreeIPA user refresh failed")
+            close_old_connections()
+            time.sleep(options['interval'])
+
+    def refresh(self, options):
+        backend = FreeIpaRpcAuthBackend()
+        since = timezone.now() - datetime.timedelta(
+            hours=options['active_hours']
+        )
+        directory_sync = DirectorySync(
+            backend,
+            backend.get_service_session(),
+            page_size=options['page_size'],
+            batch_size=options['batch_size']
+        )
+        stats = directory_sync.sync_users(get_active_usernames(since))
+        self.stdout.write(
+            "Refreshed users: updated {updated}, unchanged {unchanged}, "
+            "skipped {skipped}".format(**stats)
+        )
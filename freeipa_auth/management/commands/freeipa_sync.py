@@ -0,0 +1,73 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from freeipa_auth.backends import FreeIpaRpcAuthBackend
+from freeipa_auth.sync import (
+    DirectorySync, DirectoryTruncated, IncrementalDirectorySync
+)
+
+
+class Command(BaseCommand):
+
+    help = "Sync every FreeIPA user and group membership into django"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--page-size', type=int, default=200,
+                            help="Users read from FreeIPA per request")
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help="Rows written per bulk query")
+        parser.add_argument('--create-groups', action='store_true',
+                            help="Create django groups for FreeIPA groups")
+        parser.add_argument('--incremental', action='store_true',
+                            help="Only sync users modified since the last "
+                                 "incremental run")
+        parser.add_argument('--reset', action='store_true',
+                            help="Forget the last incremental run first")
+        parser.add_argument('--state-file',
+                            help="File keeping the last incremental run, "
+                                 "instead of the django cache")
+        parser.add_argument('--cache-alias', default='default',
+                            help="Django cache keeping the last incremental "
+                                 "run")
+
+    def handle(self, *args, **options):
+        backend = FreeIpaRpcAuthBackend()
+        sync_options = {
+            'page_size': options['page_size'],
+            'batch_size': options['batch_size'],
+        }
+        sync_class = DirectorySync
+        if options['incremental']:
+            sync_class = IncrementalDirectorySync
+            sync_options.update(cache_alias=options['cache_alias'],
+                                state_file=options['state_file'])
+        directory_sync = sync_class(
+            backend,
+            backend.get_service_session(),
+            **sync_options
+        )
+
+        if options['incremental']:
+            if not directory_sync.is_state_durable():
+                raise CommandError(
+                    "The {alias} cache is local to this process and would "
+                    "forget the last incremental run, pass --state-file or "
+                    "a shared --cache-alias".format(
+                        alias=options['cache_alias'])
+                )
+            if options['reset']:
+                directory_sync.reset()
+
+        try:
+            if options['create_groups']:
+                created = directory_sync.sync_groups()
+                self.stdout.write(
+                    "Created {count} groups".format(count=created)
+                )
+
+            stats = directory_sync.sync_users()
+        except DirectoryTruncated as e:
+            raise CommandError(str(e))
+        self.stdout.write(
+            "Created {created}, updated {updated}, unchanged {unchanged}, "
+            "skipped {skipped} users".format(**stats)
+        )
@@ -0,0 +1,199 @@
+import logging
+import threading
+import time
+
+from collections import defaultdict
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+
+class MetricsSink(object):
+
+    """Base metrics sink, discarding everything it is given"""
+
+    def observe(self, name, value, **labels):
+        """
+        Record a timing in seconds
+        :param name: metric name
+        :param value: seconds
+        :param labels: metric labels, e.g. server
+        """
+
+    def increment(self, name, amount=1, **labels):
+        """
+        Increment a counter
+        :param name: metric name
+        :param amount: int
+        :param labels: metric labels, e.g. server
+        """
+
+
+class InMemoryMetricsSink(MetricsSink):
+
+    """Metrics sink keeping every observation in memory, meant for tests"""
+
+    def __init__(self):
+        self.observations = defaultdict(list)
+        self.counters = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def observe(self, name, value, **labels):
+        with self._lock:
+            self.observations[_key(name, labels)].append(value)
+
+    def increment(self, name, amount=1, **labels):
+        with self._lock:
+            self.counters[_key(name, labels)] += amount
+
+    def get_observations(self, name, **labels):
+        return list(self.observations.get(_key(name, labels), []))
+
+    def get_count(self, name, **labels):
+        return self.counters.get(_key(name, labels), 0)
+
+    def clear(self):
+        with self._lock:
+            self.observations.clear()
+            self.counters.clear()
+
+
+class PrometheusMetricsSink(MetricsSink):
+
+    """Metrics sink aggregating histograms and counters for Prometheus"""
+
+    buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+    def __init__(self, buckets=None):
+        if buckets is not None:
+            self.buckets = tuple(sorted(buckets))
+        self.histograms = {}
+        self.counters = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def observe(self, name, value, **labels):
+        key = _key(name, labels)
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = {
+                    'buckets': [0] * len(self.buckets), 'sum': 0, 'count': 0
+                }
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    histogram['buckets'][index] += 1
+            histogram['sum'] += value
+            histogram['count'] += 1
+
+    def increment(self, name, amount=1, **labels):
+        with self._lock:
+            self.counters[_key(name, labels)] += amount
+
+    @staticmethod
+    def _labels(labels, **extra):
+        labels = list(labels) + sorted(extra.items())
+        if not labels:
+            return ''
+        return '{' + ','.join(
+            '{name}="{value}"'.format(
+                name=name,
+                value=str(value).replace('\\', '\\\\').replace('"', '\\"'))
+            for name, value in labels
+        ) + '}'
+
+    def render(self):
+        """
+        Render every metric in the Prometheus text exposition format
+        :return: string
+        """
+        lines = []
+        with self._lock:
+            histograms = sorted(self.histograms.items())
+            counters = sorted(self.counters.items())
+
+        typed = set()
+        for (name, labels), histogram in histograms:
+            if name not in typed:
+                lines.append('# TYPE {name} histogram'.format(name=name))
+                typed.add(name)
+            for bound, count in zip(self.buckets, histogram['buckets']):
+                lines.append('{name}_bucket{labels} {count}'.format(
+                    name=name, labels=self._labels(labels, le=bound),
+                    count=count))
+            lines.append('{name}_bucket{labels} {count}'.format(
+                name=name, labels=self._labels(labels, le='+Inf'),
+                count=histogram['count']))
+            lines.append('{name}_sum{labels} {value}'.format(
+                name=name, labels=self._labels(labels),
+                value=histogram['sum']))
+            lines.append('{name}_count{labels} {count}'.format(
+                name=name, labels=self._labels(labels),
+                count=histogram['count']))
+
+        for (name, labels), count in counters:
+            if name not in typed:
+                lines.append('# TYPE {name} counter'.format(name=name))
+                typed.add(name)
+            lines.append('{name}{labels} {count}'.format(
+                name=name, labels=self._labels(labels), count=count))
+
+        return '\n'.join(lines) + '\n'
+
+
+class MetricsRegistry(object):
+
+    """Holds the process wide metrics sink"""
+
+    def __init__(self):
+        self.sink = MetricsSink()
+        self._path = None
+
+    def configure(self, path):
+        """
+        Use the sink class at the dotted path, keeping the current sink
+        if it was already configured from that path
+        :param path: dotted path or None to discard metrics
+        """
+        if path == self._path:
+            return
+        if path is None:
+            self.sink = MetricsSink()
+        else:
+            from django.utils.module_loading import import_string
+            self.sink = import_string(path)()
+        self._path = path
+
+
+metrics = MetricsRegistry()
+
+
+def get_sink():
+    """
+    Returns the process wide metrics sink
+    :return: MetricsSink
+    """
+    return metrics.sink
+
+
+@contextmanager
+def timed(name, **labels):
+    """
+    Record how long the block took, labelled with its outcome. The block
+    may set the outcome through the yielded dict, exceptions record error.
+    """
+    outcome = {'outcome': 'success'}
+    start = time.monotonic()
+    try:
+        yield outcome
+    except Exception:
+        outcome['outcome'] = 'error'
+        raise
+    finally:
+        labels['outcome'] = outcome['outcome']
+        sink = get_sink()
+        sink.observe(name + '_seconds', time.monotonic() - start, **labels)
+        sink.increment(name + '_total', **labels)
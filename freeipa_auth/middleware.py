@@ -0,0 +1,95 @@
+import logging
+import time
+
+import requests
+
+from django.contrib.auth import BACKEND_SESSION_KEY, logout
+from django.utils.module_loading import import_string
+
+from freeipa_auth.backends import FreeIpaRpcAuthBackend
+from freeipa_auth.settings import get_settings
+
+logger = logging.getLogger(__name__)
+
+VALIDATED_AT_KEY = '_freeipa_auth_validated_at'
+
+
+class FreeIpaSessionRevalidationMiddleware(object):
+
+    """
+    Logs out users whose freeipa account was disabled or removed since
+    they logged in, and keeps their django groups in line with freeipa
+    when FREEIPA_AUTH_UPDATE_USER_GROUPS is set. Each session is checked
+    at most once per FREEIPA_AUTH_SESSION_REVALIDATE_INTERVAL seconds.
+    Must come after AuthenticationMiddleware.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        self.revalidate(request)
+        return self.get_response(request)
+
+    def revalidate(self, request):
+        """
+        Check the freeipa account of the request's user if it is due
+        :param request: django request
+        """
+        interval = get_settings().SESSION_REVALIDATE_INTERVAL
+        if not interval or not request.user.is_authenticated:
+            return
+
+        backend = self.get_backend(request)
+        if backend is None:
+            return
+
+        now = time.time()
+        validated_at = request.session.get(VALIDATED_AT_KEY)
+        if validated_at is not None and now - validated_at < interval:
+            return
+        request.session[VALIDATED_AT_KEY] = now
+        if validated_at is None:
+            # Checked by the login itself
+            return
+
+        username = request.user.get_username()
+        try:
+            status = backend.get_account_status(username)
+        except requests.RequestException as e:
+            # e.g. unreachable servers or a rejected service login
+            logger.warning("FreeIPA account check failed, session not "
+                           "revalidated: {error}".format(error=e))
+            return
+        if status is None:
+            return
+
+        if not status.active:
+            logger.info("FreeIPA account {username} is disabled, logging "
+                        "out".format(username=username))
+            backend.invalidate_credentials(username)
+            logout(request)
+            return
+
+        if backend.settings.UPDATE_USER_GROUPS:
+            changed_fields = backend.update_user_groups(request.user,
+                                                        status.groups)
+            if changed_fields:
+                request.user.save(update_fields=changed_fields)
+
+    def get_backend(self, request):
+        """
+        Returns the freeipa backend the user logged in with
+        :param request: django request
+        :return: FreeIpaRpcAuthBackend or None for other backends
+        """
+        path = request.session.get(BACKEND_SESSION_KEY)
+        if not path:
+            return None
+        try:
+            backend_class = import_string(path)
+        except ImportError:
+            return None
+        if not issubclass(backend_class, FreeIpaRpcAuthBackend):
+            return None
+        return backend_class()
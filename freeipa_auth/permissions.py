@@ -0,0 +1,155 @@
+import hashlib
+import logging
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import Group, Permission
+from django.core.cache import caches
+
+from freeipa_auth.settings import get_settings
+
+logger = logging.getLogger(__name__)
+
+User = get_user_model()
+
+
+class PermissionCache(object):
+
+    """
+    Shared cache of permissions for users whose permissions come from their
+    groups. Users with the same group set share one group permission entry.
+    All keys carry a version which is bumped whenever permissions change.
+    """
+
+    key_prefix = 'freeipa_auth:permissions:'
+
+    def __init__(self, timeout, alias='default'):
+        self.timeout = timeout
+        self.cache = caches[alias]
+
+    def get_version(self):
+        version_key = self.key_prefix + 'version'
+        version = self.cache.get(version_key)
+        if version is None:
+            self.cache.add(version_key, 1, None)
+            version = self.cache.get(version_key, 1)
+        return version
+
+    def invalidate_all(self):
+        """Invalidate every cached permission, e.g. after a group changed"""
+        try:
+            self.cache.incr(self.key_prefix + 'version')
+        except ValueError:
+            self.cache.set(self.key_prefix + 'version', 2, None)
+
+    def _user_key(self, user_id):
+        return '{prefix}{version}:user:{user_id}'.format(
+            prefix=self.key_prefix, version=self.get_version(),
+            user_id=user_id)
+
+    def _groups_key(self, group_ids):
+        digest = hashlib.sha256(
+            ','.join(str(pk) for pk in group_ids).encode()).hexdigest()
+        return '{prefix}{version}:groups:{digest}'.format(
+            prefix=self.key_prefix, version=self.get_version(),
+            digest=digest)
+
+    def invalidate_user(self, user_id):
+        """Invalidate a user's cached groups and own permissions"""
+        self.cache.delete(self._user_key(user_id))
+
+    def get_user_entry(self, user_obj):
+        """
+        Returns the user's group ids and own permissions
+        :param user_obj: django user
+        :return: dict with group_ids and permissions
+        """
+        key = self._user_key(user_obj.pk)
+        entry = self.cache.get(key)
+        if entry is None:
+            entry = {
+                'group_ids': sorted(
+                    user_obj.groups.values_list('pk', flat=True)),
+                'permissions': self._permission_names(
+                    Permission.objects.filter(user=user_obj)),
+            }
+            self.cache.set(key, entry, self.timeout)
+        return entry
+
+    def get_group_permissions(self, group_ids):
+        """
+        Returns the permissions granted by a set of groups
+        :param group_ids: sorted group ids
+        :return: set of permission names
+        """
+        if not group_ids:
+            return set()
+        key = self._groups_key(group_ids)
+        permissions = self.cache.get(key)
+        if permissions is None:
+            permissions = self._permission_names(
+                Permission.objects.filter(group__in=group_ids))
+            self.cache.set(key, permissions, self.timeout)
+        return permissions
+
+    def _permission_names(self, queryset):
+        return set(
+            '{app_label}.{codename}'.format(app_label=app_label,
+                                            codename=codename)
+            for app_label, codename in queryset.values_list(
+                'content_type__app_label', 'codename').distinct()
+        )
+
+
+def get_permission_cache():
+    """
+    Returns the permission cache used to invalidate entries on changes
+    :return: PermissionCache or None if it is disabled
+    """
+    settings = get_settings()
+    if not settings.PERMISSION_CACHE_TTL:
+        return None
+    return PermissionCache(settings.PERMISSION_CACHE_TTL,
+                           alias=settings.CREDENTIAL_CACHE_ALIAS)
+
+
+def user_groups_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if not action.startswith('post_'):
+        return
+    permission_cache = get_permission_cache()
+    if permission_cache is None:
+        return
+    if not reverse:
+        permission_cache.invalidate_user(instance.pk)
+    elif pk_set:
+        for user_id in pk_set:
+            permission_cache.invalidate_user(user_id)
+    else:
+        permission_cache.invalidate_all()
+
+
+def permissions_changed(sender, **kwargs):
+    action = kwargs.get('action')
+    if action is not None and not action.startswith('post_'):
+        return
+    permission_cache = get_permission_cache()
+    if permission_cache is not None:
+        permission_cache.invalidate_all()
+
+
+def connect_signals():
+    """Invalidate cached permissions whenever memberships or grants change"""
+    from django.db.models.signals import m2m_changed, post_delete, post_save
+
+    m2m_changed.connect(user_groups_changed, sender=User.groups.through,
+                        dispatch_uid='freeipa_auth_user_groups')
+    m2m_changed.connect(user_groups_changed,
+                        sender=User.user_permissions.through,
+                        dispatch_uid='freeipa_auth_user_permissions')
+    m2m_changed.connect(permissions_changed, sender=Group.permissions.through,
+                        dispatch_uid='freeipa_auth_group_permissions')
+    for model in (Group, Permission):
+        post_save.connect(permissions_changed, sender=model,
+                          dispatch_uid='freeipa_auth_save_' + model.__name__)
+        post_delete.connect(permissions_changed, sender=model,
+                            dispatch_uid='freeipa_auth_delete_' +
+                            model.__name__)
@@ -0,0 +1,107 @@
+import logging
+import threading
+
+from collections import namedtuple
+
+logger = logging.getLogger(__name__)
+
+# Whether a freeipa account may keep its sessions, with its groups
+AccountStatus = namedtuple('AccountStatus', ['active', 'groups'])
+
+# Status of users missing from freeipa
+MISSING_ACCOUNT = AccountStatus(active=False, groups=())
+
+
+def is_account_locked(record):
+    """
+    Returns whether a user_show record is disabled. Older servers report
+    nsaccountlock as a list of strings, newer ones as a boolean.
+    :param record: user_show result
+    :return: bool
+    """
+    value = record.get('nsaccountlock', False)
+    if isinstance(value, list):
+        value = value[0] if value else False
+    if isinstance(value, str):
+        return value.upper() == 'TRUE'
+    return bool(value)
+
+
+class _Lookup(object):
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class _Batch(object):
+
+    def __init__(self):
+        self.lookups = {}
+        self.full = threading.Event()
+
+
+class AccountStatusBatcher(object):
+
+    """
+    Coalesces concurrent account status lookups within the process into
+    batched reads. The first caller waits up to window seconds for other
+    callers to join, then reads every queued username at once and hands
+    each caller its own result.
+    """
+
+    def __init__(self):
+        self._batch = None
+        self._lock = threading.Lock()
+
+    def get(self, username, fetch, window, max_size):
+        """
+        Returns the status of a user, read along with concurrent lookups
+        :param username: string
+        :param fetch: callable taking a list of usernames and returning a
+            dict of username to AccountStatus
+        :param window: seconds to wait for other lookups to join
+        :param max_size: usernames read at once
+        :return: AccountStatus or None if it could not be read
+        """
+        with self._lock:
+            batch = self._batch
+            leader = batch is None
+            if leader:
+                batch = self._batch = _Batch()
+            lookup = batch.lookups.get(username)
+            if lookup is None:
+                lookup = batch.lookups[username] = _Lookup()
+            if len(batch.lookups) >= max_size:
+                # Later lookups start the next batch
+                self._batch = None
+                batch.full.set()
+
+        if leader:
+            batch.full.wait(window)
+            with self._lock:
+                if self._batch is batch:
+                    self._batch = None
+            self._run(batch, fetch)
+
+        lookup.event.wait()
+        if lookup.error is not None:
+            raise lookup.error
+        return lookup.result
+
+    def _run(self, batch, fetch):
+        try:
+            statuses = fetch(list(batch.lookups))
+        except Exception as e:
+            for lookup in batch.lookups.values():
+                lookup.error = e
+        else:
+            for username, lookup in batch.lookups.items():
+                lookup.result = statuses.get(username)
+        finally:
+            for lookup in batch.lookups.values():
+                lookup.event.set()
+
+
+account_status_batcher = AccountStatusBatcher()
@@ -0,0 +1,164 @@
+import logging
+import threading
+import time
+
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+
+class ServerHealth(object):
+
+    """
+    Circuit breaker and latency tracking for a single freeipa server,
+    fed passively from the outcome of real requests.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    # Weight of the newest sample in the latency moving average
+    latency_weight = 0.3
+
+    # Number of recent latency samples kept for percentiles
+    max_samples = 100
+
+    def __init__(self, host_server, failure_threshold=3, cooldown=30):
+        self.host_server = host_server
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = None
+        self.latency = None
+        self.samples = deque(maxlen=self.max_samples)
+
+    def available(self, now):
+        """
+        Whether a request may be sent to the server. Once the cooldown
+        has passed an open circuit lets a single probe request through.
+        A probe that reported no outcome within another cooldown, e.g.
+        because a faster server took the request, is offered again.
+        :param now: monotonic time
+        :return: bool
+        """
+        if self.state == self.CLOSED:
+            return True
+        if now - self.opened_at >= self.cooldown:
+            logger.info("Probing FreeIPA server: {server}".format(
+                server=self.host_server))
+            self.state = self.HALF_OPEN
+            self.opened_at = now
+            return True
+        return False
+
+    def record_success(self, latency):
+        if self.state != self.CLOSED:
+            logger.info("FreeIPA server is healthy again: {server}".format(
+                server=self.host_server))
+        self.state = self.CLOSED
+        self.failures = 0
+        self.samples.append(latency)
+        if self.latency is None:
+            self.latency = latency
+        else:
+            self.latency += self.latency_weight * (latency - self.latency)
+
+    def latency_percentile(self, percentile):
+        """
+        Returns the given percentile of recent latencies
+        :param percentile: 0 - 100
+        :return: seconds or None without samples
+        """
+        if not self.samples:
+            return None
+        samples = sorted(self.samples)
+        index = int(round(percentile / 100.0 * (len(samples) - 1)))
+        return samples[index]
+
+    def record_failure(self, now):
+        self.failures += 1
+        if self.state == self.HALF_OPEN or \
+                self.failures >= self.failure_threshold:
+            if self.state != self.OPEN:
+                logger.critical(
+                    "FreeIPA server marked unhealthy: {server}".format(
+                        server=self.host_server))
+            self.state = self.OPEN
+            self.opened_at = now
+
+
+class ServerPool(object):
+
+    """Health aware set of freeipa servers ranked by observed latency"""
+
+    def __init__(self, servers, failure_threshold=3, cooldown=30):
+        self.servers = list(servers)
+        self.health = dict(
+            (server, ServerHealth(server, failure_threshold, cooldown))
+            for server in self.servers
+        )
+        self._lock = threading.Lock()
+
+    def candidates(self):
+        """
+        Servers that may currently be used, fastest first. Servers without
+        latency samples yet rank first, in configured order.
+        :return: List of servers
+        """
+        now = time.monotonic()
+        with self._lock:
+            available = [server for server in self.servers
+                         if self.health[server].available(now)]
+
+        def rank(server):
+            latency = self.health[server].latency
+            return (latency or 0, self.servers.index(server))
+
+        return sorted(available, key=rank)
+
+    def hedge_delay(self, server, percentile, default):
+        """
+        How long to wait on a server before hedging to the next one
+        :param server:
+        :param percentile: latency percentile of the server to wait for
+        :param default: delay used until the server has latency samples
+        :return: seconds
+        """
+        with self._lock:
+            delay = self.health[server].latency_percentile(percentile)
+        return default if delay is None else delay
+
+    def record_success(self, server, latency):
+        with self._lock:
+            self.health[server].record_success(latency)
+
+    def record_failure(self, server):
+        with self._lock:
+            self.health[server].record_failure(time.monotonic())
+
+
+class ServerPoolRegistry(object):
+
+    """Process wide registry of server pools, keyed by their configuration"""
+
+    def __init__(self):
+        self._pools = {}
+        self._lock = threading.Lock()
+
+    def get_pool(self, servers, failure_threshold=3, cooldown=30):
+        key = (tuple(servers), failure_threshold, cooldown)
+        with self._lock:
+            pool = self._pools.get(key)
+            if pool is None:
+                pool = ServerPool(servers, failure_threshold, cooldown)
+                self._pools[key] = pool
+        return pool
+
+    def clear(self):
+        with self._lock:
+            self._pools = {}
+
+
+server_pools = ServerPoolRegistry()
@@ -0,0 +1,121 @@
+import logging
+import threading
+import time
+
+import requests
+
+from freeipa_auth.freeipa_utils import FreeIpaBatch, FreeIpaSessionExpired
+
+logger = logging.getLogger(__name__)
+
+
+class ServiceSession(object):
+
+    """
+    Long lived service account session shared by every directory read.
+    It logs in lazily, logs in again once the IPA session expired or is
+    older than max_age, and otherwise offers the FreeIpaSession request
+    methods.
+    """
+
+    def __init__(self, login, max_age=None):
+        """
+        :param login: callable returning an authenticated FreeIpaSession
+        :param max_age: seconds before logging in again, None to keep the
+            session until the server rejects it
+        """
+        self._login = login
+        self.max_age = max_age
+        self._session = None
+        self._logged_in_at = None
+        self._lock = threading.Lock()
+
+    def _fresh(self):
+        if self._session is None:
+            return False
+        if self.max_age is None:
+            return True
+        return time.monotonic() - self._logged_in_at < self.max_age
+
+    def get_session(self):
+        """
+        Returns the authenticated service session, logging in if needed
+        :return: FreeIpaSession
+        """
+        with self._lock:
+            if not self._fresh():
+                logger.debug("Logging in FreeIPA service account")
+                self._session = self._login()
+                self._logged_in_at = time.monotonic()
+            return self._session
+
+    def expire(self, session=None):
+        """
+        Drop the session so the next read logs in again
+        :param session: only drop the session if it is still this one
+        """
+        with self._lock:
+            if session is None or session is self._session:
+                self._session = None
+
+    def call(self, func):
+        """
+        Run func with the service session, logging in again once
+        if the session expired on the server
+        :param func: callable taking a FreeIpaSession
+        """
+        session = self.get_session()
+        try:
+            return func(session)
+        except FreeIpaSessionExpired:
+            logger.info("FreeIPA service session expired, logging in again")
+            self.expire(session)
+            return func(self.get_session())
+        except (requests.ConnectionError, requests.Timeout):
+            # The next read logs in on the healthiest server
+            self.expire(session)
+            raise
+
+    def make_session_request(self, post_data):
+        return self.call(
+            lambda session: session.make_session_request(post_data)
+        )
+
+    def make_batch_request(self, calls):
+        return self.call(lambda session: session.make_batch_request(calls))
+
+    def batch(self):
+        """
+        Returns a batch to queue calls sent in a single round trip
+        :return: FreeIpaBatch
+        """
+        return FreeIpaBatch(self)
+
+
+class ServiceSessionRegistry(object):
+
+    """Process wide service sessions, one per server list and account"""
+
+    def __init__(self):
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    def get(self, key, factory):
+        """
+        Returns the service session for key, creating it with factory
+        :param key: hashable, e.g. servers and service user
+        :param factory: callable returning a ServiceSession
+        :return: ServiceSession
+        """
+        with self._lock:
+            session = self._sessions.get(key)
+            if session is None:
+                session = self._sessions[key] = factory()
+            return session
+
+    def clear(self):
+        with self._lock:
+            self._sessions = {}
+
+
+service_sessions = ServiceSessionRegistry()
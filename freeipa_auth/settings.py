@@ -0,0 +1,190 @@
+import logging
+import threading
+
+from django.core.exceptions import ImproperlyConfigured
+from django.core.signals import setting_changed
+
+from freeipa_auth.freeipa_utils import (
+    USER_SHOW_PARAMS, get_request_template, get_user_show_params
+)
+from freeipa_auth.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+PREFIX = 'FREEIPA_AUTH_'
+
+
+def make_attr_getter(key):
+    """
+    Returns a getter for a freeipa attribute, taking the last value of
+    multi valued attributes. Missing attributes raise KeyError.
+    :param key: freeipa attribute name
+    :return: callable taking a user_show record
+    """
+    def getter(record):
+        value = record[key]
+        if isinstance(value, list):
+            value = value[-1]
+        return value
+    return getter
+
+
+class FreeIpaAuthSettings(object):
+
+    defaults = {
+        'BACKEND_ENABLED': True,
+        'SERVER': None,
+        'FAILOVER_SERVER': None,
+        'SERVERS': None,
+        'CIRCUIT_BREAKER_THRESHOLD': 3,
+        'CIRCUIT_BREAKER_COOLDOWN': 30,
+        'HEDGE_REQUESTS': False,
+        'HEDGE_PERCENTILE': 95,
+        'HEDGE_DELAY': 1,
+        'HEDGE_MAX_WORKERS': 20,
+        'SSL_VERIFY': True,
+        'UPDATE_USER_GROUPS': False,
+        'USER_ATTRS_MAP': {
+            'first_name': 'givenname',
+            'last_name': 'sn',
+            'email': 'mail'
+        },
+        'ALWAYS_UPDATE_USER': True,
+        'DEFER_USER_SYNC': False,
+        'DEFER_USER_SYNC_WORKERS': 4,
+        'DEFER_USER_SYNC_QUEUE': 100,
+        'SERVER_TIMEOUT': 5,
+        'USER_SHOW_ALL': False,
+        'POOL_SIZE': 10,
+        'POOL_KEEP_ALIVE': True,
+        'CREDENTIAL_CACHE_TTL': 0,
+        'CREDENTIAL_CACHE_ALIAS': 'default',
+        'USER_DATA_MAX_AGE': 0,
+        'SERVICE_USER': None,
+        'SERVICE_PASSWORD': None,
+        'SERVICE_DIRECTORY_READS': False,
+        'GROUP_HIERARCHY_INDEX': False,
+        'GROUP_HIERARCHY_REFRESH': 300,
+        'PERMISSION_CACHE_TTL': 0,
+        'COALESCE_LOGINS': False,
+        'THROTTLE_USERNAME_RATE': 0,
+        'THROTTLE_USERNAME_BURST': 10,
+        'THROTTLE_IP_RATE': 0,
+        'THROTTLE_IP_BURST': 50,
+        'METRICS_SINK': None,
+        'STORE_IPA_SESSION': False,
+        'IPA_SESSION_MAX_AGE': 1200,
+        'SESSION_REVALIDATE_INTERVAL': 0,
+        'ACCOUNT_STATUS_CACHE_TTL': 60,
+        'ACCOUNT_STATUS_BATCH_WINDOW': 0.05,
+        'ACCOUNT_STATUS_BATCH_SIZE': 50,
+    }
+
+    def __init__(self, prefix=PREFIX):
+        """
+        Load FreeIPA Auth settings and set defaults
+        if they do not exists
+        """
+        from django.conf import settings
+
+        for name, default in self.defaults.items():
+            value = getattr(settings, prefix + name, default)
+            setattr(self, name, value)
+
+        # SERVER and FAILOVER_SERVER are the short form of SERVERS
+        if self.SERVERS is None:
+            self.SERVERS = [self.SERVER]
+            if self.FAILOVER_SERVER:
+                self.SERVERS.append(self.FAILOVER_SERVER)
+
+        self.validate()
+
+        # Precomputed for the login hot path
+        for server in self.SERVERS:
+            if server:
+                get_request_template(server)
+        self.user_attr_getters = tuple(
+            (attr, make_attr_getter(key))
+            for attr, key in self.USER_ATTRS_MAP.items()
+        )
+        if self.USER_SHOW_ALL:
+            self.user_show_params = USER_SHOW_PARAMS
+        else:
+            # Group lists are only read when memberships are synced
+            self.user_show_params = get_user_show_params(
+                self.USER_ATTRS_MAP.values(),
+                members=self.UPDATE_USER_GROUPS
+            )
+
+        if self.METRICS_SINK:
+            metrics.configure(self.METRICS_SINK)
+
+        if len(self.SERVERS) < 2:
+            logger.warning(
+                "FreeIPA Failover Server is not set. Proceed with caution."
+            )
+
+    def validate(self):
+        """Raise ImproperlyConfigured for settings that cannot work"""
+        if not isinstance(self.SERVERS, (list, tuple)):
+            raise ImproperlyConfigured(
+                "FREEIPA_AUTH_SERVERS must be a list of servers"
+            )
+        if not isinstance(self.USER_ATTRS_MAP, dict):
+            raise ImproperlyConfigured(
+                "FREEIPA_AUTH_USER_ATTRS_MAP must be a dict of django user "
+                "fields to freeipa attributes"
+            )
+        if not 0 < self.HEDGE_PERCENTILE <= 100:
+            raise ImproperlyConfigured(
+                "FREEIPA_AUTH_HEDGE_PERCENTILE must be between 0 and 100"
+            )
+        if self.SESSION_REVALIDATE_INTERVAL and not self.SERVICE_USER:
+            raise ImproperlyConfigured(
+                "FREEIPA_AUTH_SERVICE_USER is required to revalidate sessions"
+            )
+
+
+class SettingsRegistry(object):
+
+    """
+    Holds the FreeIPA Auth settings, loaded once and reloaded whenever
+    a FREEIPA_AUTH_ setting changes
+    """
+
+    def __init__(self):
+        self._settings = None
+        self._lock = threading.Lock()
+
+    def get(self):
+        settings = self._settings
+        if settings is None:
+            with self._lock:
+                if self._settings is None:
+                    self._settings = FreeIpaAuthSettings()
+                settings = self._settings
+        return settings
+
+    def clear(self):
+        with self._lock:
+            self._settings = None
+
+
+auth_settings = SettingsRegistry()
+
+
+def get_settings():
+    """
+    Returns the process wide FreeIPA Auth settings
+    :return: FreeIpaAuthSettings
+    """
+    return auth_settings.get()
+
+
+def reload_settings(setting, **kwargs):
+    if setting.startswith(PREFIX):
+        auth_settings.clear()
+
+
+setting_changed.connect(reload_settings,
+                        dispatch_uid='freeipa_auth_reload_settings')
@@ -0,0 +1,116 @@
+import asyncio
+import copy
+import hashlib
+import hmac
+import threading
+import weakref
+
+from django.conf import settings
+from django.utils.encoding import force_bytes
+
+
+def login_key(username, password):
+    """
+    Key of a login attempt. The password only enters as an HMAC keyed
+    with SECRET_KEY, so attempts with different passwords never share
+    a result. The key is kept in memory only.
+    :param username: string
+    :param password: string
+    :return: tuple
+    """
+    fingerprint = hmac.new(force_bytes(settings.SECRET_KEY),
+                           force_bytes(password), hashlib.sha256).hexdigest()
+    return username, fingerprint
+
+
+class _Call(object):
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight(object):
+
+    """
+    Coalesces concurrent calls with the same key within the process. The
+    first caller runs the call while later callers wait for it and share
+    its result or exception. Each waiter gets its own shallow copy of the
+    result, so e.g. a user instance is never shared between requests.
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self._async_calls = weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+
+    def do(self, key, func):
+        """
+        Run func unless a call with the same key is in flight, in which
+        case wait for that call instead
+        :param key: hashable
+        :param func: callable without arguments
+        :return: result of the call
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return copy.copy(call.result)
+
+        try:
+            call.result = func()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.event.set()
+        return call.result
+
+    async def ado(self, key, func):
+        """
+        Async twin of do, coalescing calls on the running event loop
+        :param key: hashable
+        :param func: coroutine function without arguments
+        :return: result of the call
+        """
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            calls = self._async_calls.setdefault(loop, {})
+            future = calls.get(key)
+            leader = future is None
+            if leader:
+                future = calls[key] = loop.create_future()
+
+        if not leader:
+            # A cancelled waiter must not cancel the shared call
+            return copy.copy(await asyncio.shield(future))
+
+        try:
+            result = await func()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            # Retrieved here so a call without waiters logs no warning
+            future.exception()
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del calls[key]
+
+
+login_flights = SingleFlight()
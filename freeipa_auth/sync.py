@@ -0,0 +1,376 @@
+import logging
+import os
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import UNUSABLE_PASSWORD_PREFIX
+from django.contrib.auth.models import Group
+from django.core.cache import caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+
+from freeipa_auth.permissions import get_permission_cache
+
+logger = logging.getLogger(__name__)
+
+User = get_user_model()
+
+
+class DirectoryTruncated(Exception):
+
+    """
+    freeipa returned only part of a listing, e.g. because the server's
+    size limit for the service account is lower than the directory
+    """
+
+
+def chunks(items, size):
+    """Yield successive lists of at most size items"""
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def get_modify_timestamp(record):
+    """
+    Returns the modification time of a freeipa record as a sortable
+    generalized time string, e.g. 20240131120000Z
+    :param record: freeipa record
+    :return: string or None
+    """
+    value = record.get('modifytimestamp')
+    if isinstance(value, list):
+        value = value[0] if value else None
+    if isinstance(value, dict):
+        value = value.get('__datetime__')
+    return value
+
+
+def get_active_usernames(since):
+    """
+    Usernames of freeipa users who logged in since a point in time.
+    Freeipa users are the django users without a usable password.
+    :param since: datetime
+    :return: List of usernames
+    """
+    return list(User.objects.filter(
+        last_login__gte=since,
+        password__startswith=UNUSABLE_PASSWORD_PREFIX
+    ).order_by('pk').values_list(User.USERNAME_FIELD, flat=True))
+
+
+class DirectorySync(object):
+
+    """
+    Bulk sync of freeipa users and their group memberships into django.
+    Directory records are read one page per batch request and written with
+    bulk_create / bulk_update in bounded batches, so memory stays flat for
+    large directories.
+    """
+
+    def __init__(self, backend, session, page_size=200, batch_size=500):
+        """
+        :param backend: FreeIpaRpcAuthBackend providing settings and mapping
+        :param session: authenticated FreeIpaSession used for directory reads
+        :param page_size: users read per batch request
+        :param batch_size: rows written per bulk query
+        """
+        self.backend = backend
+        self.settings = backend.settings
+        self.session = session
+        self.page_size = page_size
+        self.batch_size = batch_size
+        self.stats = {'created': 0, 'updated': 0, 'unchanged': 0,
+                      'skipped': 0}
+        self._group_ids = None
+
+    def find(self, method, params=None):
+        """
+        Run a *_find call for primary keys only
+        :param method: user_find or group_find
+        :return: List of primary keys
+        :raise DirectoryTruncated: if the server did not list every entry
+        """
+        find_params = {'pkey_only': True}
+        find_params.update(params or {})
+        key = 'uid' if method == 'user_find' else 'cn'
+        return [entry[key][0]
+                for entry in self.find_entries(method, find_params)]
+
+    def find_entries(self, method, params):
+        """
+        Run a *_find call without a client side size limit
+        :param method: user_find or group_find
+        :param params: dict of options
+        :return: List of entries
+        :raise DirectoryTruncated: if the server did not list every entry
+        """
+        response = self.session.make_session_request({
+            'method': method, 'item': [], 'params': dict(params, sizelimit=0)
+        })
+        if response['result'].get('truncated'):
+            raise DirectoryTruncated(
+                "FreeIPA truncated the {method} listing, raise the search "
+                "size limit of the service account".format(method=method)
+            )
+        return response['result']['result']
+
+    def iter_user_pages(self, uids):
+        """
+        Yield pages of user_show records, one batch request per page
+        :param uids: iterable of usernames
+        """
+        for page in chunks(uids, self.page_size):
+            batch = self.session.batch()
+            for uid in page:
+                batch.add('user_show', [uid],
+                          dict(self.settings.user_show_params))
+
+            records = []
+            for uid, result in zip(page, batch.execute()):
+                if result.get('error'):
+                    logger.warning("Could not read FreeIPA user {uid}: "
+                                   "{error}".format(uid=uid,
+                                                    error=result['error']))
+                    self.stats['skipped'] += 1
+                    continue
+                records.append(result['result'])
+            yield records
+
+    def sync_groups(self):
+        """
+        Create django groups for every freeipa group missing in django
+        :return: number of created groups
+        """
+        names = set(self.find('group_find'))
+        existing = set(Group.objects.filter(name__in=names)
+                       .values_list('name', flat=True))
+        Group.objects.bulk_create(
+            [Group(name=name) for name in sorted(names - existing)],
+            batch_size=self.batch_size
+        )
+        self._group_ids = None
+        return len(names - existing)
+
+    def sync_users(self, uids=None):
+        """
+        Create or update django users from their freeipa records
+        :param uids: usernames to sync, defaults to every freeipa user
+        :return: dict of counters
+        """
+        if uids is None:
+            uids = self.find('user_find')
+        for records in self.iter_user_pages(uids):
+            self.apply_records(records)
+        return self.stats
+
+    def apply_records(self, records):
+        """
+        Write a page of user_show records to django
+        :param records: List of user_show results
+        """
+        records = dict((record['uid'][0], record) for record in records)
+        existing = User.objects.in_bulk(
+            list(records), field_name=User.USERNAME_FIELD
+        )
+
+        to_create = []
+        to_update = []
+        update_fields = set()
+        for username, record in records.items():
+            user = existing.get(username)
+            created = user is None
+            if created:
+                user = User(**{User.USERNAME_FIELD: username})
+                user.set_unusable_password()
+
+            try:
+                changed_fields = self.backend.update_user_attrs(user, record)
+            except KeyError as e:
+                logger.warning("FreeIPA user {username} is missing {key}"
+                               .format(username=username, key=e))
+                self.stats['skipped'] += 1
+                continue
+
+            if not user.is_staff:
+                user.is_staff = True
+                changed_fields.append('is_staff')
+
+            if created:
+                to_create.append(user)
+            elif changed_fields:
+                to_update.append(user)
+                update_fields.update(changed_fields)
+            else:
+                self.stats['unchanged'] += 1
+
+        User.objects.bulk_create(to_create, batch_size=self.batch_size)
+        if to_update:
+            User.objects.bulk_update(to_update, sorted(update_fields),
+                                     batch_size=self.batch_size)
+        self.stats['created'] += len(to_create)
+        self.stats['updated'] += len(to_update)
+
+        if self.settings.UPDATE_USER_GROUPS:
+            self.apply_memberships(records)
+
+    def get_group_ids(self):
+        if self._group_ids is None:
+            self._group_ids = dict(Group.objects.values_list('name', 'pk'))
+        return self._group_ids
+
+    def apply_memberships(self, records):
+        """
+        Add and remove only the user group rows that changed
+        :param records: dict of username to user_show record
+        """
+        group_ids = self.get_group_ids()
+        user_ids = dict(
+            User.objects.filter(
+                **{User.USERNAME_FIELD + '__in': list(records)}
+            ).values_list(User.USERNAME_FIELD, 'pk')
+        )
+
+        desired = set()
+        for username, record in records.items():
+            if username not in user_ids:
+                continue
+            for group in self.backend.get_record_groups(record):
+                if group in group_ids:
+                    desired.add((user_ids[username], group_ids[group]))
+
+        field = User._meta.get_field('groups')
+        through = field.remote_field.through
+        user_field = field.m2m_field_name()
+        group_field = field.m2m_reverse_field_name()
+        current = set(
+            through.objects.filter(
+                **{user_field + '__in': list(user_ids.values())}
+            ).values_list(user_field, group_field)
+        )
+
+        through.objects.bulk_create(
+            [through(**{user_field + '_id': user_id,
+                        group_field + '_id': group_id})
+             for user_id, group_id in desired - current],
+            batch_size=self.batch_size
+        )
+
+        removed = {}
+        for user_id, group_id in current - desired:
+            removed.setdefault(user_id, []).append(group_id)
+        for user_id, group_ids_removed in removed.items():
+            through.objects.filter(**{
+                user_field: user_id,
+                group_field + '__in': group_ids_removed
+            }).delete()
+
+        # Bulk writes send no m2m_changed signals
+        permission_cache = get_permission_cache()
+        if permission_cache is None:
+            return
+        for user_id in set(user_id for user_id, group_id in desired ^ current):
+            permission_cache.invalidate_user(user_id)
+
+
+class IncrementalDirectorySync(DirectorySync):
+
+    """
+    Directory sync applying only the users modified since the last run.
+    The newest modification time seen is persisted as a high-water mark,
+    in a state file when one is given and in the django cache otherwise.
+    The modification times of every user are read in a single listing,
+    which the server's search size limit applies to.
+    """
+
+    state_key = 'freeipa_auth:sync:high_water_mark'
+
+    def __init__(self, backend, session, cache_alias='default',
+                 state_file=None, **kwargs):
+        """
+        :param cache_alias: django cache holding the high-water mark
+        :param state_file: path of a file holding the high-water mark
+            instead of the cache
+        """
+        super(IncrementalDirectorySync, self).__init__(
+            backend, session, **kwargs
+        )
+        self.cache = caches[cache_alias]
+        self.state_file = state_file
+
+    def is_state_durable(self):
+        """
+        Whether the high-water mark outlives the process. Local memory and
+        dummy caches lose it as soon as the sync exits.
+        :return: bool
+        """
+        return self.state_file is not None or \
+            not isinstance(self.cache, (LocMemCache, DummyCache))
+
+    def get_high_water_mark(self):
+        if self.state_file is None:
+            return self.cache.get(self.state_key)
+        try:
+            with open(self.state_file) as state:
+                return state.read().strip() or None
+        except FileNotFoundError:
+            return None
+
+    def set_high_water_mark(self, mark):
+        if self.state_file is None:
+            self.cache.set(self.state_key, mark, None)
+            return
+        # Replace the file at once so an interrupted run keeps the old mark
+        temp_file = self.state_file + '.tmp'
+        with open(temp_file, 'w') as state:
+            state.write(mark or '')
+        os.replace(temp_file, self.state_file)
+
+    def reset(self):
+        """Forget the high-water mark so the next run syncs every user"""
+        if self.state_file is None:
+            self.cache.delete(self.state_key)
+            return
+        try:
+            os.remove(self.state_file)
+        except FileNotFoundError:
+            pass
+
+    def sync_users(self, uids=None):
+        """
+        Create or update the django users modified since the last run.
+        Group membership changes update the user's modification time too.
+        Every user is listed with all attributes but the member lists, as
+        freeipa only returns modifytimestamp along with every attribute,
+        and the changed users are read in pages like a full sync.
+        :return: dict of counters
+        """
+        mark = self.get_high_water_mark()
+        newest = mark
+
+        # modifytimestamp is only returned along with every attribute
+        entries = self.find_entries('user_find',
+                                    {'all': True, 'no_members': True})
+
+        changed = []
+        for entry in entries:
+            timestamp = get_modify_timestamp(entry)
+            # Timestamps have a resolution of one second, so the second of
+            # the mark is applied again in case it changed after the last
+            # listing. apply_records only writes actual changes.
+            if mark and timestamp and timestamp < mark:
+                self.stats['unchanged'] += 1
+                continue
+            if timestamp and (newest is None or timestamp > newest):
+                newest = timestamp
+            changed.append(entry['uid'][0])
+
+        for records in self.iter_user_pages(changed):
+            self.apply_records(records)
+
+        self.set_high_water_mark(newest)
+        return self.stats
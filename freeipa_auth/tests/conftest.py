@@ -6,6 +6,19 @@ from django.contrib.auth.models import Permission
 from django.contrib.contenttypes.models import ContentType
 from django.contrib.auth.models import Group
 from django.conf import settings as django_settings
+from django.test import override_settings
+from freeipa_auth.servers import server_pools
+from freeipa_auth.groups import group_hierarchy
+from freeipa_auth.service import service_sessions
+
+
+@pytest.fixture(autouse=True)
+def reset_server_pools(request):
+    """Fixture to forget server health, cached groups and service sessions
+    between test cases"""
+    request.addfinalizer(server_pools.clear)
+    request.addfinalizer(group_hierarchy.clear)
+    request.addfinalizer(service_sessions.clear)
 
 
 @pytest.fixture
@@ -103,14 +116,10 @@ def settings(request, db):
     """Fixture to allow for setting overrides per test case"""
 
     def override(**kwargs):
-        for k, v in kwargs.items():
-            setattr(django_settings, k, v)
-
-        def fin():
-            for k in kwargs:
-                delattr(django_settings, k)
-
-        request.addfinalizer(fin)
+        # override_settings sends setting_changed so cached settings reload
+        overridden = override_settings(**kwargs)
+        overridden.enable()
+        request.addfinalizer(overridden.disable)
 
     django_settings.override = override
     return django_settings
@@ -0,0 +1,91 @@
+import json
+import pytest
+import requests
+
+async_to_sync = pytest.importorskip("asgiref.sync").async_to_sync
+httpx = pytest.importorskip("httpx")
+
+from freeipa_auth.async_utils import AsyncFreeIpaSession, async_connection_pools  # noqa: E402
+
+
+@pytest.fixture
+def mock_transport(monkeypatch):
+    """Fixture routing async sessions through a recording mock transport"""
+    requests_made = []
+
+    def handler(request):
+        requests_made.append(request)
+        if request.url.path == "/ipa/session/login_password":
+            return httpx.Response(200, headers={"Set-Cookie": "ipa_session=abc"})
+        body = json.loads(request.content)
+        return httpx.Response(200, json={"result": {"result": {
+            "uid": body["params"][0],
+            "memberof_group": ["test_group"],
+        }}})
+
+    transport = httpx.MockTransport(handler)
+    monkeypatch.setattr(async_connection_pools, "get_transport",
+                        lambda *args, **kwargs: transport)
+    transport.requests = requests_made
+    return transport
+
+
+class TestAsyncFreeIpaSession:
+    username = "dummy_freeipa_username"
+    password = "dummy_freeipa_password"
+
+    def test_load_user_data(self, mock_transport):
+        async def run():
+            session = AsyncFreeIpaSession("ipa.foo.com")
+            response = await session.authenticate(self.username, self.password)
+            await session.load_user_data()
+            return session, response
+
+        session, response = async_to_sync(run)()
+        assert response.status_code == 200
+        assert session.user_is_authenticated
+        assert session.groups == ["test_group"]
+        login, user_show = mock_transport.requests
+        assert login.url == "https://ipa.foo.com/ipa/session/login_password"
+        assert login.headers["referer"] == "https://ipa.foo.com/ipa/session/login_password"
+        assert user_show.headers["cookie"] == "ipa_session=abc"
+        assert json.loads(user_show.content) == {
+            "id": 0,
+            "method": "user_show",
+            "params": [[self.username], {"all": True, "raw": False}],
+        }
+
+    def test_authenticate_defers_user_data(self, mock_transport):
+        async def run():
+            session = AsyncFreeIpaSession("ipa.foo.com")
+            await session.authenticate(self.username, self.password)
+            return session
+
+        session = async_to_sync(run)()
+        assert session.user_data == {}
+        assert len(mock_transport.requests) == 1
+
+    def test_transport_errors_raised_as_requests_errors(self, monkeypatch):
+        def handler(request):
+            raise httpx.ConnectError("refused", request=request)
+
+        transport = httpx.MockTransport(handler)
+        monkeypatch.setattr(async_connection_pools, "get_transport",
+                            lambda *args, **kwargs: transport)
+
+        async def run():
+            session = AsyncFreeIpaSession("ipa.foo.com")
+            await session.authenticate(self.username, self.password)
+
+        with pytest.raises(requests.ConnectionError):
+            async_to_sync(run)()
+
+    def test_sessions_share_transport(self):
+        async def run():
+            first = AsyncFreeIpaSession("ipa.foo.com")
+            second = AsyncFreeIpaSession("ipa.foo.com")
+            return first, second
+
+        first, second = async_to_sync(run)()
+        assert first.session._transport is second.session._transport
+        assert first.session.cookies is not second.session.cookies
@@ -1,11 +1,29 @@
+import django
 import pytest
 import requests
+import threading
 
 from unittest import mock
 from django.test import override_settings
+from django.core.cache import cache
 from django.contrib.auth import backends
 
+from django.core.exceptions import ImproperlyConfigured
+
 from freeipa_auth.backends import FreeIpaRpcAuthBackend, FreeIpaAuthSettings
+from freeipa_auth.settings import get_settings
+from freeipa_auth.groups import GroupHierarchy
+from freeipa_auth.sync import DirectoryTruncated
+
+try:
+    from asgiref.sync import async_to_sync
+except ImportError:  # Django 2.2 does not install asgiref
+    async_to_sync = None
+
+# The async path uses the async ORM added in Django 4.2
+requires_async_orm = pytest.mark.skipif(
+    django.VERSION < (4, 2), reason="aauthenticate requires Django 4.2"
+)
 
 
 class TestFreeIpaRpcAuthBackend:
@@ -20,26 +38,32 @@ class TestFreeIpaRpcAuthBackend:
         FREEIPA_AUTH_SERVER="ipa.foo.com",
         FREEIPA_AUTH_FAILOVER_SERVER="ipa.failover.com",
         FREEIPA_AUTH_SSL_VERIFY="/path/to/ssl", 
+        FREEIPA_AUTH_CIRCUIT_BREAKER_THRESHOLD=1,
     )
+    @mock.patch('freeipa_auth.backends.logger.critical') # mute for tests
+    @mock.patch('freeipa_auth.servers.logger.critical') # mute for tests
     @mock.patch('freeipa_auth.backends.FreeIpaSession')
-    def test_authenicate_failover_server(self, mock_freeipa):
+    def test_authenicate_failover_server(self, mock_freeipa, *args):
         """
-        Asserts that if this is the second attempt, we use
-        the failover server.
+        Asserts that once the main server is marked unhealthy, we go
+        straight to the failover server.
         """
+        backend = FreeIpaRpcAuthBackend()
+        backend.get_server_pool().record_failure("ipa.foo.com")
         mock_response = mock.MagicMock()
         mock_response.status_code = 418
         mock_freeipa.return_value.authenticate = mock.Mock(return_value=mock_response)
-        backend = FreeIpaRpcAuthBackend()
         backend.authenticate(
             username=self.username,
             password=self.password,
-            tries=2,
         )
         mock_freeipa.assert_called_once_with(
             "ipa.failover.com",
             ssl_verify="/path/to/ssl",
-            server_timeout=5
+            server_timeout=5,
+            pool_size=10,
+            keep_alive=True,
+            user_show_params={"all": False, "raw": False, "no_members": True}
         )
 
     @override_settings(
@@ -49,37 +73,268 @@ class TestFreeIpaRpcAuthBackend:
     )
     @mock.patch('freeipa_auth.backends.logger.critical') # mute for tests
     @mock.patch('freeipa_auth.backends.FreeIpaSession')
-    def test_recursive_call_with_failover_server(self, mock_freeipa, mock_logger_critical):
+    def test_failover_server_on_connection_error(self, mock_freeipa, mock_logger_critical):
         """
-        Asserts that when we're on the first try and we
-        have a failover server set, a second attempt is made
-        if we have an error raised on the first try.
+        Asserts that when we have a failover server set, a second
+        attempt is made if we have an error raised on the first try,
+        and that the error is raised once every server failed.
         """
         mock_freeipa.return_value.authenticate = mock.Mock(
             side_effect=requests.ConnectionError
         )
         backend = FreeIpaRpcAuthBackend()
-        with pytest.raises(Exception):
+        with pytest.raises(requests.ConnectionError):
             backend.authenticate(
                 username=self.username,
                 password=self.password,
             )
-        # Because we can't test recursive methods, we're
-        # just asserting an expected side effect
         assert mock_freeipa.call_count == 2
         assert mock_freeipa.call_args_list == [
             mock.call(
                 "ipa.foo.com",
                 ssl_verify="/path/to/ssl",
                 server_timeout=5,
+                pool_size=10,
+                keep_alive=True,
+                user_show_params={"all": False, "raw": False, "no_members": True},
             ),
             mock.call(
                 "ipa.failover.com",
                 ssl_verify="/path/to/ssl",
                 server_timeout=5,
+                pool_size=10,
+                keep_alive=True,
+                user_show_params={"all": False, "raw": False, "no_members": True},
             ),
         ]
 
+    @override_settings(
+        FREEIPA_AUTH_SERVERS=["ipa1.foo.com", "ipa2.foo.com", "ipa3.foo.com"],
+    )
+    @mock.patch('freeipa_auth.backends.FreeIpaSession')
+    def test_authenticate_prefers_fastest_server(self, mock_freeipa):
+        """
+        Asserts that servers are tried in order of observed latency.
+        """
+        mock_response = mock.MagicMock()
+        mock_response.status_code = 401
+        mock_freeipa.return_value.authenticate = mock.Mock(return_value=mock_response)
+        backend = FreeIpaRpcAuthBackend()
+        pool = backend.get_server_pool()
+        pool.record_success("ipa1.foo.com", 0.5)
+        pool.record_success("ipa2.foo.com", 0.3)
+        pool.record_success("ipa3.foo.com", 0.1)
+        backend.authenticate(username=self.username, password=self.password)
+        assert mock_freeipa.call_args[0] == ("ipa3.foo.com",)
+
+    @override_settings(
+        FREEIPA_AUTH_SERVERS=["ipa1.foo.com", "ipa2.foo.com"],
+        FREEIPA_AUTH_HEDGE_REQUESTS=True,
+        FREEIPA_AUTH_HEDGE_DELAY=0.01,
+    )
+    @mock.patch('freeipa_auth.backends.FreeIpaSession')
+    def test_authenticate_hedged(self, mock_freeipa):
+        """
+        Asserts that a slow main server is hedged to the next server
+        and the slow login is cancelled once the other one answered.
+        """
+        release = threading.Event()
+        sessions = {}
+
+        def new_session(server, **kwargs):
+            session = mock.Mock(name=server)
+            if server == "ipa1.foo.com":
+                session.authenticate.side_effect = lambda *a, **kw: release.wait(5)
+            else:
+                session.authenticate.return_value = mock.Mock(status_code=401)
+            sessions[server] = session
+            return session
+
+        mock_freeipa.side_effect = new_session
+        backend = FreeIpaRpcAuthBackend()
+        try:
+            backend.authenticate(username=self.username, password=self.password)
+        finally:
+            release.set()
+        sessions["ipa2.foo.com"].authenticate.assert_called_once()
+        sessions["ipa1.foo.com"].cancel.assert_called_once_with()
+
+    @override_settings(
+        FREEIPA_AUTH_SERVER="ipa.foo.com",
+        FREEIPA_AUTH_CREDENTIAL_CACHE_TTL=60,
+    )
+    @mock.patch('freeipa_auth.backends.FreeIpaSession')
+    def test_authenticate_credential_cache_hit(self, mock_freeipa, test_user):
+        """
+        Asserts that repeat logins with the same credentials are
+        served from the credential cache without contacting freeipa.
+        """
+        mock_response = mock.MagicMock()
+        mock_response.status_code = 200
+        mock_freeipa.return_value.authenticate = mock.Mock(return_value=mock_response)
+        mock_freeipa.return_value.user = test_user.username
+        mock_freeipa.return_value.user_data = {"givenname": "A", "sn": "B", "mail": "c@d.com"}
+        mock_freeipa.return_value.groups = []
+        backend = FreeIpaRpcAuthBackend()
+        try:
+            first = backend.authenticate(username=test_user.username, password=self.password)
+            second = backend.authenticate(username=test_user.username, password=self.password)
+            assert first == second == test_user
+            assert mock_freeipa.call_count == 1
+
+            backend.invalidate_credentials(test_user.username)
+            backend.authenticate(username=test_user.username, password=self.password)
+            assert mock_freeipa.call_count == 2
+        finally:
+            cache.clear()
+
+    @override_settings(
+        FREEIPA_AUTH_SERVER="ipa.foo.com",
+        FREEIPA_AUTH_USER_DATA_MAX_AGE=60,
+    )
+    @mock.patch('freeipa_auth.backends.FreeIpaRpcAuthBackend.update_user')
+    @mock.patch('freeipa_auth.backends.FreeIpaSession')
+    def test_authenticate_user_data_max_age(self, mock_freeipa, mock_update_user, test_user):
+        """
+        Asserts that within USER_DATA_MAX_AGE a login still checks the
+        password but skips the user_show read and the user sync.
+        """
+        mock_response = mock.MagicMock()
+        mock_response.status_code = 200
+        mock_freeipa.return_value.authenticate = mock.Mock(return_value=mock_response)
+        mock_freeipa.return_value.user = test_user.username
+        mock_freeipa.return_value.user_data = {"givenname": "A", "sn": "B", "mail": "c@d.com"}
+        mock_update_user.return_value = test_user
+        backend = FreeIpaRpcAuthBackend()
+        try:
+            backend.authenticate(username=test_user.username, password=self.password)
+            user = backend.authenticate(username=test_user.username, password=self.password)
+            assert user == test_user
+            assert mock_update_user.call_count == 1
+            assert mock_freeipa.return_value.authenticate.call_args_list == [
+                mock.call(test_user.username, self.password),
+                mock.call(test_user.username, self.password),
+            ]
+        finally:
+            cache.clear()
+
+    @override_settings(
+        FREEIPA_AUTH_SERVER="ipa.foo.com",
+        FREEIPA_AUTH_ALWAYS_UPDATE_USER=False,
+    )
+    def test_authenticate_existing_user_skips_user_show(self, test_user, monkeypatch):
+        """
+        Asserts that without ALWAYS_UPDATE_USER an existing user logs
+        in with the password check only.
+        """
+        monkeypatch.setattr("requests.sessions.Session.request",
+                            lambda *args, **kwargs: mock.Mock(status_code=200))
+        get_user_data = mock.Mock(return_value={})
+        monkeypatch.setattr("freeipa_auth.freeipa_utils.FreeIpaSession._get_user_data",
+                            get_user_data)
+        user = FreeIpaRpcAuthBackend().authenticate(username=test_user.username,
+                                                    password=self.password)
+        assert user == test_user
+        get_user_data.assert_not_called()
+
+    @override_settings(
+        FREEIPA_AUTH_SERVER="ipa.foo.com",
+        FREEIPA_AUTH_UPDATE_USER_GROUPS=True,
+    )
+    @requires_async_orm
+    @mock.patch('freeipa_auth.backends.AsyncFreeIpaSession')
+    def test_aauthenticate(self, mock_freeipa, test_group):
+        """
+        Asserts that the async path authenticates through the async
+        session and syncs the user with the async ORM.
+        """
+        async def authenticate(*args, **kwargs):
+            return mock.Mock(status_code=200)
+
+        user_data = {"givenname": "Chester", "sn": "Tester", "mail": "c@d.com"}
+
+        async def load_user_data():
+            return user_data
+
+        mock_freeipa.return_value.authenticate = authenticate
+        mock_freeipa.return_value.load_user_data = load_user_data
+        mock_freeipa.return_value.user = self.username
+        mock_freeipa.return_value.user_data = user_data
+        mock_freeipa.return_value.groups = [test_group.name]
+        backend = FreeIpaRpcAuthBackend()
+        user = async_to_sync(backend.aauthenticate)(
+            None, username=self.username, password=self.password
+        )
+        assert user.username == self.username
+        assert user.first_name == "Chester"
+        assert not user.has_usable_password()
+        assert list(user.groups.all()) == [test_group]
+
+    @override_settings(
+        FREEIPA_AUTH_SERVER="ipa.foo.com",
+    )
+    @requires_async_orm
+    @mock.patch('freeipa_auth.backends.AsyncFreeIpaSession')
+    def test_aauthenticate_invalid_credentials(self, mock_freeipa, db):
+        async def authenticate(*args, **kwargs):
+            return mock.Mock(status_code=401)
+
+        mock_freeipa.return_value.authenticate = authenticate
+        backend = FreeIpaRpcAuthBackend()
+        user = async_to_sync(backend.aauthenticate)(
+            None, username=self.username, password=self.password
+        )
+        assert user is None
+
+    def test_get_all_user_groups_does_not_mutate(self):
+        backend = FreeIpaRpcAuthBackend()
+        user_session = mock.Mock(
+            groups=["developers"],
+            user_data={"memberof_group": ["developers"],
+                       "memberofindirect_group": ["engineering"]},
+        )
+        user_session.groups = user_session.user_data["memberof_group"]
+        assert set(backend.get_all_user_groups(user_session)) == {"developers", "engineering"}
+        assert user_session.user_data["memberof_group"] == ["developers"]
+
+    @override_settings(
+        FREEIPA_AUTH_GROUP_HIERARCHY_INDEX=True,
+    )
+    def test_get_all_user_groups_from_hierarchy_index(self):
+        backend = FreeIpaRpcAuthBackend()
+        user_session = mock.Mock(groups=["developers"], user_data={})
+        hierarchy = GroupHierarchy({"developers": ["engineering"], "engineering": ["staff"]})
+        with mock.patch.object(backend, "load_group_hierarchy", return_value=hierarchy):
+            groups = backend.get_all_user_groups(user_session)
+        assert set(groups) == {"developers", "engineering", "staff"}
+
+    def test_load_group_hierarchy(self):
+        backend = FreeIpaRpcAuthBackend()
+        service_session = mock.Mock()
+        service_session.make_session_request.return_value = {"result": {
+            "result": [{"cn": ["developers"], "memberof_group": ["staff"]}],
+            "truncated": False,
+        }}
+        with mock.patch.object(backend, "get_service_session",
+                               return_value=service_session):
+            hierarchy = backend.load_group_hierarchy()
+        assert hierarchy.ancestors["developers"] == {"staff"}
+        service_session.make_session_request.assert_called_once_with({
+            "method": "group_find", "item": [],
+            "params": {"no_members": False, "sizelimit": 0},
+        })
+
+    def test_load_group_hierarchy_truncated(self):
+        backend = FreeIpaRpcAuthBackend()
+        service_session = mock.Mock()
+        service_session.make_session_request.return_value = {"result": {
+            "result": [], "truncated": True,
+        }}
+        with mock.patch.object(backend, "get_service_session",
+                               return_value=service_session):
+            with pytest.raises(DirectoryTruncated):
+                backend.load_group_hierarchy()
+
     def test_update_user_groups_staff_flag(self, test_user):
         backend = FreeIpaRpcAuthBackend()
         assert not test_user.is_staff
@@ -114,8 +369,8 @@ class TestFreeIpaRpcAuthBackend:
         assert test_user.last_name == test_data["sn"]
         assert test_user.email == test_data["mail"]
 
-    @mock.patch('freeipa_auth.backends.FreeIpaRpcAuthBackend.update_user_attrs')
-    @mock.patch('freeipa_auth.backends.FreeIpaRpcAuthBackend.update_user_groups')
+    @mock.patch('freeipa_auth.backends.FreeIpaRpcAuthBackend.update_user_attrs', return_value=[])
+    @mock.patch('freeipa_auth.backends.FreeIpaRpcAuthBackend.update_user_groups', return_value=[])
     def test_update_user(self, mock_update_user_groups, mock_update_user_attrs, test_user, mock_user_session_data):
         backend = FreeIpaRpcAuthBackend()
         password = test_user.password
@@ -134,6 +389,44 @@ class TestFreeIpaRpcAuthBackend:
         backend.update_user(mock_user_session_data)
         mock_update_user_attrs.assert_not_called()
         mock_update_user_groups.assert_not_called()
+
+    def test_update_user_sets_unusable_password(self, test_user, mock_user_session_data):
+        backend = FreeIpaRpcAuthBackend()
+        user = backend.update_user(mock_user_session_data)
+        user.refresh_from_db()
+        assert not user.has_usable_password()
+
+    @override_settings(
+        FREEIPA_AUTH_UPDATE_USER_GROUPS=True
+    )
+    def test_update_user_unchanged_skips_writes(self, test_user, mock_user_session_data,
+                                                django_assert_num_queries):
+        """
+        Asserts that a repeat sync with unchanged freeipa data only
+        reads the user and its groups and issues no writes.
+        """
+        backend = FreeIpaRpcAuthBackend()
+        backend.update_user(mock_user_session_data)
+        # get_or_create, group lookup and current memberships
+        with django_assert_num_queries(3):
+            backend.update_user(mock_user_session_data)
+
+    def test_update_user_attrs_returns_changed_fields(self, test_user, mock_user_session_data):
+        backend = FreeIpaRpcAuthBackend()
+        test_data = mock_user_session_data.user_data
+        assert backend.update_user_attrs(test_user, test_data) == ["first_name", "last_name", "email"]
+        assert backend.update_user_attrs(test_user, test_data) == []
+
+    @override_settings(
+        FREEIPA_AUTH_UPDATE_USER_GROUPS=True
+    )
+    def test_update_user_groups_only_changes_diff(self, test_user, test_group, test_group2):
+        backend = FreeIpaRpcAuthBackend()
+        backend.update_user_groups(test_user, [test_group.name])
+        with mock.patch.object(type(test_user.groups), 'remove') as mock_remove:
+            backend.update_user_groups(test_user, [test_group.name, test_group2.name])
+            mock_remove.assert_not_called()
+        assert set(test_user.groups.all()) == {test_group, test_group2}
 class TestFreeIpaAuthSettings:
     @override_settings(
         FREEIPA_AUTH_SERVER="ipa.foo.com",
@@ -151,3 +444,59 @@ class TestFreeIpaAuthSettings:
     def test_failover_set_no_warning(self, caplog):
         FreeIpaAuthSettings()
         assert 'FreeIPA Failover Server is not set. Proceed with caution.' not in caplog.text
+
+    @override_settings(
+        FREEIPA_AUTH_SERVER="ipa.foo.com",
+        FREEIPA_AUTH_FAILOVER_SERVER="ipa.failover.com",
+    )
+    def test_servers_from_server_and_failover(self):
+        assert FreeIpaAuthSettings().SERVERS == ["ipa.foo.com", "ipa.failover.com"]
+
+    @override_settings(
+        FREEIPA_AUTH_SERVERS=["ipa1.foo.com", "ipa2.foo.com", "ipa3.foo.com"],
+    )
+    def test_servers_list(self, caplog):
+        assert FreeIpaAuthSettings().SERVERS == ["ipa1.foo.com", "ipa2.foo.com", "ipa3.foo.com"]
+        assert 'FreeIPA Failover Server is not set. Proceed with caution.' not in caplog.text
+
+    def test_settings_loaded_once(self, caplog):
+        with override_settings(FREEIPA_AUTH_SERVER="ipa.foo.com"):
+            backend = FreeIpaRpcAuthBackend()
+            assert FreeIpaRpcAuthBackend().settings is backend.settings
+            assert backend.settings is get_settings()
+        assert caplog.text.count('FreeIPA Failover Server is not set') == 1
+
+    def test_settings_reloaded_on_change(self):
+        with override_settings(FREEIPA_AUTH_SERVER="ipa.foo.com"):
+            assert get_settings().SERVERS == ["ipa.foo.com"]
+        with override_settings(FREEIPA_AUTH_SERVER="ipa.bar.com"):
+            assert get_settings().SERVERS == ["ipa.bar.com"]
+
+    @override_settings(FREEIPA_AUTH_USER_ATTRS_MAP=["givenname"])
+    def test_invalid_attrs_map(self):
+        with pytest.raises(ImproperlyConfigured):
+            FreeIpaAuthSettings()
+
+    @override_settings(FREEIPA_AUTH_USER_ATTRS_MAP={"first_name": "givenname"})
+    def test_user_attr_getters(self):
+        (attr, getter), = FreeIpaAuthSettings().user_attr_getters
+        assert attr == "first_name"
+        assert getter({"givenname": ["Old", "Chester"]}) == "Chester"
+        with pytest.raises(KeyError):
+            getter({})
+
+    def test_user_show_params_projected(self):
+        params = FreeIpaAuthSettings().user_show_params
+        assert params == {"all": False, "raw": False, "no_members": True}
+
+    @override_settings(
+        FREEIPA_AUTH_USER_ATTRS_MAP={"first_name": "displayname"},
+        FREEIPA_AUTH_UPDATE_USER_GROUPS=True,
+    )
+    def test_user_show_params_non_default_attr(self):
+        params = FreeIpaAuthSettings().user_show_params
+        assert params == {"all": True, "raw": False}
+
+    @override_settings(FREEIPA_AUTH_USER_SHOW_ALL=True)
+    def test_user_show_all(self):
+        assert FreeIpaAuthSettings().user_show_params == {"all": True, "raw": False}
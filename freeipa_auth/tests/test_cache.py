@@ -0,0 +1,55 @@
+import pytest
+
+from django.core.cache import cache
+
+from freeipa_auth.cache import CredentialCache, UserDataCache
+
+
+@pytest.fixture
+def credential_cache(request):
+    """Fixture for a credential cache cleared after each test"""
+    request.addfinalizer(cache.clear)
+    return CredentialCache(60)
+
+
+class TestCredentialCache:
+    username = "dummy_freeipa_username"
+    password = "dummy_freeipa_password"
+
+    def test_get_user_id_after_set(self, credential_cache, test_user):
+        credential_cache.set(self.username, self.password, test_user)
+        assert credential_cache.get_user_id(self.username, self.password) == test_user.pk
+
+    def test_get_user_id_wrong_password(self, credential_cache, test_user):
+        credential_cache.set(self.username, self.password, test_user)
+        assert credential_cache.get_user_id(self.username, "wrong") is None
+
+    def test_get_user_id_missing(self, credential_cache):
+        assert credential_cache.get_user_id(self.username, self.password) is None
+
+    def test_password_not_stored(self, credential_cache, test_user):
+        credential_cache.set(self.username, self.password, test_user)
+        entry = cache.get(credential_cache._key(self.username))
+        assert self.password not in str(entry)
+
+    def test_invalidate(self, credential_cache, test_user):
+        credential_cache.set(self.username, self.password, test_user)
+        credential_cache.invalidate(self.username)
+        assert credential_cache.get_user_id(self.username, self.password) is None
+
+
+class TestUserDataCache:
+    username = "dummy_freeipa_username"
+
+    def test_get_after_set(self, request):
+        request.addfinalizer(cache.clear)
+        user_data_cache = UserDataCache(60)
+        user_data_cache.set(self.username, {"givenname": ["Chester"]})
+        assert user_data_cache.get(self.username) == {"givenname": ["Chester"]}
+
+    def test_invalidate(self, request):
+        request.addfinalizer(cache.clear)
+        user_data_cache = UserDataCache(60)
+        user_data_cache.set(self.username, {"givenname": ["Chester"]})
+        user_data_cache.invalidate(self.username)
+        assert user_data_cache.get(self.username) is None
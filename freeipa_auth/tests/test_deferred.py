@@ -0,0 +1,116 @@
+import django
+import pytest
+import threading
+
+from unittest import mock
+from django.test import TestCase, override_settings
+
+from freeipa_auth.backends import FreeIpaRpcAuthBackend
+from freeipa_auth.deferred import DeferredSync
+
+
+@pytest.fixture
+def deferred(request):
+    deferred = DeferredSync()
+    request.addfinalizer(deferred.wait)
+    return deferred
+
+
+class TestDeferredSync:
+    @pytest.mark.skipif(django.VERSION < (3, 2),
+                        reason="captureOnCommitCallbacks requires Django 3.2")
+    def test_runs_on_commit(self, db, deferred):
+        func = mock.Mock()
+        with TestCase.captureOnCommitCallbacks() as callbacks:
+            deferred.submit("testuser", func, max_workers=1, max_pending=10)
+
+        assert len(callbacks) == 1
+        func.assert_not_called()
+        callbacks[0]()
+        deferred.wait()
+        func.assert_called_once_with()
+
+    def test_queued_key_not_queued_again(self, deferred):
+        release = threading.Event()
+        started = threading.Event()
+
+        def block():
+            started.set()
+            release.wait()
+
+        func = mock.Mock()
+        deferred._submit("other", block, max_workers=1, max_pending=10)
+        started.wait()
+        deferred._submit("testuser", func, max_workers=1, max_pending=10)
+        deferred._submit("testuser", func, max_workers=1, max_pending=10)
+        release.set()
+        deferred.wait()
+
+        assert func.call_count == 1
+
+    def test_full_queue_runs_inline(self, deferred):
+        release = threading.Event()
+        func = mock.Mock()
+        deferred._submit("other", release.wait, max_workers=1, max_pending=1)
+        deferred._submit("testuser", func, max_workers=1, max_pending=1)
+
+        # Ran in this thread while the pool is still busy
+        func.assert_called_once_with()
+        release.set()
+        deferred.wait()
+        assert deferred._pending == 0
+
+    def test_failure_frees_slot(self, deferred):
+        deferred._submit("testuser", mock.Mock(side_effect=ValueError),
+                         max_workers=1, max_pending=1)
+        deferred.wait()
+
+        assert deferred._pending == 0
+        assert deferred._queued == set()
+
+
+class TestDeferredUserSync:
+    password = "fake"
+    user_data = {"givenname": "Chester", "sn": "Tester", "mail": "c@d.com"}
+
+    @pytest.fixture
+    def freeipa(self, monkeypatch):
+        monkeypatch.setattr("requests.sessions.Session.request",
+                            lambda *args, **kwargs: mock.Mock(status_code=200))
+        get_user_data = mock.Mock(return_value=self.user_data)
+        monkeypatch.setattr("freeipa_auth.freeipa_utils.FreeIpaSession._get_user_data",
+                            get_user_data)
+        return get_user_data
+
+    @override_settings(
+        FREEIPA_AUTH_SERVER="ipa.foo.com",
+        FREEIPA_AUTH_DEFER_USER_SYNC=True,
+    )
+    @mock.patch('freeipa_auth.backends.deferred_syncs')
+    def test_existing_user_synced_after_login(self, deferred_syncs, test_user, freeipa):
+        user = FreeIpaRpcAuthBackend().authenticate(username=test_user.username,
+                                                    password=self.password)
+
+        assert user == test_user
+        freeipa.assert_not_called()
+        assert deferred_syncs.submit.call_count == 1
+        key, func = deferred_syncs.submit.call_args[0]
+        assert key == test_user.username
+
+        func()
+        test_user.refresh_from_db()
+        assert test_user.first_name == "Chester"
+        assert not test_user.has_usable_password()
+
+    @override_settings(
+        FREEIPA_AUTH_SERVER="ipa.foo.com",
+        FREEIPA_AUTH_DEFER_USER_SYNC=True,
+    )
+    @mock.patch('freeipa_auth.backends.deferred_syncs')
+    def test_new_user_created_inline(self, deferred_syncs, db, freeipa):
+        user = FreeIpaRpcAuthBackend().authenticate(username="newuser",
+                                                    password=self.password)
+
+        assert user.username == "newuser"
+        assert user.email == "c@d.com"
+        deferred_syncs.submit.assert_not_called()
@@ -1,7 +1,12 @@
 import json
+import pytest
+import threading
 from unittest import mock
 
-from freeipa_auth.freeipa_utils import FreeIpaSession
+from freeipa_auth.freeipa_utils import (
+    FreeIpaSession, connection_pools, decode_response, get_request_template,
+    get_user_show_params
+)
 
 
 class TestFreeIpaSession:
@@ -19,18 +24,22 @@ class TestFreeIpaSession:
         mock_response.json = mock.Mock(return_value={
             "results": "tada"
         })
+        mock_response.content = b'{"results": "tada"}'
         session.session.post = mock.Mock(return_value=mock_response)
         expected_url = "https://ipa.foo.com/ipa/session/json"
-        expected_headers = {**session.login_headers}
-        expected_headers["referer"] = expected_url
-        expected_headers["Content-Type"] = "application/json"
-        expected_headers["Accept"] = "application/json"
-        expected_session_post_data = {**session.session_post_data}
-        expected_session_post_data["method"] = "FAKE_METHOD"
-        expected_session_post_data["params"] = [
-            "FAKE_ITEM",
-            "FAKE_PARAMS",
-        ]
+        expected_headers = {
+            "referer": expected_url,
+            "Content-Type": "application/json",
+            "Accept": "application/json",
+        }
+        expected_session_post_data = {
+            "id": 0,
+            "method": "FAKE_METHOD",
+            "params": [
+                "FAKE_ITEM",
+                "FAKE_PARAMS",
+            ],
+        }
         results = session.make_session_request({
             "method": "FAKE_METHOD",
             "params": "FAKE_PARAMS",
@@ -79,6 +88,95 @@ class TestFreeIpaSession:
             "data": "unreal data"
         }
 
+    def test_authenticate_defers_user_data(self):
+        """
+        Asserts that #authenticate skips the user_show request until
+        user_data is first accessed, and then fetches it once.
+        """
+        session = FreeIpaSession("ipa.foo.com")
+        session.session.post = mock.Mock(return_value=mock.Mock(status_code=200))
+        session._get_user_data = mock.Mock(return_value={"uid": ["some_username"]})
+        session.authenticate(self.username, self.password)
+        assert session.user_is_authenticated
+        assert not session.has_user_data
+        session._get_user_data.assert_not_called()
+        assert session.user_data == {"uid": ["some_username"]}
+        assert session.groups == []
+        session._get_user_data.assert_called_once_with()
+
+    def test_user_data_loader(self):
+        """
+        Asserts that a user_data_loader replaces the user_show request
+        on the session itself.
+        """
+        session = FreeIpaSession("ipa.foo.com")
+        session.user_is_authenticated = True
+        session._get_user_data = mock.Mock()
+        session.user_data_loader = mock.Mock(return_value={"uid": ["other"]})
+        assert session.user_data == {"uid": ["other"]}
+        session.user_data_loader.assert_called_once_with(session)
+        session._get_user_data.assert_not_called()
+
+    def test_user_data_unauthenticated_not_fetched(self):
+        session = FreeIpaSession("ipa.foo.com")
+        session._get_user_data = mock.Mock()
+        assert session.user_data == {}
+        session._get_user_data.assert_not_called()
+
+    def test_batch_sends_single_request(self):
+        """
+        Asserts that queued batch calls are sent as one freeipa batch
+        request and results come back in call order.
+        """
+        session = FreeIpaSession("ipa.foo.com")
+        session.make_session_request = mock.Mock(return_value={
+            "result": {"count": 2, "results": [
+                {"result": {"cn": ["admins"]}, "error": None},
+                {"result": None, "error": "group not found"},
+            ]}
+        })
+        batch = session.batch()
+        assert batch.add("group_show", ["admins"]) == 0
+        assert batch.add("group_show", ["missing"], {"all": True}) == 1
+        results = batch.execute()
+        session.make_session_request.assert_called_once_with({
+            "method": "batch",
+            "item": [
+                {"method": "group_show", "params": [["admins"], {}]},
+                {"method": "group_show", "params": [["missing"], {"all": True}]},
+            ],
+            "params": {},
+        })
+        assert results[0]["result"] == {"cn": ["admins"]}
+        assert results[1]["error"] == "group not found"
+
+    def test_empty_batch_makes_no_request(self):
+        session = FreeIpaSession("ipa.foo.com")
+        session.make_session_request = mock.Mock()
+        assert session.batch().execute() == []
+        session.make_session_request.assert_not_called()
+
+    def test_get_user_data_batches_post_login_calls(self):
+        """
+        Asserts that post login calls are sent in the same batch
+        request as user_show.
+        """
+        session = FreeIpaSession("ipa.foo.com")
+        session.user = "some_username"
+        session.user_is_authenticated = True
+        session.post_login_calls = [
+            {"method": "group_show", "item": ["admins"], "params": {}},
+        ]
+        session.make_batch_request = mock.Mock(return_value=[
+            {"result": {"uid": ["some_username"]}, "error": None},
+            {"result": {"cn": ["admins"]}, "error": None},
+        ])
+        user_data = session._get_user_data()
+        calls = session.make_batch_request.call_args[0][0]
+        assert [call["method"] for call in calls] == ["user_show", "group_show"]
+        assert user_data == {"uid": ["some_username"]}
+        assert session.post_login_results == [{"result": {"cn": ["admins"]}, "error": None}]
+
     def test_get_user_data_unauthenticated_returns_dict(self):
         """
         Asserts that #_get_user_data returns {} if the user
@@ -87,3 +185,117 @@ class TestFreeIpaSession:
         session = FreeIpaSession("ipa.foo.com")
         user_data = session._get_user_data()
         assert user_data == {}
+
+
+class TestUserShowParams:
+    def test_default_attrs(self):
+        assert get_user_show_params(["givenname", "sn", "mail"]) == {
+            "all": False, "raw": False
+        }
+
+    def test_non_default_attr_requests_all(self):
+        assert get_user_show_params(["mail", "displayname"])["all"] is True
+
+    def test_without_members(self):
+        params = get_user_show_params(["mail"], members=False)
+        assert params["no_members"] is True
+
+    def test_session_sends_params(self):
+        params = get_user_show_params(["mail"], members=False)
+        session = FreeIpaSession("ipa.foo.com", user_show_params=params)
+        session.user = "testuser"
+        assert session.user_post_data["params"] == {
+            "all": False, "raw": False, "no_members": True
+        }
+
+
+class TestDecodeResponse:
+    def test_decode_with_orjson(self):
+        orjson = pytest.importorskip("orjson")
+        response = mock.Mock(content=b'{"result": {"result": {"uid": ["testuser"]}}}')
+        with mock.patch("freeipa_auth.freeipa_utils.orjson", orjson):
+            assert decode_response(response) == {"result": {"result": {"uid": ["testuser"]}}}
+        response.json.assert_not_called()
+
+    @mock.patch("freeipa_auth.freeipa_utils.orjson", None)
+    def test_decode_without_orjson(self):
+        response = mock.Mock()
+        response.json.return_value = {"result": None}
+        assert decode_response(response) == {"result": None}
+
+
+class TestRequestTemplate:
+
+    def test_template_precomputed_per_server(self):
+        template = get_request_template("ipa.foo.com")
+        assert get_request_template("ipa.foo.com") is template
+        assert template.login_url == "https://ipa.foo.com/ipa/session/login_password"
+        assert template.session_headers["referer"] == "https://ipa.foo.com/ipa/session/json"
+
+    def test_template_headers_immutable(self):
+        with pytest.raises(TypeError):
+            get_request_template("ipa.foo.com").login_headers["referer"] = "elsewhere"
+
+    def test_concurrent_requests_do_not_share_state(self):
+        """
+        Asserts that concurrent sessions for different servers and
+        methods always send their own URL, referer and payload.
+        """
+        sent = []
+        lock = threading.Lock()
+
+        def post(self, url, headers=None, data=None, **kwargs):
+            payload = json.loads(data)
+            with lock:
+                sent.append((url, headers["referer"], payload["method"], payload["params"][0]))
+            return mock.Mock(json=mock.Mock(return_value={}), content=b'{}')
+
+        def worker(index):
+            server = "ipa{index}.foo.com".format(index=index % 3)
+            session = FreeIpaSession(server)
+            for call in range(50):
+                method = "method_{index}_{call}".format(index=index, call=call)
+                session.make_session_request({"method": method, "item": [server], "params": {}})
+
+        with mock.patch("requests.Session.post", post):
+            threads = [threading.Thread(target=worker, args=(index,)) for index in range(12)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        assert len(sent) == 12 * 50
+        for url, referer, method, item in sent:
+            server = item[0]
+            assert url == referer == "https://{server}/ipa/session/json".format(server=server)
+            index = int(method.split("_")[1])
+            assert server == "ipa{index}.foo.com".format(index=index % 3)
+
+
+class TestConnectionPoolRegistry:
+
+    def teardown_method(self):
+        connection_pools.clear()
+
+    def test_sessions_share_server_adapter(self):
+        """
+        Asserts that sessions for the same server share one pooled
+        adapter while keeping separate cookie jars.
+        """
+        first = FreeIpaSession("ipa.foo.com")
+        second = FreeIpaSession("ipa.foo.com")
+        url = "https://ipa.foo.com/ipa/session/json"
+        assert first.session.get_adapter(url) is second.session.get_adapter(url)
+        assert first.session.cookies is not second.session.cookies
+
+    def test_servers_get_separate_adapters(self):
+        """
+        Asserts that each server gets its own pooled adapter sized
+        from the given pool size.
+        """
+        first = FreeIpaSession("ipa.foo.com", pool_size=3)
+        second = FreeIpaSession("ipa.failover.com", pool_size=3)
+        first_adapter = first.session.get_adapter("https://ipa.foo.com/")
+        second_adapter = second.session.get_adapter("https://ipa.failover.com/")
+        assert first_adapter is not second_adapter
+        assert first_adapter._pool_maxsize == 3
@@ -0,0 +1,79 @@
+import pytest
+import threading
+
+from unittest import mock
+
+from freeipa_auth.groups import GroupHierarchy, GroupHierarchyIndex
+
+
+class TestGroupHierarchy:
+
+    def test_transitive_closure(self):
+        hierarchy = GroupHierarchy({
+            "developers": ["engineering"],
+            "engineering": ["staff"],
+            "staff": [],
+            "ops": ["engineering", "oncall"],
+        })
+        assert hierarchy.ancestors["developers"] == {"engineering", "staff"}
+        assert hierarchy.ancestors["ops"] == {"engineering", "staff", "oncall"}
+        assert hierarchy.ancestors["staff"] == set()
+
+    def test_cycles_terminate(self):
+        hierarchy = GroupHierarchy({"a": ["b"], "b": ["a"]})
+        assert hierarchy.ancestors["a"] == {"b"}
+        assert hierarchy.ancestors["b"] == {"a"}
+
+    def test_effective_groups(self):
+        hierarchy = GroupHierarchy.from_records([
+            {"cn": ["developers"], "memberof_group": ["engineering"]},
+            {"cn": ["engineering"], "memberof_group": ["staff"]},
+            {"cn": ["staff"]},
+        ])
+        assert hierarchy.effective_groups(["developers", "unknown"]) == {
+            "developers", "engineering", "staff", "unknown"
+        }
+
+
+class TestGroupHierarchyIndex:
+
+    def test_reloads_when_stale(self):
+        index = GroupHierarchyIndex()
+        loader = mock.Mock(side_effect=lambda: GroupHierarchy({}))
+        first = index.get(loader, max_age=60)
+        assert index.get(loader, max_age=60) is first
+        assert loader.call_count == 1
+        index.get(loader, max_age=0)
+        assert loader.call_count == 2
+
+    @mock.patch('freeipa_auth.groups.logger.exception', mock.Mock()) # mute for tests
+    def test_failed_reload_keeps_previous(self):
+        index = GroupHierarchyIndex()
+        hierarchy = index.get(lambda: GroupHierarchy({}), max_age=60)
+        assert index.get(mock.Mock(side_effect=ValueError), max_age=0) is hierarchy
+
+    def test_failed_first_load_raises(self):
+        with pytest.raises(ValueError):
+            GroupHierarchyIndex().get(mock.Mock(side_effect=ValueError), max_age=60)
+
+    def test_stale_served_during_reload(self):
+        index = GroupHierarchyIndex()
+        stale = index.get(lambda: GroupHierarchy({}), max_age=60)
+        started = threading.Event()
+        release = threading.Event()
+        fresh = GroupHierarchy({"developers": []})
+
+        def slow_loader():
+            started.set()
+            release.wait()
+            return fresh
+
+        reload = threading.Thread(target=index.get, args=(slow_loader, 0))
+        reload.start()
+        started.wait()
+        loader = mock.Mock()
+        assert index.get(loader, max_age=0) is stale
+        loader.assert_not_called()
+        release.set()
+        reload.join()
+        assert index.get(loader, max_age=60) is fresh
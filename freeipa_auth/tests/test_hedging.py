@@ -0,0 +1,90 @@
+import threading
+import pytest
+
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+from freeipa_auth.hedging import HedgedAttempt, run_hedged
+
+
+@pytest.fixture
+def executor(request):
+    """Fixture for a thread pool shut down after each test"""
+    executor = ThreadPoolExecutor(max_workers=4)
+    request.addfinalizer(lambda: executor.shutdown(wait=False))
+    return executor
+
+
+class TestRunHedged:
+
+    def test_fast_primary_wins_alone(self, executor):
+        secondary = mock.Mock(return_value="secondary")
+        result = run_hedged([
+            HedgedAttempt(lambda: "primary", mock.Mock(), 1),
+            HedgedAttempt(secondary, mock.Mock(), 1),
+        ], executor=executor)
+        assert result == "primary"
+        secondary.assert_not_called()
+
+    def test_slow_primary_is_hedged_and_cancelled(self, executor):
+        release = threading.Event()
+        primary_cancel = mock.Mock()
+
+        def slow_primary():
+            release.wait(5)
+            return "primary"
+
+        try:
+            result = run_hedged([
+                HedgedAttempt(slow_primary, primary_cancel, 0.01),
+                HedgedAttempt(lambda: "secondary", mock.Mock(), 1),
+            ], executor=executor)
+        finally:
+            release.set()
+        assert result == "secondary"
+        primary_cancel.assert_called_once_with()
+
+    def test_queued_primary_not_hedged(self):
+        """
+        Asserts that the delay of an attempt waiting for a free worker
+        only starts once the attempt runs.
+        """
+        executor = ThreadPoolExecutor(max_workers=1)
+        release = threading.Event()
+        executor.submit(release.wait, 5)
+        try:
+            with mock.patch.object(executor, "submit", wraps=executor.submit) as submit:
+                timer = threading.Timer(0.2, release.set)
+                timer.start()
+                result = run_hedged([
+                    HedgedAttempt(lambda: "primary", mock.Mock(), 0.01),
+                    HedgedAttempt(lambda: "secondary", mock.Mock(), 1),
+                ], executor=executor)
+        finally:
+            release.set()
+            executor.shutdown(wait=False)
+        assert result == "primary"
+        assert submit.call_count == 1
+
+    def test_failed_primary_hedges_immediately(self, executor):
+        result = run_hedged([
+            HedgedAttempt(mock.Mock(side_effect=ValueError), mock.Mock(), 5),
+            HedgedAttempt(lambda: "secondary", mock.Mock(), 5),
+        ], executor=executor, retry_on=(ValueError,))
+        assert result == "secondary"
+
+    def test_all_failed_raises(self, executor):
+        with pytest.raises(ValueError):
+            run_hedged([
+                HedgedAttempt(mock.Mock(side_effect=ValueError), mock.Mock(), 1),
+                HedgedAttempt(mock.Mock(side_effect=ValueError), mock.Mock(), 1),
+            ], executor=executor, retry_on=(ValueError,))
+
+    def test_unexpected_error_raises(self, executor):
+        secondary = mock.Mock(return_value="secondary")
+        with pytest.raises(KeyError):
+            run_hedged([
+                HedgedAttempt(mock.Mock(side_effect=KeyError), mock.Mock(), 1),
+                HedgedAttempt(secondary, mock.Mock(), 1),
+            ], executor=executor, retry_on=(ValueError,))
+        secondary.assert_not_called()
@@ -0,0 +1,121 @@
+import pytest
+import requests
+
+from unittest import mock
+from django.contrib.auth import login
+from django.contrib.auth.models import AnonymousUser
+from django.contrib.sessions.backends.db import SessionStore
+from django.test import RequestFactory, override_settings
+
+from freeipa_auth.backends import FreeIpaRpcAuthBackend
+from freeipa_auth.freeipa_utils import FreeIpaSession, FreeIpaSessionExpired
+from freeipa_auth.ipa_sessions import SESSION_KEY, Fernet, IpaSessionStore
+
+COOKIE = {'value': 'MagBearerToken=abc', 'domain': 'ipa.foo.com',
+          'path': '/ipa'}
+
+requires_cryptography = pytest.mark.skipif(
+    Fernet is None, reason="storing IPA sessions requires cryptography"
+)
+
+
+@requires_cryptography
+class TestIpaSessionStore:
+    def test_round_trip(self):
+        store = IpaSessionStore(60)
+        session = {}
+        store.save(session, 'ipa.foo.com', 'chester', COOKIE)
+        assert store.load(session) == {'server': 'ipa.foo.com',
+                                       'user': 'chester', 'cookie': COOKIE}
+
+    def test_cookie_encrypted(self):
+        session = {}
+        IpaSessionStore(60).save(session, 'ipa.foo.com', 'chester', COOKIE)
+        assert 'MagBearerToken' not in session[SESSION_KEY]
+
+    def test_other_secret_cannot_load(self):
+        session = {}
+        IpaSessionStore(60).save(session, 'ipa.foo.com', 'chester', COOKIE)
+        assert IpaSessionStore(60, secret='other').load(session) is None
+
+    def test_expired(self):
+        store = IpaSessionStore(60)
+        session = {}
+        with mock.patch('time.time', return_value=1000):
+            store.save(session, 'ipa.foo.com', 'chester', COOKIE)
+        with mock.patch('time.time', return_value=1061):
+            assert store.load(session) is None
+
+    def test_clear(self):
+        store = IpaSessionStore(60)
+        session = {}
+        store.save(session, 'ipa.foo.com', 'chester', COOKIE)
+        store.clear(session)
+        assert store.load(session) is None
+
+
+class TestFreeIpaSessionCookie:
+    def test_from_cookie_sends_cookie(self):
+        ipa_session = FreeIpaSession.from_cookie('ipa.foo.com', 'chester',
+                                                 COOKIE)
+        assert ipa_session.user_is_authenticated
+        assert ipa_session.export_cookie() == COOKIE
+        prepared = ipa_session.session.prepare_request(
+            requests.Request('POST', ipa_session.template.session_url)
+        )
+        assert prepared.headers['Cookie'] == 'ipa_session=MagBearerToken=abc'
+
+    def test_export_cookie_without_login(self):
+        assert FreeIpaSession('ipa.foo.com').export_cookie() is None
+
+    def test_expired_session_raises(self):
+        ipa_session = FreeIpaSession.from_cookie('ipa.foo.com', 'chester',
+                                                 COOKIE)
+        response = mock.Mock(status_code=401)
+        with mock.patch.object(ipa_session.session, 'post',
+                               return_value=response):
+            with pytest.raises(FreeIpaSessionExpired):
+                ipa_session.make_session_request(ipa_session.user_post_data)
+
+
+@requires_cryptography
+class TestStoredIpaSession:
+    @override_settings(
+        FREEIPA_AUTH_SERVER="ipa.foo.com",
+        FREEIPA_AUTH_STORE_IPA_SESSION=True,
+    )
+    @mock.patch('freeipa_auth.backends.FreeIpaSession.authenticate',
+                autospec=True)
+    def test_login_stores_ipa_session(self, mock_authenticate, test_user):
+        def authenticate(ipa_session, user, password, **kwargs):
+            ipa_session.user = user
+            ipa_session.session.cookies.set('ipa_session', COOKIE['value'],
+                                            domain=COOKIE['domain'],
+                                            path=COOKIE['path'])
+            return mock.Mock(status_code=200)
+        mock_authenticate.side_effect = authenticate
+
+        request = RequestFactory().post('/login/')
+        request.session = SessionStore()
+        request.user = AnonymousUser()
+        backend = FreeIpaRpcAuthBackend()
+        with mock.patch.object(backend, 'get_synced_user',
+                               return_value=test_user):
+            user = backend.authenticate(request, username=test_user.username,
+                                        password='secret')
+        login(request, user,
+              backend='freeipa_auth.backends.FreeIpaRpcAuthBackend')
+
+        ipa_session = backend.get_ipa_session(request)
+        assert ipa_session.host_server == 'ipa.foo.com'
+        assert ipa_session.user == test_user.username
+        assert ipa_session.export_cookie() == COOKIE
+
+    @override_settings(FREEIPA_AUTH_STORE_IPA_SESSION=True)
+    def test_other_user_gets_no_session(self, test_user):
+        request = RequestFactory().get('/')
+        request.session = SessionStore()
+        request.user = test_user
+        IpaSessionStore(1200).save(request.session, 'ipa.foo.com', 'someone',
+                                   COOKIE)
+        assert FreeIpaRpcAuthBackend().get_ipa_session(request) is None
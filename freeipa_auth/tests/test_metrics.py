@@ -0,0 +1,141 @@
+import pytest
+import requests
+
+from collections import namedtuple
+from unittest import mock
+from django.http import Http404
+from django.test import RequestFactory, override_settings
+
+from freeipa_auth.backends import FreeIpaRpcAuthBackend
+from freeipa_auth.freeipa_utils import FreeIpaSession
+from freeipa_auth.metrics import (
+    InMemoryMetricsSink, MetricsRegistry, PrometheusMetricsSink, metrics,
+    timed
+)
+from freeipa_auth.views import metrics_view
+
+
+@pytest.fixture
+def sink(request):
+    """Fixture installing an in memory metrics sink for one test"""
+    request.addfinalizer(lambda: metrics.configure(None))
+    metrics.configure('freeipa_auth.metrics.InMemoryMetricsSink')
+    return metrics.sink
+
+
+class TestTimed:
+    def test_records_success(self, sink):
+        with timed('phase', server='ipa.foo.com'):
+            pass
+        assert len(sink.get_observations('phase_seconds', server='ipa.foo.com',
+                                         outcome='success')) == 1
+        assert sink.get_count('phase_total', server='ipa.foo.com',
+                              outcome='success') == 1
+
+    def test_records_error(self, sink):
+        with pytest.raises(ValueError):
+            with timed('phase'):
+                raise ValueError
+        assert sink.get_count('phase_total', outcome='error') == 1
+
+    def test_block_sets_outcome(self, sink):
+        with timed('phase') as outcome:
+            outcome['outcome'] = 'failure'
+        assert sink.get_count('phase_total', outcome='failure') == 1
+
+
+class TestMetricsRegistry:
+    def test_configure_same_path_keeps_sink(self):
+        registry = MetricsRegistry()
+        registry.configure('freeipa_auth.metrics.InMemoryMetricsSink')
+        sink = registry.sink
+        registry.configure('freeipa_auth.metrics.InMemoryMetricsSink')
+        assert registry.sink is sink
+        assert isinstance(sink, InMemoryMetricsSink)
+
+    @override_settings(
+        FREEIPA_AUTH_METRICS_SINK='freeipa_auth.metrics.PrometheusMetricsSink'
+    )
+    def test_configured_from_settings(self, request):
+        request.addfinalizer(lambda: metrics.configure(None))
+        FreeIpaRpcAuthBackend()
+        assert isinstance(metrics.sink, PrometheusMetricsSink)
+
+
+class TestPrometheusMetricsSink:
+    def test_render(self):
+        sink = PrometheusMetricsSink(buckets=[0.1, 1])
+        sink.observe('login_seconds', 0.5, server='ipa.foo.com')
+        sink.increment('failovers_total', server='ipa.foo.com')
+        assert sink.render().splitlines() == [
+            '# TYPE login_seconds histogram',
+            'login_seconds_bucket{server="ipa.foo.com",le="0.1"} 0',
+            'login_seconds_bucket{server="ipa.foo.com",le="1"} 1',
+            'login_seconds_bucket{server="ipa.foo.com",le="+Inf"} 1',
+            'login_seconds_sum{server="ipa.foo.com"} 0.5',
+            'login_seconds_count{server="ipa.foo.com"} 1',
+            '# TYPE failovers_total counter',
+            'failovers_total{server="ipa.foo.com"} 1',
+        ]
+
+    def test_escapes_label_values(self):
+        sink = PrometheusMetricsSink()
+        sink.increment('total', server='a"b')
+        assert 'total{server="a\\"b"} 1' in sink.render()
+
+
+class TestMetricsView:
+    def test_renders_prometheus_sink(self, request):
+        request.addfinalizer(lambda: metrics.configure(None))
+        metrics.configure('freeipa_auth.metrics.PrometheusMetricsSink')
+        metrics.sink.increment('failovers_total', server='ipa.foo.com')
+        response = metrics_view(RequestFactory().get('/metrics/freeipa/'))
+        assert response.status_code == 200
+        assert b'failovers_total{server="ipa.foo.com"} 1' in response.content
+
+    def test_other_sink_not_found(self, sink):
+        with pytest.raises(Http404):
+            metrics_view(RequestFactory().get('/metrics/freeipa/'))
+
+
+class TestInstrumentation:
+    username = "dummy_freeipa_username"
+    password = "dummy_freeipa_password"
+
+    def test_login_failure_outcome(self, sink, monkeypatch):
+        monkeypatch.setattr("requests.sessions.Session.request",
+                            lambda *args, **kwargs:
+                            namedtuple("Response", ['status_code'])(401))
+        FreeIpaSession("ipa.foo.com").authenticate(self.username, self.password)
+        assert sink.get_count('freeipa_auth_login_total', server='ipa.foo.com',
+                              outcome='failure') == 1
+
+    def test_session_request_labelled_by_method(self, sink):
+        session = FreeIpaSession("ipa.foo.com")
+        response = mock.Mock()
+        response.json.return_value = {'result': {'result': {}}}
+        response.content = b'{"result": {"result": {}}}'
+        with mock.patch.object(session.session, 'post', return_value=response):
+            session.make_session_request({'method': 'user_show', 'item': [],
+                                          'params': {}})
+        assert sink.get_count('freeipa_auth_request_total',
+                              server='ipa.foo.com', method='user_show',
+                              outcome='success') == 1
+
+    @override_settings(
+        FREEIPA_AUTH_SERVER="ipa.foo.com",
+        FREEIPA_AUTH_FAILOVER_SERVER="ipa.failover.com",
+    )
+    @mock.patch('freeipa_auth.backends.logger.critical')  # mute for tests
+    @mock.patch('freeipa_auth.backends.FreeIpaSession')
+    def test_failover_counted(self, mock_freeipa, mock_logger_critical, sink):
+        mock_freeipa.return_value.authenticate = mock.Mock(
+            side_effect=requests.ConnectionError
+        )
+        with pytest.raises(requests.ConnectionError):
+            FreeIpaRpcAuthBackend().authenticate(username=self.username,
+                                                 password=self.password)
+        assert sink.get_count('freeipa_auth_failovers_total',
+                              server='ipa.foo.com') == 1
+        assert sink.get_count('freeipa_auth_failovers_total',
+                              server='ipa.failover.com') == 0
@@ -0,0 +1,102 @@
+import pytest
+import requests
+
+from unittest import mock
+from django.contrib.auth import BACKEND_SESSION_KEY, SESSION_KEY
+from django.contrib.auth.models import AnonymousUser
+from django.contrib.sessions.backends.db import SessionStore
+from django.core.exceptions import ImproperlyConfigured
+from django.http import HttpResponse
+from django.test import RequestFactory, override_settings
+
+from freeipa_auth.middleware import (
+    VALIDATED_AT_KEY, FreeIpaSessionRevalidationMiddleware
+)
+from freeipa_auth.revalidation import AccountStatus
+from freeipa_auth.settings import FreeIpaAuthSettings
+
+BACKEND = 'freeipa_auth.backends.FreeIpaRpcAuthBackend'
+
+
+@pytest.fixture
+def make_request(test_user):
+    def make_request(backend=BACKEND, validated_at=1000):
+        request = RequestFactory().get('/')
+        request.session = SessionStore()
+        request.session[SESSION_KEY] = str(test_user.pk)
+        request.session[BACKEND_SESSION_KEY] = backend
+        if validated_at is not None:
+            request.session[VALIDATED_AT_KEY] = validated_at
+        request.user = test_user
+        return request
+    return make_request
+
+
+def revalidate(request, status):
+    middleware = FreeIpaSessionRevalidationMiddleware(lambda r: HttpResponse())
+    with mock.patch('freeipa_auth.backends.FreeIpaRpcAuthBackend.get_account_status',
+                    **status) as get_account_status:
+        with mock.patch('time.time', return_value=2000):
+            middleware(request)
+    return get_account_status
+
+
+class TestFreeIpaSessionRevalidationMiddleware:
+    @pytest.fixture(autouse=True)
+    def revalidation_settings(self, settings):
+        settings.override(
+            FREEIPA_AUTH_SERVICE_USER="django-sync",
+            FREEIPA_AUTH_SESSION_REVALIDATE_INTERVAL=300,
+        )
+
+    def test_disabled_user_logged_out(self, make_request):
+        request = make_request()
+        get_account_status = revalidate(
+            request, {'return_value': AccountStatus(False, ())}
+        )
+        get_account_status.assert_called_once_with("testuser")
+        assert isinstance(request.user, AnonymousUser)
+        assert SESSION_KEY not in request.session
+
+    def test_active_user_kept(self, make_request, test_user):
+        request = make_request()
+        revalidate(request, {'return_value': AccountStatus(True, ())})
+        assert request.user == test_user
+        assert request.session[VALIDATED_AT_KEY] == 2000
+
+    def test_recently_validated_not_checked(self, make_request):
+        request = make_request(validated_at=1900)
+        get_account_status = revalidate(request, {'return_value': None})
+        get_account_status.assert_not_called()
+
+    def test_first_request_after_login_not_checked(self, make_request):
+        request = make_request(validated_at=None)
+        get_account_status = revalidate(request, {'return_value': None})
+        get_account_status.assert_not_called()
+        assert request.session[VALIDATED_AT_KEY] == 2000
+
+    def test_other_backend_not_checked(self, make_request):
+        request = make_request(backend='django.contrib.auth.backends.ModelBackend')
+        get_account_status = revalidate(request, {'return_value': None})
+        get_account_status.assert_not_called()
+
+    def test_unreachable_freeipa_keeps_session(self, make_request, test_user):
+        request = make_request()
+        revalidate(request, {'side_effect': requests.ConnectionError})
+        assert request.user == test_user
+
+    def test_rejected_service_login_keeps_session(self, make_request, test_user):
+        request = make_request()
+        revalidate(request, {'side_effect': requests.HTTPError("401 Unauthorized")})
+        assert request.user == test_user
+
+    @override_settings(FREEIPA_AUTH_UPDATE_USER_GROUPS=True)
+    def test_groups_synced(self, make_request, test_user, test_group):
+        request = make_request()
+        revalidate(request, {'return_value': AccountStatus(True, (test_group.name,))})
+        assert list(test_user.groups.all()) == [test_group]
+
+    @override_settings(FREEIPA_AUTH_SERVICE_USER=None)
+    def test_requires_service_user(self):
+        with pytest.raises(ImproperlyConfigured):
+            FreeIpaAuthSettings()
@@ -0,0 +1,78 @@
+import pytest
+
+from unittest import mock
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+
+from freeipa_auth.backends import FreeIpaRpcAuthBackend
+
+
+@pytest.fixture
+def backend(request, db, settings):
+    """Fixture for a backend with the permission cache enabled"""
+    request.addfinalizer(cache.clear)
+    settings.override(FREEIPA_AUTH_PERMISSION_CACHE_TTL=60)
+    return FreeIpaRpcAuthBackend()
+
+
+@pytest.fixture
+def group_user(test_user, test_group, test_permission):
+    test_group.permissions.add(test_permission)
+    test_user.groups.add(test_group)
+    return test_user
+
+
+def fresh(user):
+    """Reload a user so ModelBackend's per instance cache is empty"""
+    return get_user_model().objects.get(pk=user.pk)
+
+
+class TestPermissionCache:
+    perm = "auth.test_permission"
+
+    def test_has_perm_from_cache(self, backend, group_user, django_assert_num_queries):
+        assert backend.has_perm(fresh(group_user), self.perm)
+        user = fresh(group_user)
+        with django_assert_num_queries(0):
+            assert backend.has_perm(user, self.perm)
+
+    def test_users_with_same_groups_share_entry(self, backend, group_user, test_group,
+                                                django_assert_num_queries):
+        other = get_user_model().objects.create(username="other")
+        other.groups.add(test_group)
+        assert backend.has_perm(fresh(group_user), self.perm)
+        other = fresh(other)
+        # only the user's own groups and permissions are read
+        with django_assert_num_queries(2):
+            assert backend.has_perm(other, self.perm)
+
+    def test_group_membership_change_invalidates(self, backend, group_user, test_group):
+        assert backend.has_perm(fresh(group_user), self.perm)
+        group_user.groups.remove(test_group)
+        assert not backend.has_perm(fresh(group_user), self.perm)
+
+    def test_reverse_membership_change_invalidates(self, backend, group_user, test_group):
+        assert backend.has_perm(fresh(group_user), self.perm)
+        test_group.user_set.remove(group_user)
+        assert not backend.has_perm(fresh(group_user), self.perm)
+
+    def test_group_permission_change_invalidates(self, backend, group_user, test_group,
+                                                 test_permission):
+        assert backend.has_perm(fresh(group_user), self.perm)
+        test_group.permissions.remove(test_permission)
+        assert not backend.has_perm(fresh(group_user), self.perm)
+
+    def test_user_permissions(self, backend, test_user, test_permission):
+        assert not backend.has_perm(fresh(test_user), self.perm)
+        test_user.user_permissions.add(test_permission)
+        assert backend.has_perm(fresh(test_user), self.perm)
+
+    def test_disabled_by_default(self, group_user):
+        assert FreeIpaRpcAuthBackend().permission_cache is None
+        assert FreeIpaRpcAuthBackend().has_perm(fresh(group_user), self.perm)
+
+    def test_disabled_cache_not_invalidated(self, group_user, test_group):
+        with mock.patch('freeipa_auth.permissions.PermissionCache') as permission_cache:
+            group_user.groups.remove(test_group)
+            test_group.save()
+        permission_cache.assert_not_called()
@@ -0,0 +1,159 @@
+import django
+import pytest
+import threading
+import time
+
+from unittest import mock
+from django.test import override_settings
+
+from freeipa_auth.backends import FreeIpaRpcAuthBackend
+from freeipa_auth.revalidation import (
+    MISSING_ACCOUNT, AccountStatus, AccountStatusBatcher, is_account_locked
+)
+
+try:
+    from asgiref.sync import async_to_sync
+except ImportError:  # Django 2.2 does not install asgiref
+    async_to_sync = None
+
+
+def run_in_threads(targets):
+    results = [None] * len(targets)
+
+    def run(index):
+        results[index] = targets[index]()
+
+    threads = [threading.Thread(target=run, args=(index,))
+               for index in range(len(targets))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+class TestIsAccountLocked:
+    def test_boolean(self):
+        assert is_account_locked({"nsaccountlock": True})
+        assert not is_account_locked({"nsaccountlock": False})
+
+    def test_string_list(self):
+        assert is_account_locked({"nsaccountlock": ["TRUE"]})
+        assert not is_account_locked({"nsaccountlock": ["FALSE"]})
+
+    def test_missing(self):
+        assert not is_account_locked({})
+
+
+class TestAccountStatusBatcher:
+    def test_concurrent_lookups_share_batch(self):
+        batcher = AccountStatusBatcher()
+        fetch = mock.Mock(side_effect=lambda usernames: {
+            username: AccountStatus(True, ()) for username in usernames
+        })
+        results = run_in_threads([
+            lambda username=username: batcher.get(username, fetch,
+                                                  window=0.5, max_size=3)
+            for username in ["a", "b", "c"]
+        ])
+
+        assert results == [AccountStatus(True, ())] * 3
+        fetch.assert_called_once()
+        assert sorted(fetch.call_args[0][0]) == ["a", "b", "c"]
+
+    def test_full_batch_not_delayed(self):
+        batcher = AccountStatusBatcher()
+        fetch = mock.Mock(return_value={"a": MISSING_ACCOUNT})
+        started = time.monotonic()
+        assert batcher.get("a", fetch, window=5, max_size=1) == MISSING_ACCOUNT
+        assert time.monotonic() - started < 1
+
+    def test_unknown_user(self):
+        batcher = AccountStatusBatcher()
+        assert batcher.get("a", mock.Mock(return_value={}),
+                           window=0, max_size=10) is None
+
+    def test_error_shared(self):
+        batcher = AccountStatusBatcher()
+        fetch = mock.Mock(side_effect=ValueError)
+
+        def get():
+            try:
+                batcher.get("a", fetch, window=0.5, max_size=10)
+            except ValueError as e:
+                return e
+
+        results = run_in_threads([get, get])
+        assert all(isinstance(result, ValueError) for result in results)
+        fetch.assert_called_once()
+
+
+class TestAccountStatus:
+    @override_settings(
+        FREEIPA_AUTH_SERVICE_USER="django-sync",
+        FREEIPA_AUTH_UPDATE_USER_GROUPS=True,
+    )
+    def test_fetch_account_statuses(self):
+        service_session = mock.Mock()
+        service_session.batch.return_value.execute.return_value = [
+            {"result": {"nsaccountlock": False, "memberof_group": ["admin"]}},
+            {"result": {"nsaccountlock": True}},
+            {"error": "gone: user not found", "error_name": "NotFound"},
+            {"error": "boom", "error_name": "InternalError"},
+        ]
+        backend = FreeIpaRpcAuthBackend()
+        with mock.patch.object(backend, 'get_service_session',
+                               return_value=service_session):
+            statuses = backend.fetch_account_statuses(
+                ["active", "locked", "gone", "unknown"]
+            )
+
+        assert statuses == {
+            "active": AccountStatus(True, ("admin",)),
+            "locked": AccountStatus(False, ()),
+            "gone": MISSING_ACCOUNT,
+        }
+        service_session.batch.return_value.add.assert_any_call(
+            "user_show", ["active"], {"all": False, "raw": False}
+        )
+
+    @override_settings(
+        FREEIPA_AUTH_SERVICE_USER="django-sync",
+        FREEIPA_AUTH_SESSION_REVALIDATE_INTERVAL=300,
+    )
+    def test_status_cached(self):
+        backend = FreeIpaRpcAuthBackend()
+        with mock.patch.object(backend, 'fetch_account_statuses', return_value={
+            "chester": AccountStatus(True, ())
+        }) as fetch:
+            backend.get_account_status("chester")
+            assert backend.get_account_status("chester") == AccountStatus(True, ())
+        fetch.assert_called_once_with(["chester"])
+        backend.account_status_cache.invalidate("chester")
+
+    @override_settings(
+        FREEIPA_AUTH_SERVICE_USER="django-sync",
+        FREEIPA_AUTH_SESSION_REVALIDATE_INTERVAL=300,
+    )
+    @pytest.mark.skipif(django.VERSION < (4, 2),
+                        reason="aauthenticate requires Django 4.2")
+    def test_login_forgets_status(self, test_user):
+        backend = FreeIpaRpcAuthBackend()
+        backend.account_status_cache.set(test_user.username, AccountStatus(False, ()))
+        user_session = mock.Mock(user=test_user.username)
+        user_session.export_cookie.return_value = None
+
+        async def authenticate_on_servers(username, password):
+            return user_session, mock.Mock(status_code=200)
+
+        async def get_synced_user(user_session, cached_user_data):
+            return test_user
+
+        with mock.patch.object(backend, "aauthenticate_on_servers", authenticate_on_servers), \
+                mock.patch.object(backend, "aget_synced_user", get_synced_user):
+            user = async_to_sync(backend.aauthenticate)(
+                None, username=test_user.username, password="secret"
+            )
+
+        assert user == test_user
+        assert backend.account_status_cache.get(test_user.username) is None
@@ -0,0 +1,105 @@
+from unittest import mock
+
+from freeipa_auth.servers import ServerHealth, ServerPool
+
+
+@mock.patch('freeipa_auth.servers.logger.critical', mock.Mock()) # mute for tests
+class TestServerHealth:
+
+    def test_opens_after_threshold(self):
+        health = ServerHealth("ipa.foo.com", failure_threshold=2, cooldown=30)
+        health.record_failure(now=0)
+        assert health.available(now=1)
+        health.record_failure(now=1)
+        assert health.state == ServerHealth.OPEN
+        assert not health.available(now=2)
+
+    def test_half_open_allows_single_probe(self):
+        health = ServerHealth("ipa.foo.com", failure_threshold=1, cooldown=30)
+        health.record_failure(now=0)
+        assert health.available(now=30)
+        assert health.state == ServerHealth.HALF_OPEN
+        assert not health.available(now=31)
+
+    def test_unused_probe_offered_again(self):
+        health = ServerHealth("ipa.foo.com", failure_threshold=1, cooldown=30)
+        health.record_failure(now=0)
+        assert health.available(now=30)
+        assert not health.available(now=59)
+        assert health.available(now=60)
+        assert health.state == ServerHealth.HALF_OPEN
+
+    def test_probe_success_closes(self):
+        health = ServerHealth("ipa.foo.com", failure_threshold=1, cooldown=30)
+        health.record_failure(now=0)
+        health.available(now=30)
+        health.record_success(0.1)
+        assert health.state == ServerHealth.CLOSED
+        assert health.available(now=31)
+
+    def test_probe_failure_reopens(self):
+        health = ServerHealth("ipa.foo.com", failure_threshold=3, cooldown=30)
+        for now in range(3):
+            health.record_failure(now=now)
+        health.available(now=40)
+        health.record_failure(now=40)
+        assert health.state == ServerHealth.OPEN
+        assert not health.available(now=41)
+
+    def test_latency_moving_average(self):
+        health = ServerHealth("ipa.foo.com")
+        health.record_success(1.0)
+        assert health.latency == 1.0
+        health.record_success(2.0)
+        assert 1.0 < health.latency < 2.0
+
+    def test_latency_percentile(self):
+        health = ServerHealth("ipa.foo.com")
+        assert health.latency_percentile(95) is None
+        for latency in range(11):
+            health.record_success(latency / 10.0)
+        assert health.latency_percentile(50) == 0.5
+        assert health.latency_percentile(90) == 0.9
+
+
+@mock.patch('freeipa_auth.servers.logger.critical', mock.Mock()) # mute for tests
+class TestServerPool:
+
+    def test_candidates_in_configured_order(self):
+        pool = ServerPool(["ipa1.foo.com", "ipa2.foo.com"])
+        assert pool.candidates() == ["ipa1.foo.com", "ipa2.foo.com"]
+
+    def test_candidates_ranked_by_latency(self):
+        pool = ServerPool(["ipa1.foo.com", "ipa2.foo.com"])
+        pool.record_success("ipa1.foo.com", 0.5)
+        pool.record_success("ipa2.foo.com", 0.1)
+        assert pool.candidates() == ["ipa2.foo.com", "ipa1.foo.com"]
+
+    def test_candidates_skip_unhealthy(self):
+        pool = ServerPool(["ipa1.foo.com", "ipa2.foo.com"], failure_threshold=1)
+        pool.record_failure("ipa1.foo.com")
+        assert pool.candidates() == ["ipa2.foo.com"]
+
+    def test_recovered_server_returns_without_probe(self):
+        """
+        Asserts that a server listed for a probe that another, faster
+        server served comes back once the cooldown passed again.
+        """
+        pool = ServerPool(["ipa1.foo.com", "ipa2.foo.com"], failure_threshold=1, cooldown=30)
+        pool.record_success("ipa1.foo.com", 0.01)
+        pool.record_success("ipa2.foo.com", 0.05)
+        with mock.patch("time.monotonic", return_value=0):
+            pool.record_failure("ipa2.foo.com")
+        with mock.patch("time.monotonic", return_value=30):
+            assert pool.candidates() == ["ipa1.foo.com", "ipa2.foo.com"]
+        pool.record_success("ipa1.foo.com", 0.01)
+        with mock.patch("time.monotonic", return_value=31):
+            assert pool.candidates() == ["ipa1.foo.com"]
+        with mock.patch("time.monotonic", return_value=60):
+            assert pool.candidates() == ["ipa1.foo.com", "ipa2.foo.com"]
+
+    def test_hedge_delay(self):
+        pool = ServerPool(["ipa1.foo.com"])
+        assert pool.hedge_delay("ipa1.foo.com", 95, default=1) == 1
+        pool.record_success("ipa1.foo.com", 0.2)
+        assert pool.hedge_delay("ipa1.foo.com", 95, default=1) == 0.2
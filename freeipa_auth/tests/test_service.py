@@ -0,0 +1,120 @@
+import pytest
+import requests
+
+from unittest import mock
+from django.test import override_settings
+
+from freeipa_auth.backends import FreeIpaRpcAuthBackend
+from freeipa_auth.freeipa_utils import FreeIpaSessionExpired
+from freeipa_auth.service import ServiceSession
+
+
+def mock_session(*responses):
+    session = mock.Mock()
+    session.make_session_request.side_effect = list(responses)
+    return session
+
+
+class TestServiceSession:
+    post_data = {'method': 'user_show', 'item': ['chester'], 'params': {}}
+
+    def test_logs_in_once(self):
+        first = mock_session({'result': 1}, {'result': 2})
+        login = mock.Mock(return_value=first)
+        service_session = ServiceSession(login)
+        assert login.call_count == 0
+        assert service_session.make_session_request(self.post_data) == {'result': 1}
+        assert service_session.make_session_request(self.post_data) == {'result': 2}
+        assert login.call_count == 1
+
+    def test_logs_in_again_on_expired_session(self):
+        expired = mock_session(FreeIpaSessionExpired())
+        fresh = mock_session({'result': 1})
+        login = mock.Mock(side_effect=[expired, fresh])
+        service_session = ServiceSession(login)
+        assert service_session.make_session_request(self.post_data) == {'result': 1}
+        assert login.call_count == 2
+
+    def test_expired_twice_raises(self):
+        login = mock.Mock(side_effect=[
+            mock_session(FreeIpaSessionExpired()),
+            mock_session(FreeIpaSessionExpired()),
+        ])
+        with pytest.raises(FreeIpaSessionExpired):
+            ServiceSession(login).make_session_request(self.post_data)
+
+    def test_connection_error_drops_session(self):
+        login = mock.Mock(side_effect=[
+            mock_session(requests.ConnectionError()),
+            mock_session({'result': 1}),
+        ])
+        service_session = ServiceSession(login)
+        with pytest.raises(requests.ConnectionError):
+            service_session.make_session_request(self.post_data)
+        assert service_session.make_session_request(self.post_data) == {'result': 1}
+
+    def test_max_age(self):
+        login = mock.Mock(side_effect=lambda: mock_session({'result': 1}))
+        service_session = ServiceSession(login, max_age=60)
+        with mock.patch('freeipa_auth.service.time.monotonic', return_value=0):
+            service_session.get_session()
+        with mock.patch('freeipa_auth.service.time.monotonic', return_value=59):
+            service_session.get_session()
+        assert login.call_count == 1
+        with mock.patch('freeipa_auth.service.time.monotonic', return_value=61):
+            service_session.get_session()
+        assert login.call_count == 2
+
+    def test_batch(self):
+        session = mock.Mock()
+        session.make_batch_request.return_value = [{'result': 1}]
+        batch = ServiceSession(mock.Mock(return_value=session)).batch()
+        batch.add('group_show', ['admins'])
+        assert batch.execute() == [{'result': 1}]
+
+
+class TestServiceDirectoryReads:
+    username = "dummy_freeipa_username"
+    password = "dummy_freeipa_password"
+
+    @override_settings(FREEIPA_AUTH_SERVICE_USER="django-sync")
+    def test_service_session_shared(self):
+        assert FreeIpaRpcAuthBackend().get_service_session() is \
+            FreeIpaRpcAuthBackend().get_service_session()
+
+    @override_settings(
+        FREEIPA_AUTH_SERVER="ipa.foo.com",
+        FREEIPA_AUTH_SERVICE_USER="django-sync",
+        FREEIPA_AUTH_SERVICE_DIRECTORY_READS=True,
+    )
+    @mock.patch('freeipa_auth.backends.FreeIpaSession')
+    def test_user_data_read_by_service_session(self, mock_freeipa, test_user):
+        user_session = mock_freeipa.return_value
+        user_session.authenticate.return_value = mock.Mock(status_code=200)
+
+        backend = FreeIpaRpcAuthBackend()
+        with mock.patch.object(backend, 'update_user',
+                               return_value=test_user):
+            assert backend.authenticate(username=self.username,
+                                        password=self.password) == test_user
+        assert user_session.user_data_loader == backend.fetch_directory_user_data
+
+    @override_settings(FREEIPA_AUTH_SERVICE_USER="django-sync")
+    def test_fetch_directory_user_data(self):
+        user_session = mock.Mock(user=self.username,
+                                 user_show_params={'all': True},
+                                 post_login_calls=[])
+        service_session = mock.Mock()
+        service_session.make_session_request.return_value = {
+            'result': {'result': {'uid': [self.username]}}
+        }
+        backend = FreeIpaRpcAuthBackend()
+        with mock.patch.object(backend, 'get_service_session',
+                               return_value=service_session):
+            user_data = backend.fetch_directory_user_data(user_session)
+
+        assert user_data == {'uid': [self.username]}
+        service_session.make_session_request.assert_called_once_with({
+            'method': 'user_show', 'item': [self.username],
+            'params': {'all': True}
+        })
@@ -0,0 +1,154 @@
+import asyncio
+import pytest
+import threading
+import time
+
+from unittest import mock
+from django.test import override_settings
+
+from freeipa_auth.backends import FreeIpaRpcAuthBackend
+from freeipa_auth.singleflight import SingleFlight, login_key
+
+
+def run_in_threads(count, target):
+    results = [None] * count
+
+    def run(index):
+        try:
+            results[index] = target()
+        except Exception as e:
+            results[index] = e
+
+    threads = [threading.Thread(target=run, args=(index,)) for index in range(count)]
+    for thread in threads:
+        thread.start()
+    return threads, results
+
+
+def wait_for_waiters(func):
+    """Wait until the leader runs and the other threads queued behind it"""
+    while func.call_count == 0:
+        time.sleep(0.001)
+    time.sleep(0.1)
+
+
+class TestSingleFlight:
+    def test_concurrent_calls_share_result(self):
+        flights = SingleFlight()
+        release = threading.Event()
+        func = mock.Mock(side_effect=lambda: release.wait() and "result")
+
+        threads, results = run_in_threads(
+            4, lambda: flights.do("key", func)
+        )
+        wait_for_waiters(func)
+        release.set()
+        for thread in threads:
+            thread.join()
+
+        assert results == ["result"] * 4
+        assert func.call_count == 1
+
+    def test_waiters_get_copies(self):
+        flights = SingleFlight()
+        release = threading.Event()
+        func = mock.Mock(side_effect=lambda: release.wait() and {"user": "chester"})
+
+        threads, results = run_in_threads(3, lambda: flights.do("key", func))
+        wait_for_waiters(func)
+        release.set()
+        for thread in threads:
+            thread.join()
+
+        assert results == [{"user": "chester"}] * 3
+        assert len(set(id(result) for result in results)) == 3
+
+    def test_exception_shared(self):
+        flights = SingleFlight()
+        release = threading.Event()
+
+        def fail():
+            release.wait()
+            raise ValueError("boom")
+
+        func = mock.Mock(side_effect=fail)
+        threads, results = run_in_threads(3, lambda: flights.do("key", func))
+        wait_for_waiters(func)
+        release.set()
+        for thread in threads:
+            thread.join()
+        assert all(isinstance(result, ValueError) for result in results)
+        assert func.call_count == 1
+
+    def test_sequential_calls_not_coalesced(self):
+        flights = SingleFlight()
+        func = mock.Mock(return_value="result")
+        flights.do("key", func)
+        flights.do("key", func)
+        assert func.call_count == 2
+
+    def test_async_concurrent_calls_share_result(self):
+        flights = SingleFlight()
+        calls = []
+
+        async def func():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return "result"
+
+        async def run():
+            return await asyncio.gather(*[flights.ado("key", func) for _ in range(4)])
+
+        assert asyncio.run(run()) == ["result"] * 4
+        assert len(calls) == 1
+
+    def test_async_exception_shared(self):
+        flights = SingleFlight()
+
+        async def func():
+            await asyncio.sleep(0.01)
+            raise ValueError("boom")
+
+        async def run():
+            return await asyncio.gather(
+                *[flights.ado("key", func) for _ in range(2)],
+                return_exceptions=True
+            )
+
+        assert all(isinstance(result, ValueError) for result in asyncio.run(run()))
+
+
+class TestLoginKey:
+    def test_password_fingerprint(self):
+        assert login_key("chester", "secret") == login_key("chester", "secret")
+        assert login_key("chester", "secret") != login_key("chester", "other")
+        assert "secret" not in repr(login_key("chester", "secret"))
+
+
+class TestCoalescedLogins:
+    username = "dummy_freeipa_username"
+    password = "dummy_freeipa_password"
+
+    @override_settings(FREEIPA_AUTH_COALESCE_LOGINS=True)
+    def test_concurrent_logins_share_exchange(self, test_user):
+        release = threading.Event()
+
+        def authenticate_on_freeipa(request, username, password):
+            release.wait()
+            return test_user
+
+        with mock.patch.object(FreeIpaRpcAuthBackend, "authenticate_on_freeipa",
+                               side_effect=authenticate_on_freeipa) as mock_auth:
+            threads, results = run_in_threads(
+                3, lambda: FreeIpaRpcAuthBackend().authenticate(
+                    username=self.username, password=self.password)
+            )
+            wait_for_waiters(mock_auth)
+            release.set()
+            for thread in threads:
+                thread.join()
+
+        assert results == [test_user] * 3
+        assert mock_auth.call_count == 1
+        # Every request gets its own user instance
+        assert len(set(id(user) for user in results)) == 3
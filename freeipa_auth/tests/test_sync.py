@@ -0,0 +1,285 @@
+import datetime
+import pytest
+
+from io import StringIO
+from unittest import mock
+from django.contrib.auth.models import Group, User
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import CommandError, call_command
+from django.test import override_settings
+from django.utils import timezone
+
+from freeipa_auth.backends import FreeIpaRpcAuthBackend
+from freeipa_auth.freeipa_utils import FreeIpaSession
+from freeipa_auth.sync import (
+    DirectorySync, DirectoryTruncated, IncrementalDirectorySync, chunks, get_active_usernames,
+    get_modify_timestamp
+)
+
+
+DIRECTORY = {
+    "chester": {"uid": ["chester"], "givenname": ["Chester"], "sn": ["Tester"],
+                "mail": ["chester@test.com"], "memberof_group": ["test_group"],
+                "memberofindirect_group": ["test_group2"]},
+    "lester": {"uid": ["lester"], "givenname": ["Lester"], "sn": ["Tester"],
+               "mail": ["lester@test.com"], "memberof_group": ["test_group2"]},
+    "nomail": {"uid": ["nomail"], "givenname": ["No"], "sn": ["Mail"]},
+}
+
+
+@pytest.fixture
+def directory_session():
+    """Fixture for a service session answering from a fake directory"""
+
+    def make_session_request(post_data):
+        if post_data["method"] == "user_find":
+            return {"result": {"result": [{"uid": [uid]} for uid in sorted(DIRECTORY)]}}
+        if post_data["method"] == "group_find":
+            return {"result": {"result": [{"cn": ["test_group"]}, {"cn": ["new_group"]}]}}
+        results = []
+        for call in post_data["item"]:
+            uid = call["params"][0][0]
+            results.append({"result": DIRECTORY[uid], "error": None})
+        return {"result": {"count": len(results), "results": results}}
+
+    session = FreeIpaSession("ipa.foo.com")
+    session.make_session_request = mock.Mock(side_effect=make_session_request)
+    return session
+
+
+class TestDirectorySync:
+
+    def test_chunks(self):
+        assert list(chunks(range(5), 2)) == [[0, 1], [2, 3], [4]]
+
+    def test_sync_users_creates_users(self, db, directory_session):
+        stats = DirectorySync(FreeIpaRpcAuthBackend(), directory_session, page_size=2).sync_users()
+        assert stats == {"created": 2, "updated": 0, "unchanged": 0, "skipped": 1}
+        user = User.objects.get(username="chester")
+        assert user.first_name == "Chester"
+        assert user.email == "chester@test.com"
+        assert user.is_staff
+        assert not user.has_usable_password()
+        # user_find and one batch request per page
+        assert directory_session.make_session_request.call_count == 3
+
+    def test_sync_users_updates_changed_only(self, db, directory_session):
+        User.objects.create(username="chester", first_name="Old", is_staff=True)
+        User.objects.create(username="lester", first_name="Lester", last_name="Tester",
+                            email="lester@test.com", is_staff=True)
+        stats = DirectorySync(FreeIpaRpcAuthBackend(), directory_session).sync_users()
+        assert stats["updated"] == 1
+        assert stats["unchanged"] == 1
+        assert User.objects.get(username="chester").first_name == "Chester"
+
+    @override_settings(FREEIPA_AUTH_UPDATE_USER_GROUPS=True)
+    def test_sync_users_memberships(self, db, directory_session, test_group, test_group2):
+        lester = User.objects.create(username="lester")
+        lester.groups.add(test_group)
+        DirectorySync(FreeIpaRpcAuthBackend(), directory_session).sync_users()
+        chester = User.objects.get(username="chester")
+        assert set(chester.groups.all()) == {test_group, test_group2}
+        assert list(lester.groups.all()) == [test_group2]
+
+    def test_truncated_listing(self, db, directory_session):
+        directory_session.make_session_request = mock.Mock(return_value={
+            "result": {"result": [{"uid": ["chester"]}], "truncated": True}
+        })
+        with pytest.raises(DirectoryTruncated):
+            DirectorySync(FreeIpaRpcAuthBackend(), directory_session).sync_users()
+        assert not User.objects.filter(username="chester").exists()
+
+    def test_sync_groups(self, db, directory_session, test_group):
+        assert DirectorySync(FreeIpaRpcAuthBackend(), directory_session).sync_groups() == 1
+        assert Group.objects.filter(name="new_group").exists()
+
+
+class TestFreeIpaSyncCommand:
+
+    @override_settings(FREEIPA_AUTH_SERVICE_USER="django-sync")
+    def test_command(self, db, directory_session):
+        out = StringIO()
+        with mock.patch.object(FreeIpaRpcAuthBackend, "get_service_session",
+                               return_value=directory_session):
+            call_command("freeipa_sync", "--create-groups", stdout=out)
+        assert "Created 2 groups" in out.getvalue()
+        assert "Created 2, updated 0, unchanged 0, skipped 1 users" in out.getvalue()
+
+    @override_settings(FREEIPA_AUTH_SERVICE_USER="django-sync")
+    def test_command_truncated(self, db, directory_session):
+        directory_session.make_session_request = mock.Mock(return_value={
+            "result": {"result": [], "truncated": True}
+        })
+        with mock.patch.object(FreeIpaRpcAuthBackend, "get_service_session",
+                               return_value=directory_session):
+            with pytest.raises(CommandError):
+                call_command("freeipa_sync", stdout=StringIO())
+
+    @override_settings(FREEIPA_AUTH_SERVICE_USER="django-sync")
+    def test_command_incremental_refuses_local_cache(self, db, directory_session):
+        with mock.patch.object(FreeIpaRpcAuthBackend, "get_service_session",
+                               return_value=directory_session):
+            with pytest.raises(CommandError):
+                call_command("freeipa_sync", "--incremental", stdout=StringIO())
+        directory_session.make_session_request.assert_not_called()
+
+    @override_settings(FREEIPA_AUTH_SERVICE_USER="django-sync")
+    def test_command_incremental_state_file(self, db, directory_session, tmp_path):
+        state_file = str(tmp_path / "high_water_mark")
+        out = StringIO()
+        with mock.patch.object(FreeIpaRpcAuthBackend, "get_service_session",
+                               return_value=directory_session):
+            call_command("freeipa_sync", "--incremental", "--state-file", state_file,
+                         stdout=out)
+        assert "Created 2, updated 0, unchanged 0, skipped 1 users" in out.getvalue()
+
+
+class TestFreeIpaRefreshCommand:
+
+    def create_user(self, username, last_login, usable_password=False):
+        user = User(username=username, last_login=last_login)
+        if usable_password:
+            user.set_password("local")
+        else:
+            user.set_unusable_password()
+        user.save()
+        return user
+
+    def test_get_active_usernames(self, db):
+        now = timezone.now()
+        self.create_user("chester", now)
+        self.create_user("lester", now - datetime.timedelta(days=3))
+        self.create_user("local", now, usable_password=True)
+        self.create_user("never", None)
+        assert get_active_usernames(now - datetime.timedelta(days=1)) == ["chester"]
+
+    @override_settings(FREEIPA_AUTH_SERVICE_USER="django-sync",
+                       FREEIPA_AUTH_UPDATE_USER_GROUPS=True)
+    def test_command_refreshes_active_users(self, db, directory_session, test_group, test_group2):
+        now = timezone.now()
+        chester = self.create_user("chester", now)
+        lester = self.create_user("lester", now - datetime.timedelta(days=3))
+        out = StringIO()
+        with mock.patch.object(FreeIpaRpcAuthBackend, "get_service_session",
+                               return_value=directory_session):
+            call_command("freeipa_refresh", "--active-hours", "24", stdout=out)
+        assert "Refreshed users: updated 1, unchanged 0, skipped 0" in out.getvalue()
+        chester.refresh_from_db()
+        assert chester.first_name == "Chester"
+        assert set(chester.groups.all()) == {test_group, test_group2}
+        lester.refresh_from_db()
+        assert lester.first_name == ""
+        # Only the active user was read
+        assert directory_session.make_session_request.call_count == 1
+
+    @mock.patch('freeipa_auth.management.commands.freeipa_refresh.logger.exception')
+    @mock.patch('time.sleep', side_effect=[None, KeyboardInterrupt])
+    def test_command_interval_survives_failed_refresh(self, sleep, log_exception, db):
+        out = StringIO()
+        with mock.patch.object(FreeIpaRpcAuthBackend, "get_service_session",
+                               side_effect=ImproperlyConfigured) as get_service_session:
+            with pytest.raises(KeyboardInterrupt):
+                call_command("freeipa_refresh", "--interval", "60", stdout=out)
+        assert get_service_session.call_count == 2
+        assert log_exception.call_count == 2
+
+
+class TestGetServiceSession:
+
+    def test_requires_service_user(self):
+        with pytest.raises(ImproperlyConfigured):
+            FreeIpaRpcAuthBackend().get_service_session()
+
+
+class TestIncrementalDirectorySync:
+
+    def session_with(self, records):
+        records = dict((record["uid"][0], record) for record in records)
+
+        def make_session_request(post_data):
+            if post_data["method"] == "user_find":
+                return {"result": {"result": [
+                    {"uid": record["uid"], "modifytimestamp": record["modifytimestamp"]}
+                    for record in records.values()
+                ]}}
+            return {"result": {"results": [
+                {"result": records[call["params"][0][0]], "error": None}
+                for call in post_data["item"]
+            ]}}
+
+        session = FreeIpaSession("ipa.foo.com")
+        session.make_session_request = mock.Mock(side_effect=make_session_request)
+        return session
+
+    def test_get_modify_timestamp(self):
+        assert get_modify_timestamp({"modifytimestamp": [{"__datetime__": "20240101000000Z"}]}) == "20240101000000Z"
+        assert get_modify_timestamp({"modifytimestamp": ["20240101000000Z"]}) == "20240101000000Z"
+        assert get_modify_timestamp({}) is None
+
+    def test_only_applies_users_modified_since_last_run(self, db, request):
+        request.addfinalizer(cache.clear)
+        backend = FreeIpaRpcAuthBackend()
+        chester = dict(DIRECTORY["chester"], modifytimestamp=[{"__datetime__": "20240102000000Z"}])
+        lester = dict(DIRECTORY["lester"], modifytimestamp=[{"__datetime__": "20240101000000Z"}])
+
+        stats = IncrementalDirectorySync(backend, self.session_with([chester, lester])).sync_users()
+        assert stats["created"] == 2
+
+        chester = dict(chester, givenname=["Chet"], modifytimestamp=[{"__datetime__": "20240103000000Z"}])
+        lester = dict(lester, givenname=["Les"])
+        directory_sync = IncrementalDirectorySync(backend, self.session_with([chester, lester]))
+        stats = directory_sync.sync_users()
+        assert stats == {"created": 0, "updated": 1, "unchanged": 1, "skipped": 0}
+        assert User.objects.get(username="chester").first_name == "Chet"
+        assert User.objects.get(username="lester").first_name == "Lester"
+        assert directory_sync.get_high_water_mark() == "20240103000000Z"
+        # Only the changed user was read
+        user_show = directory_sync.session.make_session_request.call_args_list[-1][0][0]
+        assert [call["params"][0] for call in user_show["item"]] == [["chester"]]
+
+    def test_listing_without_members(self, db, request):
+        request.addfinalizer(cache.clear)
+        directory_sync = IncrementalDirectorySync(FreeIpaRpcAuthBackend(), self.session_with([]))
+        directory_sync.sync_users()
+        listing = directory_sync.session.make_session_request.call_args[0][0]
+        assert listing["params"] == {"all": True, "no_members": True, "sizelimit": 0}
+
+    def test_reapplies_second_of_high_water_mark(self, db, request):
+        """
+        Asserts that a change made in the same second as the last run,
+        after its listing, is still applied.
+        """
+        request.addfinalizer(cache.clear)
+        backend = FreeIpaRpcAuthBackend()
+        chester = dict(DIRECTORY["chester"], modifytimestamp=[{"__datetime__": "20240102000000Z"}])
+        IncrementalDirectorySync(backend, self.session_with([chester])).sync_users()
+
+        chester = dict(chester, givenname=["Chet"])
+        stats = IncrementalDirectorySync(backend, self.session_with([chester])).sync_users()
+        assert stats["updated"] == 1
+        assert User.objects.get(username="chester").first_name == "Chet"
+
+    def test_state_file(self, db, tmp_path):
+        state_file = str(tmp_path / "high_water_mark")
+        directory_sync = IncrementalDirectorySync(FreeIpaRpcAuthBackend(), self.session_with([]),
+                                                  state_file=state_file)
+        assert directory_sync.is_state_durable()
+        assert directory_sync.get_high_water_mark() is None
+        directory_sync.set_high_water_mark("20240103000000Z")
+        assert IncrementalDirectorySync(FreeIpaRpcAuthBackend(), self.session_with([]),
+                                        state_file=state_file).get_high_water_mark() == "20240103000000Z"
+        directory_sync.reset()
+        assert directory_sync.get_high_water_mark() is None
+        directory_sync.reset()
+
+    def test_local_cache_not_durable(self):
+        directory_sync = IncrementalDirectorySync(FreeIpaRpcAuthBackend(), self.session_with([]))
+        assert not directory_sync.is_state_durable()
+
+    def test_reset(self, db, request):
+        request.addfinalizer(cache.clear)
+        directory_sync = IncrementalDirectorySync(FreeIpaRpcAuthBackend(), self.session_with([]))
+        directory_sync.set_high_water_mark("20240103000000Z")
+        directory_sync.reset()
+        assert directory_sync.get_high_water_mark() is None
@@ -0,0 +1,114 @@
+import pytest
+
+from unittest import mock
+from django.contrib.auth import authenticate
+from django.core.cache import cache
+from django.core.exceptions import PermissionDenied
+from django.test import RequestFactory, override_settings
+
+from freeipa_auth.backends import FreeIpaRpcAuthBackend
+from freeipa_auth.metrics import metrics
+from freeipa_auth.throttling import LoginThrottle
+
+
+@pytest.fixture
+def clear_cache(request):
+    """Fixture emptying the throttle buckets after each test"""
+    request.addfinalizer(cache.clear)
+
+
+class TestLoginThrottle:
+    def test_burst_then_reject(self, clear_cache):
+        throttle = LoginThrottle('username', 60, 3)
+        assert [throttle.allow('chester', now=0) for _ in range(4)] == [
+            True, True, True, False
+        ]
+
+    def test_next_window(self, clear_cache):
+        throttle = LoginThrottle('username', 60, 1)
+        assert throttle.allow('chester', now=0)
+        assert not throttle.allow('chester', now=0.5)
+        assert throttle.allow('chester', now=1.5)
+
+    def test_window_allows_burst(self, clear_cache):
+        throttle = LoginThrottle('username', 60, 2)
+        assert throttle.allow('chester', now=0)
+        assert [throttle.allow('chester', now=1000) for _ in range(3)] == [
+            True, True, False
+        ]
+
+    def test_window_matches_rate(self, clear_cache):
+        throttle = LoginThrottle('username', 5, 10)
+        assert all(throttle.allow('chester', now=0) for _ in range(10))
+        assert not throttle.allow('chester', now=119)
+        assert throttle.allow('chester', now=120)
+
+    def test_evicted_counter(self, clear_cache):
+        throttle = LoginThrottle('username', 60, 1)
+
+        def evict(key):
+            throttle.cache.delete(key)
+            raise ValueError(key)
+
+        with mock.patch.object(throttle.cache, 'incr', side_effect=evict):
+            assert throttle.allow('chester', now=0)
+        assert not throttle.allow('chester', now=0)
+
+    def test_buckets_per_ident_and_scope(self, clear_cache):
+        throttle = LoginThrottle('username', 60, 1)
+        assert throttle.allow('chester', now=0)
+        assert throttle.allow('tester', now=0)
+        assert LoginThrottle('ip', 60, 1).allow('chester', now=0)
+
+    def test_reset(self, clear_cache):
+        throttle = LoginThrottle('username', 60, 1)
+        assert throttle.allow('chester', now=0)
+        throttle.reset('chester', now=0)
+        assert throttle.allow('chester', now=0)
+
+
+class TestBackendThrottling:
+    username = "dummy_freeipa_username"
+    password = "dummy_freeipa_password"
+
+    @override_settings(
+        FREEIPA_AUTH_SERVER="ipa.foo.com",
+        FREEIPA_AUTH_THROTTLE_USERNAME_RATE=1,
+        FREEIPA_AUTH_THROTTLE_USERNAME_BURST=2,
+    )
+    @mock.patch('freeipa_auth.backends.FreeIpaSession')
+    def test_username_throttled_before_session(self, mock_freeipa, db, clear_cache, request):
+        request.addfinalizer(lambda: metrics.configure(None))
+        metrics.configure('freeipa_auth.metrics.InMemoryMetricsSink')
+        mock_freeipa.return_value.authenticate.return_value = mock.Mock(status_code=401)
+        backend = FreeIpaRpcAuthBackend()
+        for _ in range(2):
+            backend.authenticate(username=self.username, password=self.password)
+        with pytest.raises(PermissionDenied):
+            backend.authenticate(username=self.username, password=self.password)
+        assert mock_freeipa.call_count == 2
+        assert metrics.sink.get_count('freeipa_auth_throttled_total',
+                                      scope='username') == 1
+
+    @override_settings(
+        FREEIPA_AUTH_SERVER="ipa.foo.com",
+        FREEIPA_AUTH_THROTTLE_IP_RATE=1,
+        FREEIPA_AUTH_THROTTLE_IP_BURST=1,
+        AUTHENTICATION_BACKENDS=[
+            'freeipa_auth.backends.FreeIpaRpcAuthBackend',
+            'django.contrib.auth.backends.ModelBackend',
+        ],
+    )
+    @mock.patch('freeipa_auth.backends.FreeIpaSession')
+    def test_ip_throttled(self, mock_freeipa, db, clear_cache):
+        mock_freeipa.return_value.authenticate.return_value = mock.Mock(status_code=401)
+        request = RequestFactory().post('/login/', REMOTE_ADDR='10.0.0.1')
+        assert authenticate(request, username="one", password=self.password) is None
+        with mock.patch('django.contrib.auth.backends.ModelBackend.authenticate') as model_backend:
+            assert authenticate(request, username="two", password=self.password) is None
+            model_backend.assert_not_called()
+        assert mock_freeipa.call_count == 1
+
+        other = RequestFactory().post('/login/', REMOTE_ADDR='10.0.0.2')
+        authenticate(other, username="three", password=self.password)
+        assert mock_freeipa.call_count == 2
@@ -0,0 +1,78 @@
+import hashlib
+import logging
+import math
+import time
+
+from django.core.cache import caches
+from django.utils.encoding import force_bytes
+
+logger = logging.getLogger(__name__)
+
+
+class LoginThrottle(object):
+
+    """
+    Counter of login attempts per identifier, e.g. username or client ip,
+    kept in the django cache so every worker shares it. Attempts are
+    counted in fixed windows of burst / rate minutes, each allowing burst
+    attempts, which averages out at rate attempts per minute. Counters
+    only use the cache's atomic add and incr, so no lock is held across
+    cache round trips.
+    """
+
+    key_prefix = 'freeipa_auth:throttle:'
+
+    def __init__(self, scope, rate, burst, alias='default'):
+        """
+        :param scope: name of the identifier, e.g. username or ip
+        :param rate: attempts allowed per minute on average
+        :param burst: attempts allowed at once
+        :param alias: django cache alias
+        """
+        self.scope = scope
+        self.burst = burst
+        self.window = burst * 60.0 / rate
+        self.timeout = int(math.ceil(self.window)) + 1
+        self.cache = caches[alias]
+
+    def _key(self, ident, now):
+        digest = hashlib.sha256(force_bytes(ident)).hexdigest()
+        return '{prefix}{scope}:{digest}:{window}'.format(
+            prefix=self.key_prefix, scope=self.scope, digest=digest,
+            window=int(now // self.window))
+
+    def allow(self, ident, now=None):
+        """
+        Count an attempt
+        :param ident: identifier, e.g. the username
+        :param now: timestamp, defaults to the current time
+        :return: True if the attempt may proceed
+        """
+        now = time.time() if now is None else now
+        key = self._key(ident, now)
+        # add only creates the counter if it is missing
+        self.cache.add(key, 0, self.timeout)
+        try:
+            attempts = self.cache.incr(key)
+        except ValueError:
+            # Evicted between add and incr
+            self.cache.add(key, 1, self.timeout)
+            attempts = 1
+        return attempts <= self.burst
+
+    def reset(self, ident, now=None):
+        """Forget the attempts, e.g. after an administrator unlocked a user"""
+        now = time.time() if now is None else now
+        self.cache.delete(self._key(ident, now))
+
+
+def get_client_ip(request):
+    """
+    Returns the client ip of a request. Behind a proxy REMOTE_ADDR must be
+    set from the forwarded header by a trusted middleware.
+    :param request: django request or None
+    :return: string or None
+    """
+    if request is None:
+        return None
+    return getattr(request, 'META', {}).get('REMOTE_ADDR')
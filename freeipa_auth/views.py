@@ -0,0 +1,16 @@
+from django.http import Http404, HttpResponse
+
+from freeipa_auth.metrics import get_sink
+
+
+def metrics_view(request):
+    """
+    Expose the auth pipeline metrics to Prometheus. Requires
+    FREEIPA_AUTH_METRICS_SINK to be a PrometheusMetricsSink, other sinks
+    answer 404. The view does no authentication of its own.
+    """
+    render = getattr(get_sink(), 'render', None)
+    if render is None:
+        raise Http404("FREEIPA_AUTH_METRICS_SINK cannot be rendered")
+    return HttpResponse(render(),
+                        content_type='text/plain; version=0.0.4')
@@ -19,6 +19,8 @@ setup(
     install_requires=['requests', 'Django >= 2.2.0'],
     extras_require={
         'security': ['pyOpenSSL >= 0.14', 'cryptography>=1.3.4', 'idna>=2.0.0'],
+        'async': ['httpx'],
+        'fast': ['orjson'],
     },
     author="Kris Anderson",
     author_email="kris@enervee.com",